@@ -2,6 +2,8 @@
 ASGI config for alx_backend_graphql_crm project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; websockets to ``/graphql/`` carry GraphQL subscriptions
+(see ``alx_backend_graphql.subscriptions``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
@@ -13,4 +15,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imports models: only once get_asgi_application() has set Django up
+from alx_backend_graphql.subscriptions import GraphQLWebSocketApp  # noqa: E402
+
+websocket_application = GraphQLWebSocketApp()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,179 @@
+"""
+Batched requests: a JSON array of operations POSTed to ``/graphql/`` at once.
+
+    [{"id": 1, "query": "{ allProducts { ... } }"}, {"id": 2, "query": "mutation { ... }"}]
+
+The response is an array in the same order, each item with its ``id`` and
+its own ``status``; the HTTP status is the worst of them. Every operation
+goes through the same checks as a single request (persisted queries, cost
+limits, response cache), but they share the request context: DataLoader
+batches and the rows they cached carry over from one operation to the
+next, and are dropped after each mutation so later reads see its writes.
+
+- Operations run in order. With ``GRAPHQL_BATCH_THREADS`` > 0, each run of
+  consecutive queries goes to a thread pool instead; a mutation still runs
+  after every operation before it and before every one after it.
+- By default every operation commits on its own and a failure only affects
+  its own item. With the ``X-GraphQL-Batch-Atomic: true`` header the whole
+  batch runs in one transaction (and one thread): the first operation to
+  fail rolls everything back, the operations after it are skipped and every
+  other item reports the rollback.
+"""
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from django.conf import settings
+from django.db import connections, transaction
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphql import ExecutionResult, GraphQLError, OperationType, get_operation_ast
+
+from crm.loaders import Loaders
+
+ATOMIC_HEADER = 'HTTP_X_GRAPHQL_BATCH_ATOMIC'
+DEFAULT_MAX_SIZE = 20
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(threads):
+    """A process-wide pool of ``threads`` workers, kept across requests
+    along with their database connections."""
+    with _pools_lock:
+        if threads not in _pools:
+            _pools[threads] = ThreadPoolExecutor(threads, thread_name_prefix='graphql-batch')
+        return _pools[threads]
+
+
+def release_connections():
+    """After a task in a worker: pooled connections go back to the pool;
+    others stay open for the worker's next task unless they broke.
+
+    Closing them like a request thread would (``CONN_MAX_AGE`` = 0) makes
+    every task reconnect, which costs more than the parallelism saves.
+    """
+    for connection in connections.all(initialized_only=True):
+        if connection.settings_dict['OPTIONS'].get('pool') or (
+            connection.errors_occurred and not connection.is_usable()
+        ):
+            connection.close()
+
+
+def batch_limits():
+    return (
+        getattr(settings, 'GRAPHQL_BATCH_MAX_SIZE', DEFAULT_MAX_SIZE),
+        getattr(settings, 'GRAPHQL_BATCH_THREADS', 0),
+    )
+
+
+def wants_atomic(request):
+    return request.META.get(ATOMIC_HEADER, '').lower() in ('1', 'true')
+
+
+class Operation:
+    """One entry of a batch and, once it has run, its result."""
+
+    def __init__(self, index, data, kind):
+        self.index = index
+        self.data = data
+        self.kind = kind
+        self.request = None
+        self.id = data.get('id')
+        self.result = None
+
+    @property
+    def failed(self):
+        return bool(self.result.errors) or getattr(self.request, MUTATION_ERRORS_FLAG, False) is True
+
+    def fail(self, message):
+        self.result = ExecutionResult(errors=[GraphQLError(message)])
+
+
+class BatchExecutor:
+    def __init__(self, view, request, entries, atomic=False, threads=0):
+        self.view = view
+        self.request = request
+        self.atomic = atomic
+        self.threads = 0 if atomic else threads
+        self.operations = [Operation(i, data, self.operation_type(data)) for i, data in enumerate(entries)]
+
+    def operation_type(self, data):
+        """``OperationType`` of an entry, or ``None`` if it can't be told
+        without running it (e.g. a persisted query sent by hash)."""
+        query = data.get('query')
+        if not isinstance(query, str):
+            return None
+        try:
+            document, _ = self.view.get_document(query)
+        except Exception:
+            return None
+        operation = get_operation_ast(document, data.get('operationName'))
+        return operation.operation if operation is not None else None
+
+    def run(self):
+        """Execute the batch; returns the operations with their results, in order."""
+        self.request.loaders = Loaders()
+        if self.atomic:
+            self.run_atomic()
+            return self.operations
+        queries = []
+        for operation in self.operations:
+            if self.threads and operation.kind == OperationType.QUERY:
+                queries.append(operation)
+                continue
+            self.run_concurrently(queries)
+            queries = []
+            self.execute(operation)
+        self.run_concurrently(queries)
+        return self.operations
+
+    def run_atomic(self):
+        with transaction.atomic():
+            failed = None
+            for operation in self.operations:
+                if failed is not None:
+                    operation.fail(f"Not executed: operation {failed.index} of the batch failed")
+                    continue
+                self.execute(operation)
+                if operation.failed:
+                    failed = operation
+                    transaction.set_rollback(True)
+        if failed is not None:
+            for operation in self.operations[:failed.index]:
+                operation.fail(f"Rolled back: operation {failed.index} of the batch failed")
+
+    def run_concurrently(self, operations):
+        if len(operations) < 2:
+            for operation in operations:
+                self.execute(operation)
+            return
+        pool = get_pool(self.threads)
+        # Each task gets a copy of this context, not the worker's leftovers
+        futures = [pool.submit(copy_context().run, self.execute_in_worker, op) for op in operations]
+        for future in futures:
+            future.result()
+
+    def execute_in_worker(self, operation):
+        try:
+            self.execute(operation)
+        finally:
+            release_connections()
+
+    def execute(self, operation):
+        # Per-operation attributes (trace, cache entry, error flag) stay on the
+        # copy; the loaders are shared
+        operation.request = copy.copy(self.request)
+        try:
+            query, variables, operation_name, operation.id = self.view.get_graphql_params(
+                operation.request, operation.data
+            )
+            operation.result = self.view.execute_graphql_request(
+                operation.request, operation.data, query, variables, operation_name
+            )
+        except Exception as e:
+            operation.result = ExecutionResult(errors=[e])
+        if operation.kind != OperationType.QUERY:
+            # Later operations must not be served rows cached before these writes
+            self.request.loaders = Loaders()
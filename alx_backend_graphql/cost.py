@@ -0,0 +1,151 @@
+"""
+Static cost and depth analysis of GraphQL operations.
+
+Runs on the parsed document before execution, so an over-budget query is
+rejected without touching the database. Costs approximate the rows a query
+can touch: every field that resolves to an object costs 1 (leaves and the
+relay ``edges``/``node``/``pageInfo`` wrappers are free) and whatever sits
+under a connection's ``edges`` is multiplied by its page size.
+"""
+from dataclasses import dataclass
+
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, GraphQLInt, GraphQLObjectType,
+    InlineFragmentNode, get_named_type, get_nullable_type, is_leaf_type, is_list_type, type_from_ast, value_from_ast,
+)
+from graphql.language import OperationDefinitionNode
+
+DEFAULT_MAX_QUERY_DEPTH = 15
+DEFAULT_MAX_QUERY_COST = 50000
+# Assumed length of plain (non-connection) lists such as ``OrderType.lines``
+DEFAULT_LIST_SIZE = 10
+
+
+@dataclass
+class QueryCost:
+    cost: int
+    depth: int
+
+
+class QueryCostError(GraphQLError):
+    def __init__(self, message, code):
+        super().__init__(message, extensions={'code': code})
+
+
+def is_connection(type_):
+    return isinstance(type_, GraphQLObjectType) and 'edges' in type_.fields and 'pageInfo' in type_.fields
+
+
+def is_edge(type_):
+    return isinstance(type_, GraphQLObjectType) and 'node' in type_.fields and 'cursor' in type_.fields
+
+
+class CostAnalyzer:
+    def __init__(self, schema, document, variables=None, field_costs=None,
+                 page_size=None, list_size=DEFAULT_LIST_SIZE):
+        self.schema = schema
+        self.fragments = {d.name.value: d for d in document.definitions if isinstance(d, FragmentDefinitionNode)}
+        self.variables = dict(variables or {})
+        self.field_costs = field_costs or {}
+        self.page_size = page_size if page_size is not None else graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        self.list_size = list_size
+
+    def analyze(self, operation):
+        for definition in operation.variable_definitions or ():
+            name = definition.variable.name.value
+            if name not in self.variables and definition.default_value is not None:
+                self.variables[name] = value_from_ast(
+                    definition.default_value, type_from_ast(self.schema, definition.type)
+                )
+        root_type = self.schema.get_root_type(operation.operation)
+        cost, depth = self.selection_cost(root_type, operation.selection_set)
+        return QueryCost(cost=cost, depth=depth)
+
+    def fields(self, parent_type, selection_set, visited=()):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield parent_type, selection
+            elif isinstance(selection, InlineFragmentNode):
+                condition = selection.type_condition
+                type_ = self.schema.get_type(condition.name.value) if condition else parent_type
+                yield from self.fields(type_, selection.selection_set, visited)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is not None and name not in visited:
+                    type_ = self.schema.get_type(fragment.type_condition.name.value)
+                    yield from self.fields(type_, fragment.selection_set, (*visited, name))
+
+    def selection_cost(self, parent_type, selection_set, page_size=None):
+        """``(cost, depth)`` of a selection set on ``parent_type``."""
+        cost = depth = 0
+        for type_, node in self.fields(parent_type, selection_set):
+            field_cost, field_depth = self.field_cost(type_, node)
+            if page_size is not None and node.name.value == 'edges':
+                field_cost *= page_size
+            cost += field_cost
+            depth = max(depth, field_depth)
+        return cost, depth
+
+    def field_cost(self, parent_type, node):
+        name = node.name.value
+        field = getattr(parent_type, 'fields', {}).get(name)
+        if field is None or name.startswith('__'):
+            return 0, 0
+        type_ = get_named_type(field.type)
+        default = 0 if is_leaf_type(type_) or is_connection(parent_type) or is_edge(parent_type) else 1
+        cost = self.field_costs.get(f'{parent_type.name}.{name}', self.field_costs.get(name, default))
+        if node.selection_set is None:
+            return cost, 1
+
+        if is_connection(type_):
+            child_cost, child_depth = self.selection_cost(type_, node.selection_set, self.connection_size(node))
+        else:
+            child_cost, child_depth = self.selection_cost(type_, node.selection_set)
+            if is_list_type(get_nullable_type(field.type)) and not is_connection(parent_type):
+                child_cost *= self.list_size
+        return cost + child_cost, child_depth + 1
+
+    def connection_size(self, node):
+        sizes = []
+        for argument in node.arguments:
+            if argument.name.value in ('first', 'last'):
+                value = value_from_ast(argument.value, GraphQLInt, self.variables)
+                if isinstance(value, int) and not isinstance(value, bool):
+                    sizes.append(max(value, 0))
+        return max(sizes) if sizes else self.page_size
+
+
+def analyze_query(schema, document, operation, variables=None):
+    """The ``QueryCost`` of ``operation`` with the costs from settings."""
+    if not isinstance(operation, OperationDefinitionNode):
+        return QueryCost(cost=0, depth=0)
+    analyzer = CostAnalyzer(schema, document, variables, getattr(settings, 'GRAPHQL_FIELD_COSTS', None))
+    return analyzer.analyze(operation)
+
+
+def check_query_cost(query_cost):
+    """Raise ``QueryCostError`` if ``query_cost`` is over the configured limits."""
+    max_depth = getattr(settings, 'GRAPHQL_MAX_QUERY_DEPTH', DEFAULT_MAX_QUERY_DEPTH)
+    max_cost = getattr(settings, 'GRAPHQL_MAX_QUERY_COST', DEFAULT_MAX_QUERY_COST)
+    if max_depth is not None and query_cost.depth > max_depth:
+        raise QueryCostError(
+            f"Query depth {query_cost.depth} exceeds the maximum of {max_depth}", 'QUERY_TOO_DEEP'
+        )
+    if max_cost is not None and query_cost.cost > max_cost:
+        raise QueryCostError(
+            f"Query cost {query_cost.cost} exceeds the maximum of {max_cost}", 'QUERY_TOO_EXPENSIVE'
+        )
+
+
+def cost_extension(query_cost):
+    return {
+        'cost': {
+            'requested': query_cost.cost,
+            'maximum': getattr(settings, 'GRAPHQL_MAX_QUERY_COST', DEFAULT_MAX_QUERY_COST),
+            'depth': query_cost.depth,
+            'maxDepth': getattr(settings, 'GRAPHQL_MAX_QUERY_DEPTH', DEFAULT_MAX_QUERY_DEPTH),
+        }
+    }
@@ -0,0 +1,162 @@
+"""
+Parsed-document cache and automatic persisted queries (APQ) for /graphql/.
+
+Parsing and validating a query costs far more than looking it up, and
+clients send the same handful of documents over and over, so validated
+documents are kept in an LRU keyed by the sha256 of the query text.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import GraphQLError, parse, print_schema, validate
+
+DEFAULT_DOCUMENT_CACHE_SIZE = 1000
+PERSISTED_QUERY_PREFIX = 'graphql:apq:'
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class DocumentCache:
+    """Thread-safe LRU of validated documents by query hash."""
+
+    def __init__(self, maxsize=DEFAULT_DOCUMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema, query, validation_rules=None, max_errors=None):
+        """Return the parsed document and its validation errors.
+
+        Raises ``GraphQLError`` on syntax errors, like ``graphql.parse``.
+        Only documents that validate cleanly are cached, so garbage queries
+        can't push real ones out.
+        """
+        key = query_hash(query)
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return document, []
+            self.misses += 1
+
+        document = parse(query)
+        errors = validate(schema, document, validation_rules, max_errors)
+        if not errors and self.maxsize > 0:
+            with self._lock:
+                self._documents[key] = document
+                self._documents.move_to_end(key)
+                while len(self._documents) > self.maxsize:
+                    self._documents.popitem(last=False)
+        return document, errors
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._documents),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_document_cache = None
+
+
+def get_document_cache():
+    global _document_cache
+    if _document_cache is None:
+        _document_cache = DocumentCache(
+            getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', DEFAULT_DOCUMENT_CACHE_SIZE)
+        )
+    return _document_cache
+
+
+def reset_document_cache():
+    """Drop the shared cache; the next lookup rebuilds it from settings."""
+    global _document_cache
+    _document_cache = None
+
+
+class PersistedQueryNotFound(GraphQLError):
+    def __init__(self):
+        super().__init__('PersistedQueryNotFound', extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'})
+
+
+class PersistedQueryRegistry:
+    """Known documents by sha256, stored in a Django cache so workers share them."""
+
+    def __init__(self, cache_alias='default'):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def register(self, query):
+        sha = query_hash(query)
+        self.cache.set(PERSISTED_QUERY_PREFIX + sha, query, timeout=None)
+        return sha
+
+    def lookup(self, sha):
+        return self.cache.get(PERSISTED_QUERY_PREFIX + sha)
+
+    def resolve(self, query, extensions):
+        """Turn an APQ request into a query string.
+
+        - hash only: return the registered query or raise
+          ``PersistedQueryNotFound`` so the client retries with the text;
+        - hash and query: check the hash and register the query.
+
+        Request extensions that aren't shaped like that raise ``GraphQLError``.
+        """
+        if extensions is not None and not isinstance(extensions, dict):
+            raise GraphQLError('Extensions must be a JSON object', extensions={'code': 'BAD_REQUEST'})
+        persisted = (extensions or {}).get('persistedQuery')
+        if not persisted:
+            return query
+        if not isinstance(persisted, dict) or persisted.get('version') != 1:
+            raise GraphQLError('Unsupported persisted query version',
+                               extensions={'code': 'PERSISTED_QUERY_NOT_SUPPORTED'})
+        sha = persisted.get('sha256Hash')
+        if sha is not None and not isinstance(sha, str):
+            raise GraphQLError('sha256Hash must be a string', extensions={'code': 'PERSISTED_QUERY_NOT_SUPPORTED'})
+        if query:
+            if query_hash(query) != sha:
+                raise GraphQLError('provided sha does not match query',
+                                   extensions={'code': 'PERSISTED_QUERY_HASH_MISMATCH'})
+            self.register(query)
+            return query
+        query = self.lookup(sha) if sha else None
+        if query is None:
+            raise PersistedQueryNotFound()
+        return query
+
+
+def get_persisted_query_registry():
+    return PersistedQueryRegistry(getattr(settings, 'GRAPHQL_PERSISTED_QUERIES_CACHE', 'default'))
+
+
+@lru_cache(maxsize=None)
+def schema_sdl(schema):
+    return print_schema(schema)
+
+
+def schema_hash(schema):
+    """sha256 of the SDL; clients compare it against their cached copy."""
+    return query_hash(schema_sdl(schema))
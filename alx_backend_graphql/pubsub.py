@@ -0,0 +1,177 @@
+"""
+Publish/subscribe between the code that writes and the GraphQL subscriptions.
+
+Writers call ``publish(channel, message)``; it goes out once the current
+transaction commits, so a rolled-back write announces nothing. Readers
+``async with subscribe(channel) as messages`` in an event loop and iterate.
+
+Every process has one ``Hub`` holding its subscribers. A message is handed
+to each event loop with subscribers once, however many subscribers it has,
+and the loop fans it out to their queues. The ``GRAPHQL_PUBSUB_BACKEND``
+class carries messages from ``publish()`` to the hubs:
+
+- ``InProcessBackend`` (the default) delivers to this process's hub; right
+  when the ASGI process serving the websockets also runs the mutations.
+- With several processes, a backend publishes to a broker (Redis
+  ``PUBLISH``, PostgreSQL ``NOTIFY``) and has one listener per process
+  passing what it receives to ``hub.deliver``. Messages are therefore kept
+  JSON-serializable.
+
+A subscriber that falls more than ``max_queue`` messages behind is cut off
+with ``SubscriptionOverflow`` rather than buffered without end.
+"""
+import asyncio
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'alx_backend_graphql.pubsub.InProcessBackend'
+DEFAULT_MAX_QUEUE = 1000
+
+
+class SubscriptionOverflow(Exception):
+    pass
+
+
+class Subscription:
+    """One subscriber's messages on one channel, read in its event loop."""
+
+    def __init__(self, hub, channel, loop, max_queue=DEFAULT_MAX_QUEUE):
+        self.hub = hub
+        self.channel = channel
+        self.loop = loop
+        self.max_queue = max_queue
+        self.messages = deque()
+        self.overflowed = False
+        self.closed = False
+        self._ready = asyncio.Event()
+
+    def put(self, message):
+        # In the subscriber's loop
+        if len(self.messages) >= self.max_queue:
+            self.overflowed = True
+        else:
+            self.messages.append(message)
+        self._ready.set()
+
+    async def get(self):
+        while True:
+            if self.overflowed:
+                raise SubscriptionOverflow(f"Subscriber fell more than {self.max_queue} messages behind")
+            if self.messages:
+                return self.messages.popleft()
+            if self.closed:
+                raise StopAsyncIteration
+            self._ready.clear()
+            await self._ready.wait()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.hub.unsubscribe(self)
+            self._ready.set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+def fan_out(subscriptions, message):
+    for subscription in subscriptions:
+        if not subscription.closed:
+            subscription.put(message)
+
+
+class Hub:
+    """The subscribers of this process, by channel and event loop."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # channel -> {loop: {Subscription}}
+        self._channels = {}
+
+    def subscribe(self, channel, max_queue=DEFAULT_MAX_QUEUE):
+        subscription = Subscription(self, channel, asyncio.get_running_loop(), max_queue)
+        with self._lock:
+            self._channels.setdefault(channel, {}).setdefault(subscription.loop, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            loops = self._channels.get(subscription.channel, {})
+            subscriptions = loops.get(subscription.loop, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                loops.pop(subscription.loop, None)
+            if not loops:
+                self._channels.pop(subscription.channel, None)
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._channels.get(channel, {}).values())
+
+    def deliver(self, channel, message):
+        """Hand ``message`` to every subscriber of ``channel``. Thread-safe."""
+        with self._lock:
+            targets = [(loop, tuple(subscriptions)) for loop, subscriptions in self._channels.get(channel, {}).items()]
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for loop, subscriptions in targets:
+            if loop is running:
+                fan_out(subscriptions, message)
+                continue
+            try:
+                loop.call_soon_threadsafe(fan_out, subscriptions, message)
+            except RuntimeError:
+                # The loop has closed; its subscribers are gone
+                pass
+
+
+hub = Hub()
+
+
+class InProcessBackend:
+    """Delivers straight to this process's hub."""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, channel, message):
+        self.hub.deliver(channel, message)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    path = getattr(settings, 'GRAPHQL_PUBSUB_BACKEND', DEFAULT_BACKEND)
+    with _backends_lock:
+        if path not in _backends:
+            _backends[path] = import_string(path)(hub)
+        return _backends[path]
+
+
+def publish(channel, message, using=DEFAULT_DB_ALIAS):
+    """Send ``message`` to the subscribers of ``channel`` once the current
+    transaction on ``using`` commits (right away outside one)."""
+    transaction.on_commit(lambda: get_backend().publish(channel, message), using=using)
+
+
+def subscribe(channel, max_queue=DEFAULT_MAX_QUEUE):
+    """A ``Subscription`` to ``channel`` for the running event loop; use it
+    as an async context manager so it is dropped when the reader stops."""
+    return hub.subscribe(channel, max_queue)
@@ -0,0 +1,305 @@
+"""
+Cache of whole query responses, invalidated by model writes.
+
+Entries are keyed on the normalized document (``print_ast``), operation
+name, variables, user and schema hash, and live in the Django cache named
+by ``GRAPHQL_RESPONSE_CACHE``. Each entry is tagged with the models whose
+types the operation selects, found statically from the document:
+
+- every tag has a version token in the cache; an entry records the tokens
+  it was computed under and is only served while they are all current;
+- ``invalidate()`` gives the tags of the written models new tokens once
+  the transaction commits. Watched models call it from their
+  ``post_save``/``post_delete``/``m2m_changed`` signals; bulk writes that
+  send no signals call it themselves.
+
+Tokens are read before the operation executes, so a write that commits
+while a response is being computed leaves that response stale on
+arrival instead of cached under the new token.
+
+An operation is only cached when every model it selects is watched and
+nothing is running inside a transaction, which may see uncommitted rows.
+Its lifetime is the smallest ``GRAPHQL_CACHE_CONTROL`` max-age hint among
+the fields it selects; root fields without a hint use
+``GRAPHQL_RESPONSE_CACHE_MAX_AGE``.
+
+Invalidations only reach the processes that share the cache. The default
+``LocMemCache`` is private to one process, so it is only right when that
+process makes every write. The job worker (``manage.py run_crm_worker``)
+writes in processes of its own, and its writes would stay invisible to
+the web process until the entries expire. The worker therefore refuses to
+start with a process-local response cache (``is_process_local()``): point
+``CACHES['graphql']`` at Redis or Memcached, or set
+``GRAPHQL_RESPONSE_CACHE=`` (empty) to turn the cache off.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from graphql import get_named_type, print_ast
+from graphql.language import OperationDefinitionNode
+
+from alx_backend_graphql.cost import CostAnalyzer
+from alx_backend_graphql.documents import schema_hash
+from alx_backend_graphql.metrics import registry
+
+DEFAULT_MAX_AGE = 60
+ENTRY_PREFIX = 'graphql:response:'
+TAG_PREFIX = 'graphql:tag:'
+
+LOOKUPS = registry.counter(
+    'graphql_response_cache_lookups_total', 'Response cache lookups by outcome.', ('result',)
+)
+INVALIDATIONS = registry.counter(
+    'graphql_response_cache_invalidations_total', 'Response cache tags invalidated.', ('tag',)
+)
+
+# Model -> tag; only operations touching these models are cached
+_tags = {}
+
+
+def model_tag(model):
+    return _tags.get(model)
+
+
+def watch(model, tag_model=None, signals=True):
+    """Cache responses that select ``model``, invalidating them on its writes.
+
+    ``tag_model`` shares another model's tag (e.g. rows owned by it).
+    ``signals=False`` only registers the tag: keep the model out of the
+    signals when it is deleted in bulk, since any ``post_delete`` receiver
+    makes Django fetch every row before deleting it.
+    """
+    _tags[model] = (tag_model or model)._meta.label_lower
+    if signals:
+        post_save.connect(invalidate_instance, sender=model, dispatch_uid=f'response_cache:{model._meta.label}')
+        post_delete.connect(invalidate_instance, sender=model, dispatch_uid=f'response_cache:{model._meta.label}')
+        for m2m in model._meta.local_many_to_many:
+            m2m_changed.connect(
+                invalidate_m2m, sender=m2m.remote_field.through, dispatch_uid=f'response_cache:{m2m}',
+            )
+
+
+def invalidate_instance(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    invalidate(sender, using=using)
+
+
+def invalidate_m2m(sender, instance, action, model, using=DEFAULT_DB_ALIAS, **kwargs):
+    if action.startswith('post_'):
+        invalidate(sender, type(instance), model, using=using)
+
+
+_pending = threading.local()
+
+
+def invalidate(*models, using=DEFAULT_DB_ALIAS):
+    """Expire cached responses that depend on ``models`` once the current
+    transaction on ``using`` commits (right away outside one)."""
+    tags = {model_tag(model) for model in models} - {None}
+    if not tags:
+        return
+    pending = getattr(_pending, 'tags', None)
+    if pending is None:
+        pending = _pending.tags = set()
+    pending.update(tags)
+    # Every write schedules a flush, but the first one to run at commit
+    # takes all pending tags and the rest find nothing left to do. Tags from
+    # a rolled-back transaction are flushed with the next commit: a spurious
+    # miss, never a stale hit.
+    transaction.on_commit(flush_invalidations, using=using)
+
+
+def flush_invalidations():
+    pending = getattr(_pending, 'tags', None)
+    if not pending:
+        return
+    tags, _pending.tags = pending, set()
+    cache = get_response_cache()
+    if cache is not None:
+        cache.bump(tags)
+
+
+@dataclass
+class CachePolicy:
+    tags: frozenset
+    max_age: int
+
+
+class CachePolicyAnalyzer(CostAnalyzer):
+    """Models and max-age of an operation, from the types it selects."""
+
+    def __init__(self, schema, document, hints=None, default_max_age=DEFAULT_MAX_AGE):
+        super().__init__(schema, document)
+        self.hints = hints or {}
+        self.default_max_age = default_max_age
+
+    def analyze(self, operation):
+        self.tags = set()
+        self.max_age = None
+        self.cacheable = True
+        self.visit(self.schema.get_root_type(operation.operation), operation.selection_set, root=True)
+        if not self.cacheable:
+            return None
+        return CachePolicy(tags=frozenset(self.tags), max_age=self.max_age or 0)
+
+    def visit(self, parent_type, selection_set, root=False):
+        for type_, node in self.fields(parent_type, selection_set):
+            name = node.name.value
+            field_def = getattr(type_, 'fields', {}).get(name)
+            if field_def is None or name.startswith('__'):
+                if root:
+                    self.limit(self.default_max_age)
+                continue
+            return_type = get_named_type(field_def.type)
+            hint = self.hint(type_.name, name, return_type.name)
+            if hint is not None:
+                self.limit(hint)
+            elif root:
+                self.limit(self.default_max_age)
+            self.add_model(return_type)
+            if node.selection_set is not None:
+                self.visit(return_type, node.selection_set)
+
+    def hint(self, parent_name, field_name, type_name):
+        for key in (f'{parent_name}.{field_name}', type_name, field_name):
+            if key in self.hints:
+                return self.hints[key]
+        return None
+
+    def limit(self, max_age):
+        self.max_age = max_age if self.max_age is None else min(self.max_age, max_age)
+
+    def add_model(self, type_):
+        meta = getattr(getattr(type_, 'graphene_type', None), '_meta', None)
+        model = getattr(meta, 'model', None)
+        node = getattr(meta, 'node', None)
+        if model is None and node is not None:
+            # Connections depend on their node's model even without edges selected
+            model = getattr(node._meta, 'model', None)
+        if model is None:
+            return
+        tag = model_tag(model)
+        if tag is None:
+            self.cacheable = False
+        else:
+            self.tags.add(tag)
+
+
+def new_token(bumped_at=None):
+    # Compared for equality only; the prefix records when the tag was bumped
+    return f'{time.time() if bumped_at is None else bumped_at:.6f}:{uuid.uuid4().hex}'
+
+
+def bumped_at(token):
+    prefix, separator, _ = token.partition(':')
+    return float(prefix) if separator else 0.0
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    policy: CachePolicy
+    versions: dict = field(default_factory=dict)
+    hit: bool = False
+
+    def invalidated_within(self, seconds):
+        """Whether one of the entry's tags was bumped in the last ``seconds``."""
+        latest = max((bumped_at(token) for token in self.versions.values()), default=0.0)
+        return time.time() - latest < seconds
+
+
+def user_key(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return 'anonymous'
+
+
+class ResponseCache:
+    def __init__(self, alias, hints=None, default_max_age=DEFAULT_MAX_AGE):
+        self.alias = alias
+        self.hints = hints or {}
+        self.default_max_age = default_max_age
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def entry(self, schema, document, operation, variables, operation_name, request):
+        """The ``CacheEntry`` for this request, or ``None`` if it can't be cached."""
+        if not isinstance(operation, OperationDefinitionNode) or operation.operation.value != 'query':
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        policy = CachePolicyAnalyzer(schema, document, self.hints, self.default_max_age).analyze(operation)
+        if policy is None or policy.max_age <= 0:
+            return None
+        material = json.dumps(
+            [print_ast(document), operation_name, variables, user_key(request), schema_hash(schema)],
+            sort_keys=True, cls=DjangoJSONEncoder,
+        )
+        return CacheEntry(ENTRY_PREFIX + hashlib.sha256(material.encode('utf-8')).hexdigest(), policy)
+
+    def lookup(self, entry):
+        """Cached data for ``entry`` if still current; records the tag versions either way."""
+        tag_keys = [TAG_PREFIX + tag for tag in entry.policy.tags]
+        found = self.cache.get_many([entry.key, *tag_keys])
+        versions = {key: found[key] for key in tag_keys if key in found}
+        missing = [key for key in tag_keys if key not in versions]
+        if missing:
+            for key in missing:
+                self.cache.add(key, new_token(bumped_at=0), timeout=None)
+            versions.update(self.cache.get_many(missing))
+        entry.versions = versions
+        cached = found.get(entry.key)
+        if cached is not None and cached['versions'] == versions:
+            entry.hit = True
+            LOOKUPS.inc(labels=('hit',))
+            return cached['data']
+        LOOKUPS.inc(labels=('miss',))
+        return None
+
+    def store(self, entry, data):
+        self.cache.set(entry.key, {'versions': entry.versions, 'data': data}, timeout=entry.policy.max_age)
+
+    def bump(self, tags):
+        self.cache.set_many({TAG_PREFIX + tag: new_token() for tag in tags}, timeout=None)
+        for tag in tags:
+            INVALIDATIONS.inc(labels=(tag,))
+
+    @staticmethod
+    def stats():
+        hits, misses = LOOKUPS.value(('hit',)), LOOKUPS.value(('miss',))
+        lookups = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_ratio': hits / lookups if lookups else 0.0}
+
+
+def is_process_local():
+    """Whether the response cache is on and held in this process's memory."""
+    alias = getattr(settings, 'GRAPHQL_RESPONSE_CACHE', None)
+    return bool(alias) and isinstance(caches[alias], LocMemCache)
+
+
+def get_response_cache():
+    """The configured ``ResponseCache``, or ``None`` when caching is off."""
+    alias = getattr(settings, 'GRAPHQL_RESPONSE_CACHE', None)
+    if not alias:
+        return None
+    return ResponseCache(
+        alias,
+        getattr(settings, 'GRAPHQL_CACHE_CONTROL', None),
+        getattr(settings, 'GRAPHQL_RESPONSE_CACHE_MAX_AGE', DEFAULT_MAX_AGE),
+    )
+
+
+def cache_control_extension(entry):
+    return {'cacheControl': {'maxAge': entry.policy.max_age, 'hit': entry.hit}}
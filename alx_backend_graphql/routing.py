@@ -0,0 +1,214 @@
+"""
+Read/write splitting between the primary (``default``) and read replicas.
+
+``DATABASE_REPLICAS`` names the replica aliases. ``ReplicaRouter`` (in
+``DATABASE_ROUTERS``) sends reads to a replica only inside a
+``ReadRouting`` block, which the GraphQL views enter for query operations.
+Mutations, reads inside a transaction and everything outside the views
+(admin, jobs, cron, subscriptions) use the primary.
+
+- All the reads of an operation go to one replica, so they see one point
+  of its replication. Successive operations take the healthy replicas in
+  turn.
+- A replica is checked at most every ``DATABASE_REPLICA_CHECK_INTERVAL``
+  seconds. It must answer and have applied as many migrations as the
+  primary, which rules out a copy never synced. One that fails is skipped
+  until it passes again. With none healthy, reads go to the primary.
+- Read-your-writes: replicas trail the primary by up to
+  ``DATABASE_REPLICA_MAX_LAG`` seconds. A mutation gives its client a
+  signed cookie valid that long, and the client's queries read the primary
+  until it expires. Later operations of the same batch do too.
+
+With SQLite a replica is a copy of the database file, refreshed from the
+primary by ``sync_sqlite_replicas()`` (``manage.py sync_sqlite_replicas``).
+"""
+import contextvars
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'crm_read_primary'
+DEFAULT_MAX_LAG = 5
+DEFAULT_CHECK_INTERVAL = 5
+
+
+def replica_aliases():
+    return tuple(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def max_lag():
+    return getattr(settings, 'DATABASE_REPLICA_MAX_LAG', DEFAULT_MAX_LAG)
+
+
+def applied_migrations(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM django_migrations')
+        return cursor.fetchone()[0]
+
+
+def check_replica(alias):
+    """Whether ``alias`` answers and has every migration the primary has."""
+    try:
+        return applied_migrations(alias) >= applied_migrations(DEFAULT_DB_ALIAS)
+    except DatabaseError:
+        connections[alias].close()
+        return False
+
+
+class ReplicaPool:
+    """Round-robin over the replicas that pass their health check."""
+
+    def __init__(self, aliases, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.aliases = list(aliases)
+        self.check_interval = check_interval
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        # alias -> (healthy, time.monotonic() of the check)
+        self._health = {}
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            healthy, checked_at = self._health.get(alias, (None, None))
+        if checked_at is not None and now - checked_at < self.check_interval:
+            return healthy
+        was_healthy, healthy = healthy, check_replica(alias)
+        with self._lock:
+            self._health[alias] = (healthy, now)
+        if was_healthy is not None and healthy != was_healthy:
+            logger.warning("Replica %s is %s", alias, "back" if healthy else "down; reading from the others")
+        return healthy
+
+    def choose(self):
+        """The next healthy replica, or ``None``."""
+        start = next(self._turn)
+        for i in range(len(self.aliases)):
+            alias = self.aliases[(start + i) % len(self.aliases)]
+            if self.is_healthy(alias):
+                return alias
+        return None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_replica_pool():
+    """The process's ``ReplicaPool``; ``None`` without replicas."""
+    aliases = replica_aliases()
+    if not aliases:
+        return None
+    key = (aliases, getattr(settings, 'DATABASE_REPLICA_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ReplicaPool(*key)
+        return _pools[key]
+
+
+_current = contextvars.ContextVar('read_routing', default=None)
+
+
+class ReadRouting:
+    """Routes the reads made inside the block: to a replica when
+    ``replicas`` is true, else to the primary. ``alias`` is the replica
+    chosen, once the first read has picked it."""
+
+    def __init__(self, replicas=True):
+        self.pool = get_replica_pool() if replicas else None
+        self.alias = None
+        self._token = None
+
+    def db_for_read(self):
+        if self.pool is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if self.alias is None:
+            self.alias = self.pool.choose()
+            if self.alias is None:
+                # None healthy: the primary, for the whole operation
+                self.pool = None
+        return self.alias
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+
+
+class ClientRouting:
+    """Per request, shared by the operations of a batch: whether the
+    client's queries may read a replica."""
+
+    def __init__(self, request):
+        self.recent_write = request.get_signed_cookie(
+            STICKY_COOKIE, None, salt=STICKY_COOKIE, max_age=max_lag(),
+        ) is not None
+        self.wrote = False
+
+    @property
+    def replicas_allowed(self):
+        return not (self.recent_write or self.wrote)
+
+    def stick(self, response):
+        """Send the client to the primary while replicas may lack its write."""
+        if self.wrote and get_replica_pool() is not None:
+            response.set_signed_cookie(
+                STICKY_COOKIE, '1', salt=STICKY_COOKIE, max_age=max_lag(), httponly=True, samesite='Lax',
+            )
+
+
+def get_client_routing(request):
+    routing = getattr(request, 'client_routing', None)
+    if routing is None:
+        routing = request.client_routing = ClientRouting(request)
+    return routing
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        routing = _current.get()
+        return routing.db_for_read() if routing is not None else None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in replica_aliases():
+            return False
+        return None
+
+
+def sync_sqlite_replicas(aliases=None):
+    """Copy the primary SQLite database over each replica's file, as
+    replication would. Returns the aliases copied to."""
+    aliases = replica_aliases() if aliases is None else aliases
+    primary = connections[DEFAULT_DB_ALIAS]
+    for alias in aliases:
+        if primary.vendor != 'sqlite' or connections[alias].vendor != 'sqlite':
+            raise ValueError(f"Only SQLite replicas can be copied; {alias} is replicated by its server")
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    return list(aliases)
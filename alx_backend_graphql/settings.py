@@ -78,12 +78,90 @@ WSGI_APPLICATION = 'alx_backend_graphql.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE is 'sqlite' (default) or 'postgresql'; the other DB_* variables
+# are read from the environment or .env.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    # Needs psycopg 3 with the pool extra: pip install "psycopg[binary,pool]"
+    DB_POOL = os.environ.get('DB_POOL', 'True') == 'True'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'crm'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Pooled connections outlive requests already; Django refuses
+            # CONN_MAX_AGE on top of a pool, so persistent connections are
+            # only the fallback when DB_POOL=False
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', '600')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+                    'timeout': int(os.environ.get('DB_POOL_TIMEOUT', '10')),
+                },
+            } if DB_POOL else {},
+        }
+    }
+else:
+    SQLITE_PRAGMAS = [
+        # Readers don't block the writer and the writer doesn't block readers
+        'PRAGMA journal_mode=WAL',
+        # Durable across application crashes in WAL mode; only an OS crash
+        # can lose the last commits
+        'PRAGMA synchronous=NORMAL',
+        # Page cache per connection, in KiB when negative
+        f"PRAGMA cache_size=-{os.environ.get('SQLITE_CACHE_KIB', '20000')}",
+        'PRAGMA temp_store=MEMORY',
+    ]
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME') or BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # busy_timeout: seconds a writer waits for the lock before
+                # raising "database is locked"
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', '20')),
+                # Take the write lock at BEGIN. A deferred transaction that
+                # reads first can't wait for the lock when it later writes;
+                # SQLite fails it immediately whatever the timeout.
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': ';'.join(SQLITE_PRAGMAS),
+            },
+            'TEST': {
+                # File-backed so threaded tests share one database
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
     }
-}
+
+
+# Read replicas (alx_backend_graphql/routing.py), comma-separated in DB_REPLICAS:
+# hosts sharing the primary's other DB_* settings on PostgreSQL, database files
+# on SQLite (refreshed from the primary with `manage.py sync_sqlite_replicas`).
+# GraphQL queries read from them; mutations and everything else use the primary.
+for i, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    if DB_ENGINE == 'postgresql':
+        DATABASES[f'replica{i}'] = {**DATABASES['default'], 'HOST': replica, 'TEST': {'MIRROR': 'default'}}
+    else:
+        DATABASES[f'replica{i}'] = {
+            **DATABASES['default'], 'NAME': replica,
+            # Empty, with no migrations recorded, until it is first synced
+            'TEST': {'NAME': BASE_DIR / f'test_replica{i}.sqlite3', 'MIGRATE': False},
+        }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['alx_backend_graphql.routing.ReplicaRouter']
+# Seconds replicas may trail the primary: a client that mutated reads the
+# primary for this long, and responses read from a replica right after an
+# invalidation aren't cached
+DATABASE_REPLICA_MAX_LAG = int(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+# Seconds between health checks of a replica
+DATABASE_REPLICA_CHECK_INTERVAL = int(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5))
 
 
 # Password validation
@@ -122,10 +200,112 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # GraphQL responses; point it at a shared backend (Redis, Memcached)
+    # so invalidations reach every worker
+    'graphql': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'graphql-responses',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
 GRAPHENE = {
     'SCHEMA': 'alx_backend_graphql.schema.schema'
 }
 
+# Parsed and validated GraphQL documents kept in memory (0 disables the cache)
+GRAPHQL_DOCUMENT_CACHE_SIZE = int(os.environ.get('GRAPHQL_DOCUMENT_CACHE_SIZE', 1000))
+
+# Cache alias holding automatic persisted queries (sha256 -> query text)
+GRAPHQL_PERSISTED_QUERIES_CACHE = 'default'
+
+
+def env_limit(name, default):
+    """An int from the environment; empty or "none" gives None, no limit."""
+    value = os.environ.get(name, str(default)).strip()
+    return None if value.lower() in ('', 'none') else int(value)
+
+
+# Operations deeper or costlier than this are rejected before execution
+# (see alx_backend_graphql/cost.py); None (GRAPHQL_MAX_QUERY_DEPTH= or
+# GRAPHQL_MAX_QUERY_COST=none in the environment) disables a limit
+GRAPHQL_MAX_QUERY_DEPTH = env_limit('GRAPHQL_MAX_QUERY_DEPTH', 15)
+GRAPHQL_MAX_QUERY_COST = env_limit('GRAPHQL_MAX_QUERY_COST', 50000)
+
+# Per-field cost overrides, keyed by "TypeName.fieldName" or "fieldName"
+GRAPHQL_FIELD_COSTS = {
+    'totalCount': 1,
+}
+
+# Per-resolver timing and SQL counts, scraped from /metrics; always on when
+# DEBUG is, which also returns the trace in the response extensions
+GRAPHQL_TRACING = os.environ.get('GRAPHQL_TRACING', 'False') == 'True'
+
+# Cache alias for whole query responses (see alx_backend_graphql/response_cache.py);
+# set GRAPHQL_RESPONSE_CACHE= (empty) to turn it off
+GRAPHQL_RESPONSE_CACHE = os.environ.get('GRAPHQL_RESPONSE_CACHE', 'graphql') or None
+# Seconds a cached response lives unless a hint below says otherwise
+GRAPHQL_RESPONSE_CACHE_MAX_AGE = int(os.environ.get('GRAPHQL_RESPONSE_CACHE_MAX_AGE', 60))
+
+# Max-age hints in seconds, keyed by "TypeName.fieldName", a type name or
+# "fieldName". A response lives as long as its shortest hint; 0 never caches.
+GRAPHQL_CACHE_CONTROL = {
+    'Query.allProducts': 300,
+    'Query.allOrders': 30,
+    'Query.allOrdersKeyset': 30,
+    # A sync client must see every change as soon as it is committed
+    'Query.changesSince': 0,
+}
+
+# Batched requests: POST a JSON array of operations to /graphql/ (see
+# alx_backend_graphql/batch.py). Larger batches are rejected; None (an empty
+# GRAPHQL_BATCH_MAX_SIZE or "none") disables the limit.
+GRAPHQL_BATCH_MAX_SIZE = env_limit('GRAPHQL_BATCH_MAX_SIZE', 20)
+# Worker threads running the queries of a batch in parallel; 0 runs them in order.
+# Pays off when queries wait on a database server; on SQLite the GIL eats the gain.
+GRAPHQL_BATCH_THREADS = int(os.environ.get('GRAPHQL_BATCH_THREADS', 0))
+
+# GraphQL subscriptions over WebSockets at /graphql/ (alx_backend_graphql/subscriptions.py),
+# served by asgi.py. The pub/sub backend carries events from the mutations to the
+# subscribers; the in-process one only reaches subscribers of the same process.
+GRAPHQL_PUBSUB_BACKEND = os.environ.get('GRAPHQL_PUBSUB_BACKEND', 'alx_backend_graphql.pubsub.InProcessBackend')
+# Messages a socket may fall behind before it is disconnected
+GRAPHQL_WS_OUTBOX = int(os.environ.get('GRAPHQL_WS_OUTBOX', 1000))
+# Seconds a new socket has to send connection_init
+GRAPHQL_WS_INIT_TIMEOUT = int(os.environ.get('GRAPHQL_WS_INIT_TIMEOUT', 10))
+
+# Write-behind stock for createOrder (crm/reservations.py): quantities are reserved
+# in memory and written to Product.stock every CRM_STOCK_FLUSH_INTERVAL seconds.
+# Only for a single process placing orders: each process counts stock on its own.
+CRM_STOCK_RESERVATIONS = os.environ.get('CRM_STOCK_RESERVATIONS', 'False') == 'True'
+# Counters per product; threads reserve from different shards without contending
+CRM_STOCK_SHARDS = int(os.environ.get('CRM_STOCK_SHARDS', 4))
+CRM_STOCK_FLUSH_INTERVAL = float(os.environ.get('CRM_STOCK_FLUSH_INTERVAL', 0.5))
+
+# Only installed with `manage.py crontab add`; the job worker runs the same
+# work from CRM_JOB_SCHEDULE without starting a process per tick.
 CRONJOBS = [
     ('*/5 * * * *', 'crm.cron.log_crm_heartbeat'),
-]
\ No newline at end of file
+]
+
+# Days the change log behind `changesSince` is kept; older cursors must resync
+CRM_CHANGE_RETENTION_DAYS = int(os.environ.get('CRM_CHANGE_RETENTION_DAYS', 30))
+
+# Job queue (crm/jobs.py), run by `manage.py run_crm_worker`.
+# Recurring jobs: (cron expression in TIME_ZONE, task name[, kwargs]).
+CRM_JOB_SCHEDULE = [
+    ('*/5 * * * *', 'crm.heartbeat'),
+    ('0 */12 * * *', 'crm.update_low_stock'),
+    ('0 8 * * *', 'crm.send_order_reminders'),
+    ('0 2 * * 0', 'crm.clean_inactive_customers'),
+    ('30 3 * * *', 'crm.prune_jobs'),
+    ('45 3 * * *', 'crm.prune_changes'),
+]
+# Seconds before the first retry of a failed job; doubles on every retry
+CRM_JOB_RETRY_BACKOFF = int(os.environ.get('CRM_JOB_RETRY_BACKOFF', 10))
+# Seconds a worker holds a job before another worker may run it again
+CRM_JOB_LEASE = int(os.environ.get('CRM_JOB_LEASE', 300))
\ No newline at end of file
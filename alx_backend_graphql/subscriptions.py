@@ -0,0 +1,307 @@
+"""
+GraphQL subscriptions over WebSockets, served by ``asgi.py`` at ``/graphql/``.
+
+The protocol is ``graphql-transport-ws``, as spoken by the ``graphql-ws``
+client library. A client sends ``connection_init`` and gets
+``connection_ack``. Each ``subscribe`` gets ``next`` messages until the
+server sends ``complete`` or ``error``, or the client sends ``complete``.
+``ping`` is answered with ``pong``. Only subscription operations are
+served here; queries and mutations stay on the HTTP endpoints.
+
+Sockets subscribing with the same document, operation name and variables
+share one ``Group``. A group runs the subscription once: one hub
+subscription (see ``alx_backend_graphql.pubsub``), and one execution per
+event whose encoded result goes to every member. A thousand dashboards on
+the same query cost one query per event, not a thousand. Documents go
+through the same document cache, persisted queries and cost limits as
+the HTTP endpoints.
+
+Each socket's outbox holds ``GRAPHQL_WS_OUTBOX`` messages. A client that
+falls further behind is disconnected with code 1013, so it doesn't hold
+events in memory.
+"""
+import asyncio
+import json
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from graphene_django.settings import graphene_settings
+from graphql import ExecutionResult, GraphQLError, OperationType, get_operation_ast, subscribe
+
+from alx_backend_graphql.cost import QueryCostError, analyze_query, check_query_cost
+from alx_backend_graphql.documents import get_document_cache, get_persisted_query_registry
+from crm.loaders import AsyncLoaders
+
+PROTOCOL = 'graphql-transport-ws'
+DEFAULT_OUTBOX = 1000
+DEFAULT_INIT_TIMEOUT = 10
+
+
+def encode(data):
+    return json.dumps(data, cls=DjangoJSONEncoder)
+
+
+def format_errors(errors):
+    return [
+        error.formatted if isinstance(error, GraphQLError) else GraphQLError(str(error), original_error=error).formatted
+        for error in errors
+    ]
+
+
+class SubscriptionContext:
+    """``info.context`` of a group: async execution, with loaders that are
+    replaced for every event so no row outlives it."""
+
+    graphql_async = True
+
+    def __init__(self):
+        self.loaders = AsyncLoaders()
+
+
+class Group:
+    """The sockets sharing one subscription, and the task running it."""
+
+    def __init__(self, app, key, document, operation_name, variables):
+        self.app = app
+        self.key = key
+        self.document = document
+        self.operation_name = operation_name
+        self.variables = variables
+        # {(socket, operation id)}
+        self.members = set()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def add(self, socket, id):
+        self.members.add((socket, id))
+
+    def discard(self, socket, id):
+        self.members.discard((socket, id))
+        if not self.members:
+            self.app.forget(self)
+            if self.task is not None:
+                self.task.cancel()
+
+    def broadcast(self, type, payload=None):
+        body = '' if payload is None else f',"payload":{payload}'
+        for socket, id in list(self.members):
+            socket.push(f'{{"id":{encode(id)},"type":"{type}"{body}}}')
+
+    def end(self, errors=None):
+        # New subscribers start a new group from here on
+        self.app.forget(self)
+        if errors:
+            self.broadcast('error', encode(format_errors(errors)))
+        else:
+            self.broadcast('complete')
+        for socket, id in list(self.members):
+            socket.operations.pop(id, None)
+        self.members.clear()
+
+    async def run(self):
+        context = SubscriptionContext()
+        try:
+            stream = await subscribe(
+                self.app.schema, self.document, variable_values=self.variables,
+                operation_name=self.operation_name, context_value=context,
+            )
+            if isinstance(stream, ExecutionResult):
+                self.end(stream.errors)
+                return
+            try:
+                while True:
+                    context.loaders = AsyncLoaders()
+                    try:
+                        result = await stream.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    self.broadcast('next', encode(result.formatted))
+                    # What a request would do when it finishes
+                    await sync_to_async(close_old_connections)()
+            finally:
+                await stream.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.end([e])
+            return
+        self.end()
+
+
+class Socket:
+    """One client connection and its outbox."""
+
+    def __init__(self, app, send):
+        self.app = app
+        self.send = send
+        self.outbox = deque()
+        self.outbox_size = app.outbox_size
+        self.ready = asyncio.Event()
+        self.close_code = None
+        self.close_reason = ''
+        self.initialised = False
+        # {operation id: Group}
+        self.operations = {}
+
+    def push(self, text):
+        if self.close_code is not None:
+            return
+        if len(self.outbox) >= self.outbox_size:
+            self.close(1013, "Client is too slow")
+            return
+        self.outbox.append(text)
+        self.ready.set()
+
+    def close(self, code, reason=''):
+        if self.close_code is None:
+            self.close_code, self.close_reason = code, reason
+            # Undelivered messages go with the connection
+            self.outbox.clear()
+            self.ready.set()
+
+    async def write(self):
+        while True:
+            while self.outbox:
+                await self.send({'type': 'websocket.send', 'text': self.outbox.popleft()})
+            if self.close_code is not None:
+                await self.send({'type': 'websocket.close', 'code': self.close_code, 'reason': self.close_reason})
+                return
+            self.ready.clear()
+            await self.ready.wait()
+
+    def handle(self, text):
+        try:
+            message = json.loads(text)
+            type = message['type']
+        except (TypeError, ValueError, KeyError):
+            self.close(4400, "Invalid message")
+            return
+        if type == 'connection_init':
+            if self.initialised:
+                self.close(4429, "Too many initialisation requests")
+                return
+            self.initialised = True
+            self.push('{"type":"connection_ack"}')
+        elif type == 'ping':
+            self.push('{"type":"pong"}')
+        elif type == 'pong':
+            pass
+        elif type == 'subscribe':
+            if not self.initialised:
+                self.close(4401, "Unauthorized")
+                return
+            id = message.get('id')
+            if not isinstance(id, str) or not isinstance(message.get('payload'), dict):
+                self.close(4400, "Invalid message")
+            elif id in self.operations:
+                self.close(4409, f"Subscriber for {id} already exists")
+            else:
+                self.app.join(self, id, message['payload'])
+        elif type == 'complete':
+            self.leave(message.get('id'))
+        else:
+            self.close(4400, f"Unknown message type {type!r}")
+
+    def leave(self, id):
+        group = self.operations.pop(id, None)
+        if group is not None:
+            group.discard(self, id)
+
+    def leave_all(self):
+        for id in list(self.operations):
+            self.leave(id)
+
+
+class GraphQLWebSocketApp:
+    """ASGI application for ``websocket`` scopes."""
+
+    def __init__(self, path='/graphql/'):
+        self.path = path
+        self.groups = {}
+
+    @property
+    def schema(self):
+        return graphene_settings.SCHEMA.graphql_schema
+
+    @property
+    def outbox_size(self):
+        return getattr(settings, 'GRAPHQL_WS_OUTBOX', DEFAULT_OUTBOX)
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if scope['path'] != self.path or PROTOCOL not in scope.get('subprotocols', ()):
+            # Refused before the handshake: the client sees a 403
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        await send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+        socket = Socket(self, send)
+        writer = asyncio.ensure_future(socket.write())
+        timeout = getattr(settings, 'GRAPHQL_WS_INIT_TIMEOUT', DEFAULT_INIT_TIMEOUT)
+        timer = asyncio.get_running_loop().call_later(
+            timeout, lambda: socket.initialised or socket.close(4408, "Connection initialisation timeout"),
+        )
+        try:
+            while True:
+                receiving = asyncio.ensure_future(receive())
+                await asyncio.wait({receiving, writer}, return_when=asyncio.FIRST_COMPLETED)
+                if not receiving.done():
+                    # The writer sent a close: the connection is over
+                    receiving.cancel()
+                    break
+                message = receiving.result()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    socket.handle(message.get('text') or message.get('bytes', b'').decode('utf-8', 'replace'))
+        finally:
+            timer.cancel()
+            socket.leave_all()
+            writer.cancel()
+
+    def prepare(self, payload):
+        """``(document, variables, operation name, errors)`` of a ``subscribe`` payload."""
+        variables = payload.get('variables') or {}
+        operation_name = payload.get('operationName')
+        try:
+            query = get_persisted_query_registry().resolve(payload.get('query'), payload.get('extensions'))
+            if not query:
+                raise GraphQLError("Must provide query string.")
+            document, errors = get_document_cache().get(self.schema, query)
+        except GraphQLError as e:
+            return None, variables, operation_name, [e]
+        if errors:
+            return None, variables, operation_name, errors
+        operation = get_operation_ast(document, operation_name)
+        if operation is None or operation.operation != OperationType.SUBSCRIPTION:
+            return None, variables, operation_name, [GraphQLError(
+                "Only subscriptions are served over WebSockets; send queries and mutations to /graphql/."
+            )]
+        try:
+            check_query_cost(analyze_query(self.schema, document, operation, variables))
+        except QueryCostError as e:
+            return None, variables, operation_name, [e]
+        return document, variables, operation_name, []
+
+    def join(self, socket, id, payload):
+        document, variables, operation_name, errors = self.prepare(payload)
+        if errors:
+            socket.push(encode({'id': id, 'type': 'error', 'payload': format_errors(errors)}))
+            return
+        key = (payload.get('query'), encode(payload.get('extensions')), operation_name, encode(variables))
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = Group(self, key, document, operation_name, variables)
+            group.start()
+        group.add(socket, id)
+        socket.operations[id] = group
+
+    def forget(self, group):
+        if self.groups.get(group.key) is group:
+            del self.groups[group.key]
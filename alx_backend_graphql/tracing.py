@@ -0,0 +1,180 @@
+"""
+Per-resolver timing and SQL accounting for GraphQL requests.
+
+When ``GRAPHQL_TRACING`` (or ``DEBUG``) is on, every operation gets a
+``Trace``: ``TracingMiddleware`` opens a span around each resolver and a
+database execute wrapper charges every SQL statement to the span that was
+running when it was issued. Finished traces feed the Prometheus metrics
+served at ``/metrics``; with ``DEBUG`` on they are also returned under
+``extensions.tracing``. With tracing off the view installs no middleware,
+so the only cost left is a ``ContextVar`` lookup per SQL statement.
+"""
+import time
+from contextvars import ContextVar
+from inspect import isawaitable
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from alx_backend_graphql.metrics import registry
+
+_trace = ContextVar('graphql_trace', default=None)
+_span = ContextVar('graphql_span', default=None)
+
+REQUEST_DURATION = registry.histogram(
+    'graphql_request_duration_seconds', 'Wall time to execute a GraphQL operation.', ('operation',)
+)
+REQUEST_SQL_QUERIES = registry.counter(
+    'graphql_request_sql_queries_total', 'SQL statements run by GraphQL operations.', ('operation',)
+)
+RESOLVER_DURATION = registry.histogram(
+    'graphql_resolver_duration_seconds', 'Wall time spent in a resolver.', ('field',)
+)
+RESOLVER_SQL_QUERIES = registry.counter(
+    'graphql_resolver_sql_queries_total', 'SQL statements run while a resolver was executing.', ('field',)
+)
+RESOLVER_SQL_DURATION = registry.counter(
+    'graphql_resolver_sql_duration_seconds_total', 'Time spent in SQL while a resolver was executing.', ('field',)
+)
+
+
+def tracing_enabled():
+    return getattr(settings, 'GRAPHQL_TRACING', False) or settings.DEBUG
+
+
+def nanoseconds(seconds):
+    return int(seconds * 1e9)
+
+
+class Span:
+    __slots__ = ('path', 'parent_type', 'field_name', 'return_type', 'start', 'duration', 'sql_count', 'sql_time')
+
+    def __init__(self, info):
+        self.path = info.path.as_list()
+        self.parent_type = info.parent_type.name
+        self.field_name = info.field_name
+        self.return_type = str(info.return_type)
+        self.start = time.perf_counter()
+        self.duration = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    @property
+    def field(self):
+        return f'{self.parent_type}.{self.field_name}'
+
+
+class Trace:
+    def __init__(self):
+        self.spans = []
+        self.start = None
+        self.duration = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self._token = None
+
+    def begin(self):
+        """Make this the active trace of the current context."""
+        for connection in connections.all(initialized_only=True):
+            install_sql_hook(connection)
+        self._token = _trace.set(self)
+        self.start = time.perf_counter()
+
+    def end(self):
+        self.duration = time.perf_counter() - self.start
+        _trace.reset(self._token)
+
+    def span(self, info):
+        span = Span(info)
+        self.spans.append(span)
+        return span
+
+    def add_sql(self, span, elapsed):
+        self.sql_count += 1
+        self.sql_time += elapsed
+        if span is not None:
+            span.sql_count += 1
+            span.sql_time += elapsed
+
+    def record_metrics(self, operation):
+        REQUEST_DURATION.observe(self.duration, (operation,))
+        REQUEST_SQL_QUERIES.inc(self.sql_count, (operation,))
+        for span in self.spans:
+            labels = (span.field,)
+            RESOLVER_DURATION.observe(span.duration or 0.0, labels)
+            if span.sql_count:
+                RESOLVER_SQL_QUERIES.inc(span.sql_count, labels)
+                RESOLVER_SQL_DURATION.inc(span.sql_time, labels)
+
+    def as_extension(self):
+        return {
+            'duration': nanoseconds(self.duration),
+            'sqlCount': self.sql_count,
+            'sqlDuration': nanoseconds(self.sql_time),
+            'resolvers': [
+                {
+                    'path': span.path,
+                    'parentType': span.parent_type,
+                    'fieldName': span.field_name,
+                    'returnType': span.return_type,
+                    'startOffset': nanoseconds(span.start - self.start),
+                    'duration': nanoseconds(span.duration or 0.0),
+                    'sqlCount': span.sql_count,
+                    'sqlDuration': nanoseconds(span.sql_time),
+                }
+                for span in self.spans
+            ],
+        }
+
+
+class TracingMiddleware:
+    def __init__(self, trace):
+        self.trace = trace
+
+    def resolve(self, next, root, info, **args):
+        span = self.trace.span(info)
+        token = _span.set(span)
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            span.finish()
+            raise
+        finally:
+            _span.reset(token)
+        if isawaitable(result):
+            return self.finish_async(span, result)
+        span.finish()
+        return result
+
+    @staticmethod
+    async def finish_async(span, result):
+        token = _span.set(span)
+        try:
+            return await result
+        finally:
+            _span.reset(token)
+            span.finish()
+
+
+def sql_hook(execute, sql, params, many, context):
+    trace = _trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_sql(_span.get(), time.perf_counter() - start)
+
+
+def install_sql_hook(connection, **kwargs):
+    if sql_hook not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_hook)
+
+
+# Connections opened later (new threads, the async ORM's executor) get it too
+connection_created.connect(install_sql_hook, dispatch_uid='graphql_tracing_sql_hook')
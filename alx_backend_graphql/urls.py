@@ -15,11 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
-from graphene_django.views import GraphQLView
+from django.urls import include, path
+from alx_backend_graphql.views import AsyncCRMGraphQLView, CRMGraphQLView, metrics, schema_view
 from django.views.decorators.csrf import csrf_exempt
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path("graphql/", csrf_exempt(CRMGraphQLView.as_view(graphiql=True))),
+    path("graphql/async/", csrf_exempt(AsyncCRMGraphQLView.as_view())),
+    path("graphql/schema.graphql", schema_view),
+    path("crm/", include("crm.urls")),
+    path("metrics", metrics),
 ]
\ No newline at end of file
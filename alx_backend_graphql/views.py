@@ -0,0 +1,416 @@
+import json
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag, require_GET
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast, validate_schema
+
+from alx_backend_graphql.batch import BatchExecutor, batch_limits, wants_atomic
+from alx_backend_graphql.cost import QueryCostError, analyze_query, check_query_cost, cost_extension
+from alx_backend_graphql.documents import get_document_cache, get_persisted_query_registry, schema_hash, schema_sdl
+from alx_backend_graphql.metrics import registry
+from alx_backend_graphql.response_cache import cache_control_extension, get_response_cache
+from alx_backend_graphql.routing import ReadRouting, get_client_routing, max_lag
+from alx_backend_graphql.tracing import Trace, TracingMiddleware, tracing_enabled
+from crm.loaders import AsyncLoaders
+
+
+SCHEMA_HASH_HEADER = "X-GraphQL-Schema-Hash"
+
+
+class CRMGraphQLView(GraphQLView):
+    """GraphQLView that reuses parsed documents and speaks APQ.
+
+    Identical to the stock view except that parse + validate go through
+    the shared ``DocumentCache``, requests may carry a ``persistedQuery``
+    extension instead of the query text, a JSON array body is executed as
+    a batch (see ``alx_backend_graphql.batch``) and operations over the
+    depth or cost limits (see ``alx_backend_graphql.cost``) are rejected
+    before they execute. Queries may be answered from the response cache (see
+    ``alx_backend_graphql.response_cache``). The computed cost and cache
+    policy are reported in ``extensions``, along with the resolver trace
+    when ``DEBUG`` is on.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        # Before a batch copies the request: its operations share it
+        get_client_routing(request)
+        if self.is_batch(request):
+            response = self.dispatch_batch(request)
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+        self.add_headers(request, response)
+        return response
+
+    def is_batch(self, request):
+        return (
+            request.method.lower() == "post"
+            and self.get_content_type(request) == "application/json"
+            and request.body.lstrip()[:1] == b"["
+        )
+
+    def dispatch_batch(self, request):
+        """Execute a JSON array of operations (see ``alx_backend_graphql.batch``)."""
+        self.batch = True
+        try:
+            entries = self.parse_body(request)
+            max_size, threads = batch_limits()
+            if max_size is not None and len(entries) > max_size:
+                raise HttpError(HttpResponseBadRequest(f"Batches are limited to {max_size} operations."))
+            if not all(isinstance(entry, dict) for entry in entries):
+                raise HttpError(HttpResponseBadRequest("Every operation in a batch must be a JSON object."))
+            operations = BatchExecutor(self, request, entries, wants_atomic(request), threads).run()
+            responses = [
+                self.encode_execution_result(operation.request or request, operation.result, operation.id)
+                for operation in operations
+            ]
+            return HttpResponse(
+                status=max(status_code for _, status_code in responses),
+                content="[{}]".format(",".join(result for result, _ in responses)),
+                content_type="application/json",
+            )
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(request, {"errors": [self.format_error(e)]})
+            return response
+
+    def add_headers(self, request, response):
+        response[SCHEMA_HASH_HEADER] = schema_hash(self.schema.graphql_schema)
+        get_client_routing(request).stick(response)
+        entry = getattr(request, 'graphql_cache_entry', None)
+        if entry is not None and response.status_code == 200 and not self.batch:
+            # Keyed per user, so only the client itself may reuse it
+            patch_cache_control(response, private=True, max_age=entry.policy.max_age)
+
+    @staticmethod
+    def get_extensions(request, data):
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if extensions and isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        return extensions
+
+    def get_document(self, query):
+        return get_document_cache().get(
+            self.schema.graphql_schema, query,
+            self.validation_rules, graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.encode_execution_result(request, execution_result, id, show_graphiql)
+
+    def encode_execution_result(self, request, execution_result, id=None, show_graphiql=False):
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                response["errors"] = [
+                    self.format_error(e) for e in execution_result.errors
+                ]
+
+            if execution_result.errors and any(
+                not getattr(e, "path", None) for e in execution_result.errors
+            ):
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if execution_result.extensions:
+                response["extensions"] = execution_result.extensions
+
+            if self.batch:
+                response["id"] = id
+                response["status"] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+        else:
+            result = None
+
+        return result, status_code
+
+    def prepare_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        """Resolve, parse, validate and cost the document of a request.
+
+        Returns ``(document, operation_ast, extensions, None)``, or
+        ``(None, None, None, result)`` when the request ends before
+        execution.
+        """
+        try:
+            query = get_persisted_query_registry().resolve(query, self.get_extensions(request, data))
+        except GraphQLError as e:
+            return None, None, None, ExecutionResult(errors=[e])
+
+        if not query:
+            if show_graphiql:
+                return None, None, None, None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema_validation_errors = validate_schema(self.schema.graphql_schema)
+        if schema_validation_errors:
+            return None, None, None, ExecutionResult(data=None, errors=schema_validation_errors)
+
+        try:
+            document, validation_errors = self.get_document(query)
+        except Exception as e:
+            return None, None, None, ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None, None, None, None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        if validation_errors:
+            return None, None, None, ExecutionResult(data=None, errors=validation_errors)
+
+        query_cost = analyze_query(self.schema.graphql_schema, document, operation_ast, variables)
+        extensions = cost_extension(query_cost)
+        try:
+            check_query_cost(query_cost)
+        except QueryCostError as e:
+            return None, None, None, ExecutionResult(errors=[e], extensions=extensions)
+        return document, operation_ast, extensions, None
+
+    def get_middleware(self, request):
+        middleware = list(super().get_middleware(request) or [])
+        trace = getattr(request, 'graphql_trace', None)
+        if trace is not None:
+            # Last in the list is outermost
+            middleware.append(TracingMiddleware(trace))
+        return middleware
+
+    def start_trace(self, request):
+        if not tracing_enabled():
+            return None
+        request.graphql_trace = Trace()
+        request.graphql_trace.begin()
+        return request.graphql_trace
+
+    def finish_trace(self, trace, operation_ast, result):
+        if trace is None:
+            return
+        trace.end()
+        trace.record_metrics(operation_ast.operation.value if operation_ast is not None else 'unknown')
+        if settings.DEBUG:
+            result.extensions = {**(result.extensions or {}), 'tracing': trace.as_extension()}
+
+    def get_execute_options(self, request, variables, operation_name):
+        execute_options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            execute_options["execution_context_class"] = self.execution_context_class
+        return execute_options
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        document, operation_ast, extensions, early_result = self.prepare_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        if document is None:
+            return early_result
+
+        schema = self.schema.graphql_schema
+        with self.read_routing(request, operation_ast):
+            entry, result = self.lookup_response(request, document, operation_ast, variables, operation_name)
+            if result is None:
+                trace = self.start_trace(request)
+                result = self.run_execute(request, schema, document, operation_ast, variables, operation_name)
+                self.finish_trace(trace, operation_ast, result)
+                self.store_response(request, entry, result)
+        result.extensions = {**(result.extensions or {}), **extensions}
+        return result
+
+    def lookup_response(self, request, document, operation_ast, variables, operation_name):
+        """``(entry, result)``: the response cache slot of the request, if it
+        has one, and the cached result, if that is current."""
+        cache = get_response_cache()
+        entry = cache and cache.entry(
+            self.schema.graphql_schema, document, operation_ast, variables, operation_name, request
+        )
+        if entry is None:
+            return None, None
+        data = cache.lookup(entry)
+        if data is None:
+            return entry, None
+        request.graphql_cache_entry = entry
+        return entry, ExecutionResult(data=data, extensions=cache_control_extension(entry))
+
+    def read_routing(self, request, operation_ast):
+        """Reads of a query go to a replica unless the client wrote recently
+        (see ``alx_backend_graphql.routing``)."""
+        client = get_client_routing(request)
+        is_query = operation_ast is not None and operation_ast.operation == OperationType.QUERY
+        if operation_ast is not None and operation_ast.operation == OperationType.MUTATION:
+            client.wrote = True
+        request.graphql_reads = ReadRouting(is_query and client.replicas_allowed)
+        return request.graphql_reads
+
+    def store_response(self, request, entry, result):
+        if entry is None or result.errors:
+            return
+        reads = getattr(request, 'graphql_reads', None)
+        if reads is not None and reads.alias is not None and entry.invalidated_within(max_lag()):
+            # The replica may not have the write behind that invalidation yet
+            return
+        get_response_cache().store(entry, result.data)
+        request.graphql_cache_entry = entry
+        result.extensions = {**(result.extensions or {}), **cache_control_extension(entry)}
+
+    def run_execute(self, request, schema, document, operation_ast, variables, operation_name):
+        try:
+            execute_options = self.get_execute_options(request, variables, operation_name)
+
+            if (
+                operation_ast is not None
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+
+class SyncMutationMiddleware:
+    """Runs the (synchronous) mutation resolvers off the event loop."""
+
+    def resolve(self, next, root, info, **args):
+        if info.parent_type is info.schema.mutation_type:
+            return sync_to_async(next)(root, info, **args)
+        return next(root, info, **args)
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """Async flavour of the endpoint, meant to be served over ASGI.
+
+    Connections count and iterate with the async ORM and relations go
+    through ``AsyncLoaders``, so a slow query parks a coroutine instead of
+    a worker thread. Mutations still run their synchronous resolvers, in a
+    thread. GraphiQL and batching are only served by the sync view.
+    """
+
+    view_is_async = True
+
+    def get_context(self, request):
+        request.graphql_async = True
+        request.loaders = AsyncLoaders()
+        return request
+
+    def get_middleware(self, request):
+        return [SyncMutationMiddleware(), *super().get_middleware(request)]
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post"):
+                raise HttpError(
+                    HttpResponseNotAllowed(
+                        ["GET", "POST"], "GraphQL only supports GET and POST requests."
+                    )
+                )
+            data = self.parse_body(request)
+            query, variables, operation_name, id = self.get_graphql_params(request, data)
+            execution_result = await self.execute_graphql_request_async(
+                request, data, query, variables, operation_name
+            )
+            result, status_code = self.encode_execution_result(request, execution_result, id)
+            response = HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+        self.add_headers(request, response)
+        return response
+
+    async def execute_graphql_request_async(self, request, data, query, variables, operation_name):
+        document, operation_ast, extensions, early_result = self.prepare_graphql_request(
+            request, data, query, variables, operation_name
+        )
+        if document is None:
+            return early_result
+        with self.read_routing(request, operation_ast):
+            # Cache backends may do network I/O
+            entry, result = await sync_to_async(self.lookup_response)(
+                request, document, operation_ast, variables, operation_name
+            )
+            if result is None:
+                trace = self.start_trace(request)
+                try:
+                    result = execute(
+                        self.schema.graphql_schema, document,
+                        **self.get_execute_options(request, variables, operation_name),
+                    )
+                    if isawaitable(result):
+                        result = await result
+                except Exception as e:
+                    result = ExecutionResult(errors=[e])
+                self.finish_trace(trace, operation_ast, result)
+                await sync_to_async(self.store_response)(request, entry, result)
+        result.extensions = {**(result.extensions or {}), **extensions}
+        return result
+
+
+def metrics(request):
+    """Prometheus scrape endpoint for this worker's GraphQL metrics."""
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def get_schema():
+    return graphene_settings.SCHEMA.graphql_schema
+
+
+@require_GET
+@etag(lambda request: schema_hash(get_schema()))
+def schema_view(request):
+    """The schema as SDL, for clients that validate queries locally."""
+    return HttpResponse(schema_sdl(get_schema()), content_type="text/plain; charset=utf-8")
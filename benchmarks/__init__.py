@@ -0,0 +1,57 @@
+"""
+Benchmark scripts for the CRM GraphQL API.
+
+Run one with ``python -m benchmarks.<name>`` from the project root. Each
+script works on a throwaway test database, never on db.sqlite3.
+"""
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    return {
+        'n': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def format_row(label, summary):
+    return '{:<24} n={n:<6} mean={mean_ms:8.3f}ms  p50={p50_ms:8.3f}ms  p95={p95_ms:8.3f}ms'.format(label, **summary)
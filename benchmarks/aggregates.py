@@ -0,0 +1,100 @@
+"""
+Reading customer and product totals from the stats tables vs aggregating orders per query.
+
+    python -m benchmarks.aggregates [--customers 5000 --products 500 --orders 50000] [--repeat 30]
+
+Each case runs the same read twice: "stats" joins ``CustomerStats`` /
+``ProductStats``, "annotate" computes the totals on the fly with
+``annotate(Count/Sum/Max)`` over the orders. Both must return the same
+rows. "graphql" is the stats read through ``allCustomers``/``allProducts``
+with ``orderBy``, executed in-process (no response cache).
+"""
+import argparse
+
+from benchmarks import format_row, setup_django, summarize, test_database, timed
+
+CUSTOMERS_QUERY = """
+query { allCustomers(first: 50, orderBy: "-lifetimeTotal") {
+  edges { node { id name orderCount lifetimeTotal lastOrderDate } }
+} }
+"""
+
+PRODUCTS_QUERY = """
+query { allProducts(first: 20, orderBy: "-revenue") { edges { node { id name timesOrdered unitsSold revenue } } } }
+"""
+
+
+def cases():
+    from django.db.models import Count, DecimalField, F, Max, Sum
+
+    from crm.models import Customer, Product
+
+    money = DecimalField(max_digits=14, decimal_places=2)
+    top = lambda field: F(field).desc(nulls_last=True)
+    return {
+        'top customers by spend': (
+            lambda: list(Customer.objects.select_related('stats').order_by(top('stats__lifetime_total'), 'pk')
+                         .values_list('pk', 'stats__order_count')[:50]),
+            lambda: list(Customer.objects.annotate(
+                order_count=Count('orders'), lifetime_total=Sum('orders__total_amount'),
+                last_order_date=Max('orders__order_date'),
+            ).order_by(top('lifetime_total'), 'pk').values_list('pk', 'order_count')[:50]),
+        ),
+        'most frequent customers': (
+            lambda: list(Customer.objects.order_by(top('stats__order_count'), 'pk')
+                         .values_list('pk', 'stats__order_count')[:50]),
+            lambda: list(Customer.objects.annotate(order_count=Count('orders'))
+                         .order_by(top('order_count'), 'pk').values_list('pk', 'order_count')[:50]),
+        ),
+        'customer page with totals': (
+            lambda: list(Customer.objects.order_by('pk').values_list('pk', 'stats__lifetime_total')[:50]),
+            lambda: list(Customer.objects.annotate(lifetime_total=Sum('orders__total_amount'))
+                         .order_by('pk').values_list('pk', 'lifetime_total')[:50]),
+        ),
+        'best-selling products': (
+            lambda: list(Product.objects.order_by(top('stats__revenue'), 'pk')
+                         .values_list('pk', 'stats__units_sold')[:20]),
+            lambda: list(Product.objects.annotate(
+                times_ordered=Count('orderline'), units_sold=Sum('orderline__quantity'),
+                revenue=Sum(F('orderline__quantity') * F('orderline__unit_price'), output_field=money),
+            ).order_by(top('revenue'), 'pk').values_list('pk', 'units_sold')[:20]),
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import RequestFactory
+
+    from alx_backend_graphql.schema import schema
+    from crm.aggregates import rebuild_aggregates
+    from crm.synthetic import generate
+
+    with test_database():
+        generate(args.customers, args.products, args.orders)
+        print(format_row('rebuild', summarize(timed(rebuild_aggregates, 3))))
+
+        for label, (stats, annotate) in cases().items():
+            assert stats() == annotate(), f"{label}: stats and annotate() disagree"
+            fast = summarize(timed(stats, args.repeat))
+            slow = summarize(timed(annotate, args.repeat))
+            print(f'{label}')
+            print(format_row('  stats', fast))
+            print(format_row('  annotate', slow), f" x{slow['p50_ms'] / fast['p50_ms']:.1f}")
+
+        for label, query in (('graphql customers', CUSTOMERS_QUERY), ('graphql products', PRODUCTS_QUERY)):
+            def execute():
+                result = schema.execute(query, context_value=RequestFactory().post('/graphql/'))
+                assert result.errors is None, result.errors
+            print(format_row(label, summarize(timed(execute, args.repeat))))
+
+
+if __name__ == '__main__':
+    main()
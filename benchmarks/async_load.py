@@ -0,0 +1,144 @@
+"""
+Throughput of the sync (/graphql/) and async (/graphql/async/) views under
+concurrent clients.
+
+    python -m benchmarks.async_load [--clients 20] [--requests 400]
+    python -m benchmarks.async_load --base-url http://127.0.0.1:8000
+
+Without ``--base-url`` both views are driven in-process (threads for the
+sync view, tasks for the async one) on a seeded test database. With it,
+requests go over HTTP to a running server, e.g. ``uvicorn
+alx_backend_graphql.asgi:application --workers 1``; seed that database
+yourself. SQLite serializes async ORM calls on one thread, so the gap is
+only representative on PostgreSQL.
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from benchmarks import format_row, setup_django, summarize, test_database
+
+QUERY = """
+query {
+  allOrders(first: 20) {
+    totalCount
+    edges { node { id totalAmount customer { name email } products { edges { node { name price } } } } }
+  }
+}
+"""
+
+
+def seed(customers=50, orders_per_customer=10, products=5):
+    from crm.models import Customer, Order, Product
+
+    customer_objs = Customer.objects.bulk_create(
+        Customer(name=f"Customer {i}", email=f"customer{i}@example.com") for i in range(customers)
+    )
+    product_objs = Product.objects.bulk_create(
+        Product(name=f"Product {i}", price=Decimal('9.99'), stock=100) for i in range(products)
+    )
+    orders = Order.objects.bulk_create(
+        Order(customer=customer, total_amount=Decimal('49.95'))
+        for customer in customer_objs for _ in range(orders_per_customer)
+    )
+    Order.products.through.objects.bulk_create(
+        Order.products.through(order_id=order.pk, product_id=product.pk, unit_price=product.price)
+        for order in orders for product in product_objs
+    )
+
+
+def report(label, samples, elapsed):
+    print(format_row(label, summarize(samples)), f' {len(samples) / elapsed:8.1f} req/s')
+
+
+def run_threads(request, clients, requests):
+    """Run ``request`` ``requests`` times over ``clients`` threads; returns (samples, elapsed)."""
+    def one(_):
+        start = time.perf_counter()
+        request()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        samples = list(pool.map(one, range(requests)))
+    return samples, time.perf_counter() - start
+
+
+async def run_tasks(request, clients, requests):
+    """Run ``request`` ``requests`` times with at most ``clients`` in flight."""
+    semaphore = asyncio.Semaphore(clients)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await request()
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    samples = await asyncio.gather(*(one() for _ in range(requests)))
+    return list(samples), time.perf_counter() - start
+
+
+def in_process(args):
+    from django.db import connections
+    from django.test import AsyncClient, Client
+
+    payload = {'query': QUERY}
+
+    def sync_request():
+        response = Client().post('/graphql/', data=payload, content_type='application/json')
+        assert response.status_code == 200 and 'errors' not in response.json(), response.content
+        connections.close_all()
+
+    client = AsyncClient()
+
+    async def async_request():
+        response = await client.post('/graphql/async/', data=payload, content_type='application/json')
+        assert response.status_code == 200 and 'errors' not in response.json(), response.content
+
+    seed()
+    sync_request()
+    asyncio.run(async_request())  # warm up both
+    report('sync view', *run_threads(sync_request, args.clients, args.requests))
+    report('async view', *asyncio.run(run_tasks(async_request, args.clients, args.requests)))
+
+
+def over_http(args):
+    body = json.dumps({'query': QUERY}).encode()
+
+    def request_to(path):
+        def request():
+            req = urllib.request.Request(
+                args.base_url.rstrip('/') + path, data=body, headers={'Content-Type': 'application/json'}
+            )
+            with urllib.request.urlopen(req) as response:
+                assert 'errors' not in json.load(response)
+        return request
+
+    for label, path in (('sync view', '/graphql/'), ('async view', '/graphql/async/')):
+        request = request_to(path)
+        request()
+        report(label, *run_threads(request, args.clients, args.requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--base-url')
+    args = parser.parse_args()
+
+    if args.base_url:
+        over_http(args)
+        return
+    setup_django()
+    with test_database():
+        in_process(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+One batched POST of N operations vs N separate POSTs to /graphql/.
+
+    python -m benchmarks.batching [--operations 10] [--threads 4] [--repeat 50]
+
+Runs a page load's worth of small queries through the full middleware
+stack with Django's test client, with the response cache off so every
+operation executes. "saved/op" is the request-cycle overhead a batch
+avoids per operation.
+"""
+import argparse
+
+from benchmarks import format_row, setup_django, summarize, test_database, timed
+
+OPERATIONS = [
+    "query { allProducts(first: 5) { edges { node { id name price } } } }",
+    "query { allCustomers(first: 5) { edges { node { id name email } } } }",
+    "query { allOrders(first: 5) { edges { node { id totalAmount customer { name } } } } }",
+    "query { allProducts(first: 5, stock_Lte: 10) { totalCount } }",
+    "query { allCustomers(first: 3, orderBy: \"-lifetimeTotal\") { edges { node { name lifetimeTotal } } } }",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client, override_settings
+
+    from crm.synthetic import generate
+
+    payloads = [{'query': OPERATIONS[i % len(OPERATIONS)]} for i in range(args.operations)]
+
+    with test_database(), override_settings(GRAPHQL_RESPONSE_CACHE=None, GRAPHQL_BATCH_MAX_SIZE=None):
+        generate(200, 50, 2000)
+        client = Client()
+
+        def post(data):
+            response = client.post('/graphql/', data=data, content_type='application/json')
+            assert response.status_code == 200, response.content
+
+        def separate():
+            for payload in payloads:
+                post(payload)
+
+        def batched():
+            post(payloads)
+
+        cases = {'separate': separate, 'batch': batched}
+        if args.threads:
+            cases[f'batch, {args.threads} threads'] = lambda: post(payloads)
+        samples = {label: [] for label in cases}
+        for fn in cases.values():
+            fn()  # warm up
+        # Interleave the cases so machine noise hits them all alike
+        for _ in range(args.repeat):
+            for label, fn in cases.items():
+                threads = args.threads if 'threads' in label else 0
+                with override_settings(GRAPHQL_BATCH_THREADS=threads):
+                    samples[label].extend(timed(fn, 1))
+
+        baseline = summarize(samples['separate'])
+        print(f"{args.operations} operations per page load")
+        for label in cases:
+            summary = summarize(samples[label])
+            saved = (baseline['p50_ms'] - summary['p50_ms']) / args.operations
+            print(format_row(label, summary), f' saved/op {saved:6.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
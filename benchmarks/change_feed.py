@@ -0,0 +1,101 @@
+"""
+Hourly sync: full download of the connections vs polling changesSince.
+
+    python -m benchmarks.change_feed [--customers 5000 --products 500 --orders 20000] [--changed 50] [--repeat 5]
+
+"full download" pages through ``allCustomers``, ``allProducts`` and
+``allOrders`` 100 rows at a time, as the sync service does today.
+"changesSince" reads the changes since the last sync after ``--changed``
+products were restocked, customers renamed and orders deleted. Both run
+in-process with the response cache off.
+"""
+import argparse
+
+from benchmarks import format_row, setup_django, summarize, test_database, timed
+
+PAGE = """
+query($after: String) { %s(first: 100, after: $after) {
+  pageInfo { hasNextPage endCursor } edges { node { id %s } }
+} }
+"""
+
+FIELDS = {
+    'allCustomers': 'name email phone createdAt updatedAt',
+    'allProducts': 'name price stock updatedAt',
+    'allOrders': 'orderDate totalAmount updatedAt customer { id }',
+}
+
+FEED = """
+query($cursor: String) { changesSince(cursor: $cursor, first: 1000) {
+  cursor hasMore changes {
+    sequence model objectId deleted
+    customer { name email phone createdAt updatedAt }
+    product { name price stock updatedAt }
+    order { orderDate totalAmount updatedAt customer { id } }
+  }
+} }
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--changed', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db.models import F
+    from django.test import RequestFactory, override_settings
+
+    from alx_backend_graphql.schema import schema
+    from crm.models import Customer, Order, Product
+    from crm.synthetic import generate
+
+    def execute(query, **variables):
+        result = schema.execute(query, variable_values=variables, context_value=RequestFactory().post('/graphql/'))
+        assert result.errors is None, result.errors
+        return result.data
+
+    def full_download():
+        rows = 0
+        for connection, fields in FIELDS.items():
+            after = None
+            while True:
+                page = execute(PAGE % (connection, fields), after=after)[connection]
+                rows += len(page['edges'])
+                if not page['pageInfo']['hasNextPage']:
+                    break
+                after = page['pageInfo']['endCursor']
+        return rows
+
+    def sync(cursor):
+        rows = 0
+        while True:
+            feed = execute(FEED, cursor=cursor)['changesSince']
+            rows += len(feed['changes'])
+            if not feed['hasMore']:
+                return rows
+
+    with test_database(), override_settings(GRAPHQL_RESPONSE_CACHE=None):
+        generate(args.customers, args.products, args.orders)
+        cursor = execute(FEED, cursor=None)['changesSince']['cursor']
+        Product.objects.filter(pk__in=Product.objects.order_by('pk').values('pk')[:args.changed]).update(
+            stock=F('stock') + 10,
+        )
+        for customer in Customer.objects.order_by('pk')[:args.changed]:
+            customer.name += ' (renamed)'
+            customer.save()
+        Order.objects.filter(pk__in=list(Order.objects.order_by('pk').values_list('pk', flat=True)[:args.changed])).delete()
+
+        print(f"full download: {full_download()} rows, changesSince: {sync(cursor)} changes")
+        full = summarize(timed(full_download, args.repeat))
+        feed = summarize(timed(lambda: sync(cursor), args.repeat))
+        print(format_row('full download', full))
+        print(format_row('changesSince', feed), f" x{full['p50_ms'] / feed['p50_ms']:.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Per-request latency of /graphql/ with and without the document cache.
+
+    python -m benchmarks.document_cache [--requests 500]
+"""
+import argparse
+
+from benchmarks import format_row, setup_django, summarize, test_database, timed
+
+QUERY = """
+query Dashboard($first: Int) {
+  allOrders(first: $first) {
+    totalCount
+    edges { node { ...OrderFields } }
+  }
+  allProducts(first: $first, stock_Lte: 10) { edges { node { id name stock price } } }
+}
+fragment OrderFields on OrderType {
+  id
+  orderDate
+  totalAmount
+  customer { id name email }
+  lines { quantity unitPrice product { name } }
+}
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client, override_settings
+
+    from alx_backend_graphql import documents
+
+    with test_database():
+        client = Client()
+        payload = {'query': QUERY, 'variables': {'first': 1}}
+
+        def request():
+            response = client.post('/graphql/', data=payload, content_type='application/json')
+            assert response.status_code == 200, response.content
+
+        for label, size in (('no cache', 0), ('document cache', 1000)):
+            with override_settings(GRAPHQL_DOCUMENT_CACHE_SIZE=size):
+                documents.reset_document_cache()
+                request()  # warm up
+                print(format_row(label, summarize(timed(request, args.requests))))
+                print(' ' * 24, documents.get_document_cache().stats())
+        documents.reset_document_cache()
+
+
+if __name__ == '__main__':
+    main()
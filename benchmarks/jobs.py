@@ -0,0 +1,59 @@
+"""
+Job worker throughput vs starting a process per cron tick.
+
+    python -m benchmarks.jobs [--jobs 500] [--concurrency 4] [--pool thread] [--ticks 5]
+
+"process per tick" starts Python, sets up Django and runs the heartbeat
+once, as django-crontab does on every tick. "worker" queues ``--jobs``
+heartbeats and runs them with one ``Worker`` in burst mode (a process pool
+includes its start-up); its line shows the time per job, followed by the
+throughput and lag ``job_stats()`` reports for the run.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+from benchmarks import format_row, setup_django, summarize, test_database
+
+TICK = "import django; django.setup(); from crm.tasks import heartbeat; heartbeat()"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--pool', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--ticks', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from crm.jobs import Worker, enqueue, job_stats
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    samples = []
+    for _ in range(args.ticks):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', TICK], check=True, env=env)
+        samples.append(time.perf_counter() - start)
+    print(format_row('process per tick', summarize(samples)))
+
+    with test_database():
+        for _ in range(args.jobs):
+            enqueue('crm.heartbeat')
+        worker = Worker(args.concurrency, args.pool, poll_interval=0.01, schedule=())
+        start = time.perf_counter()
+        outcomes = worker.run(burst=True)
+        elapsed = time.perf_counter() - start
+        assert outcomes == {'succeeded': args.jobs}, outcomes
+        stats = job_stats(timedelta(seconds=elapsed))
+        print(format_row(f'worker, {args.pool} x{args.concurrency}', summarize([elapsed / args.jobs])),
+              f" {args.jobs / elapsed:.0f} jobs/s")
+        print(f"job_stats: {stats['throughput_per_minute']:.0f} jobs/min, "
+              f"start lag avg {stats['avg_start_lag_seconds'] * 1000:.1f}ms max {stats['max_start_lag_seconds'] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Queries on the primary vs on a read replica, while orders are written.
+
+    python -m benchmarks.replicas [--readers 4] [--seconds 5]
+
+``--readers`` threads post a nested ``allOrders`` query to /graphql/ in a
+loop while one thread places orders through ``createOrder``, for
+``--seconds`` each run. "primary" runs without replicas; "replica" reads
+from a SQLite copy of the test database (``DB_REPLICAS``, refreshed by
+``sync_sqlite_replicas()`` before the run). The response cache is off so
+every query executes.
+
+In one process on SQLite the two runs come out close: the threads share
+the GIL, and SQLite readers hardly hold up the writer. The split pays off
+with PostgreSQL and several workers, where replica reads leave the
+primary's CPU and I/O to the writes.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks import format_row, setup_django, summarize, test_database
+
+QUERY = """
+query { allOrders(first: 50) { edges { node { totalAmount customer { name } lines { quantity product { name } } } } } }
+"""
+CREATE_ORDER = """
+mutation($customer: ID!, $product: ID!) {
+  createOrder(input: {customerId: $customer, lines: [{productId: $product, quantity: 1}]}) { order { id } }
+}
+"""
+
+
+def run(readers, seconds, customer, product):
+    """``(query samples, orders placed)`` over ``seconds``."""
+    from django.db import connections
+    from django.test import Client
+
+    stop = threading.Event()
+    samples = []
+    orders = []
+
+    def read():
+        client = Client()
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                response = client.post('/graphql/', data={'query': QUERY}, content_type='application/json')
+                samples.append(time.perf_counter() - start)
+                assert 'errors' not in response.json(), response.content
+        finally:
+            connections.close_all()
+
+    def write():
+        client = Client()
+        variables = {'customer': customer.pk, 'product': product.pk}
+        try:
+            while not stop.is_set():
+                response = client.post('/graphql/', data={'query': CREATE_ORDER, 'variables': variables},
+                                       content_type='application/json')
+                assert 'errors' not in response.json(), response.content
+                orders.append(1)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=read) for _ in range(readers)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return samples, len(orders)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    # Before the settings load; the test database gets its own replica file
+    os.environ.setdefault('DB_REPLICAS', os.path.join(tempfile.gettempdir(), 'crm_replica.sqlite3'))
+    setup_django()
+    from django.test import override_settings
+
+    from alx_backend_graphql.routing import sync_sqlite_replicas
+    from crm.models import Customer, Product
+    from crm.synthetic import generate
+
+    with test_database(), override_settings(GRAPHQL_RESPONSE_CACHE=None):
+        generate(200, 50, 2000)
+        customer = Customer.objects.first()
+        product = Product.objects.create(name="Hot product", price=1, stock=10 ** 6)
+        sync_sqlite_replicas()
+        for label, replicas in (('primary', []), ('replica', None)):
+            settings = {} if replicas is None else {'DATABASE_REPLICAS': replicas}
+            with override_settings(**settings):
+                samples, orders = run(args.readers, args.seconds, customer, product)
+            print(format_row(label, summarize(samples)),
+                  f" {len(samples) / args.seconds:7.1f} queries/s {orders / args.seconds:7.1f} orders/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+createOrder throughput on a few hot products: per-order stock UPDATEs vs
+in-memory reservations flushed in batches.
+
+    python -m benchmarks.stock [--threads 8] [--orders 200] [--products 3] [--shards 4] [--flush-interval 0.5]
+
+Every thread places ``--orders`` orders of one unit of each hot product
+with ``place_order``. "per-order transaction" decrements ``Product.stock``
+in each order's transaction; "reservations" goes through a ``StockEngine``
+flushing every ``--flush-interval`` seconds. After each run the stock
+taken must equal the units ordered.
+"""
+import argparse
+import threading
+import time
+
+from benchmarks import setup_django, test_database
+
+
+def run(threads, orders, customer, quantities, engine):
+    from django.db import connection
+
+    from crm.orders import place_order
+
+    def place():
+        try:
+            for _ in range(orders):
+                place_order(customer, quantities, engine=engine)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=place) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=200, help="Orders per thread.")
+    parser.add_argument('--products', type=int, default=3)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--flush-interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    setup_django()
+    from decimal import Decimal
+
+    from django.db.models import Sum
+
+    from crm.models import Customer, Product
+    from crm.reservations import StockEngine
+
+    total = args.threads * args.orders
+    with test_database():
+        customer = Customer.objects.create(name="Flash", email="flash@example.com")
+        for label in ('per-order transaction', 'reservations'):
+            products = Product.objects.bulk_create(
+                Product(name=f"{label} {i}", price=Decimal('9.99'), stock=total) for i in range(args.products)
+            )
+            quantities = {product.pk: 1 for product in products}
+            engine = None
+            if label == 'reservations':
+                engine = StockEngine(args.shards)
+                engine.start(args.flush_interval)
+            elapsed = run(args.threads, args.orders, customer, quantities, engine)
+            if engine is not None:
+                engine.stop()
+            left = Product.objects.filter(pk__in=quantities).aggregate(left=Sum('stock'))['left']
+            assert left == 0, f"{label}: {left} units left, expected 0"
+            print(f"{label:<24} {total} orders in {elapsed:6.2f}s  {total / elapsed:8.0f} orders/s")
+
+
+if __name__ == '__main__':
+    main()
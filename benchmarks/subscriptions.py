@@ -0,0 +1,111 @@
+"""
+Fan-out of GraphQL subscriptions to many websocket clients.
+
+    python -m benchmarks.subscriptions [--clients 500] [--orders 10]
+
+``--clients`` simulated dashboards connect to the ASGI app in-process
+(``crm.tests.InProcessWebSocket``, no server or network) and subscribe to
+``orderCreated``. Then ``--orders`` orders are placed one after another
+through the ``createOrder`` mutation in a thread, as an HTTP request would.
+A row's latency runs from the mutation being sent to a client reading the
+event, over every client and order.
+
+"shared" sends every client the same query, so they all join one group.
+"per client" makes each query text unique, so every client runs its own
+subscription, as happens when each dashboard polls on its own.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks import format_row, setup_django, summarize, test_database
+
+SUBSCRIPTION = """
+subscription %s{ orderCreated { id totalAmount customer { name email } lines { quantity product { name } } } }
+"""
+CREATE_ORDER = """
+mutation($customer: ID!, $product: ID!) {
+  createOrder(input: {customerId: $customer, lines: [{productId: $product, quantity: 1}]}) { order { id } }
+}
+"""
+
+
+async def run(clients, orders, shared, customer, product):
+    from asgiref.sync import sync_to_async
+    from django.test import RequestFactory
+
+    from alx_backend_graphql.schema import schema
+    from alx_backend_graphql.subscriptions import GraphQLWebSocketApp
+    from crm.tests import InProcessWebSocket
+
+    app = GraphQLWebSocketApp()
+    sockets = []
+    for i in range(clients):
+        socket = InProcessWebSocket(app)
+        await socket.connect()
+        await socket.send_json({'type': 'connection_init'})
+        # Unique text, and so a group of its own, unless shared
+        query = SUBSCRIPTION % ('' if shared else f'Client{i} ')
+        await socket.send_json({'id': '1', 'type': 'subscribe', 'payload': {'query': query}})
+        sockets.append(socket)
+    for socket in sockets:
+        assert (await socket.receive_json())['type'] == 'connection_ack'
+    await asyncio.sleep(0.1)
+    groups = len(app.groups)
+
+    def place_order():
+        result = schema.execute(
+            CREATE_ORDER, variable_values={'customer': customer.pk, 'product': product.pk},
+            context_value=RequestFactory().post('/graphql/'),
+        )
+        assert result.errors is None, result.errors
+
+    async def read(socket):
+        arrivals = []
+        for _ in range(orders):
+            message = await socket.receive_json(timeout=60)
+            assert message['type'] == 'next' and 'errors' not in message['payload'], message
+            arrivals.append(time.perf_counter())
+        return arrivals
+
+    readers = [asyncio.ensure_future(read(socket)) for socket in sockets]
+    published = []
+    start = time.perf_counter()
+    for _ in range(orders):
+        published.append(time.perf_counter())
+        # Off the event loop, like a request thread
+        await sync_to_async(place_order, thread_sensitive=False)()
+    arrivals = await asyncio.gather(*readers)
+    elapsed = time.perf_counter() - start
+    for socket in sockets:
+        await socket.disconnect()
+
+    samples = []
+    for client in arrivals:
+        # Events arrive in order
+        samples.extend(received - sent for received, sent in zip(client, published))
+    return groups, samples, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    from decimal import Decimal
+
+    from crm.models import Customer, Product
+
+    with test_database():
+        customer = Customer.objects.create(name="Dashboard", email="dashboard@example.com")
+        product = Product.objects.create(name="Widget", price=Decimal('9.99'), stock=10 ** 6)
+        for label, shared in (('shared', True), ('per client', False)):
+            groups, samples, elapsed = asyncio.run(run(args.clients, args.orders, shared, customer, product))
+            print(format_row(f'{label}, {groups} group(s)', summarize(samples)),
+                  f" {len(samples) / elapsed:8.0f} events/s delivered")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Fixed corpus of queries and mutations run in-process against a synthetic dataset.
+
+    python -m benchmarks.suite [--customers 2000 --products 200 --orders 20000]
+                               [--repeat 30] [--output run.json] [--compare baseline.json]
+
+Each case reports p50/p95 latency, SQL statements per execution and the
+peak Python allocation of one execution (measured in a separate pass, as
+tracemalloc slows everything down). Mutations run inside a rolled-back
+transaction so every iteration sees the same data. ``--output`` saves the
+results as JSON; ``--compare`` prints the change against a saved run.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from benchmarks import setup_django, summarize, test_database
+
+CORPUS = {
+    'allCustomers': ("""
+        query { allCustomers(first: 50) { totalCount edges { node { id name email createdAt } } } }
+    """, {}),
+    'allCustomers nested': ("""
+        query {
+          allCustomers(first: 20) { edges { node {
+            name
+            orders(first: 10) { edges { node { totalAmount products { edges { node { name } } } } } }
+          } } }
+        }
+    """, {}),
+    'allCustomers filtered': ("""
+        query($name: String) { allCustomers(first: 50, name: $name) { edges { node { id email } } } }
+    """, {'name': '0-1'}),
+    'allCustomers search': ("""
+        query($q: String) { allCustomers(first: 50, search: $q) { edges { node { id name } } } }
+    """, {'q': 'customer12'}),
+    'allOrders search': ("""
+        query($q: String) { allOrders(first: 50, search: $q) { edges { node { id totalAmount } } } }
+    """, {'q': 'product 0-17'}),
+    'allCustomersKeyset': ("""
+        query { allCustomersKeyset(first: 100) { pageInfo { endCursor } edges { node { id name } } } }
+    """, {}),
+    'allProducts': ("""
+        query { allProducts(first: 100) { totalCount edges { node { id name price stock } } } }
+    """, {}),
+    'allProducts low stock': ("""
+        query { allProducts(first: 100, stock_Lte: 10) { edges { node { id name stock } } } }
+    """, {}),
+    'allOrders nested': ("""
+        query {
+          allOrders(first: 50) { totalCount edges { node {
+            id orderDate totalAmount
+            customer { name email }
+            lines { quantity unitPrice product { name } }
+          } } }
+        }
+    """, {}),
+    'allOrders filtered': ("""
+        query($min: Decimal) { allOrders(first: 50, totalAmount_Gte: $min) { edges { node { id totalAmount } } } }
+    """, {'min': '500'}),
+    'allOrdersKeyset deep': ("""
+        query { allOrdersKeyset(first: 100) { edges { node { id customer { email } } } } }
+    """, {}),
+    'createCustomer': ("""
+        mutation { createCustomer(input: {name: "Bench", email: "bench@example.com", phone: "+15550100"}) {
+          customer { id }
+        } }
+    """, {}),
+    'bulkCreateCustomers': ("""
+        mutation($inputs: [CustomerInput]!) { bulkCreateCustomers(inputs: $inputs) { customers { id } errors } }
+    """, {'inputs': [{'name': f'Bulk {i}', 'email': f'bulk{i}@example.com'} for i in range(100)]}),
+    'createProduct': ("""
+        mutation { createProduct(input: {name: "Bench", price: "9.99", stock: 5}) { product { id } } }
+    """, {}),
+    'createOrder': ("""
+        mutation($customer: ID!, $products: [ID]) {
+          createOrder(input: {customerId: $customer, productIds: $products}) { order { id totalAmount } }
+        }
+    """, None),
+    'updateLowStockProducts': ("""
+        mutation { updateLowStockProducts { success updatedCount } }
+    """, {}),
+}
+
+COMPARED = ('p50_ms', 'p95_ms', 'queries', 'peak_kib')
+
+
+class Rollback(Exception):
+    pass
+
+
+def make_runner(schema, query, variables):
+    from django.db import transaction
+    from django.http import HttpRequest
+
+    is_mutation = query.lstrip().startswith('mutation')
+
+    def run():
+        def execute():
+            result = schema.execute(query, variable_values=variables, context_value=HttpRequest())
+            assert not result.errors, result.errors
+        if not is_mutation:
+            return execute()
+        try:
+            with transaction.atomic():
+                execute()
+                raise Rollback
+        except Rollback:
+            pass
+    return run
+
+
+def measure(run, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    run()  # warm up
+    samples = []
+    with CaptureQueriesContext(connection) as ctx:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    summary = summarize(samples)
+    # Savepoint statements of the rolled-back mutations are not the API's
+    statements = [q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+    summary.update(queries=len(statements) / repeat, peak_kib=peak / 1024)
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    print()
+    print('{:<24}'.format('change vs baseline') + ''.join(f'{name:>12}' for name in COMPARED))
+    for case, summary in results.items():
+        before = baseline.get('results', {}).get(case)
+        if before is None:
+            continue
+        cells = []
+        for name in COMPARED:
+            if before.get(name):
+                cells.append(f'{(summary[name] / before[name] - 1) * 100:+11.1f}%')
+            else:
+                cells.append(f'{summary[name] - before.get(name, 0):+12.1f}')
+        print(f'{case:<24}' + ''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--case', action='append', help="Only run these cases (repeatable).")
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    args = parser.parse_args()
+
+    setup_django()
+    from alx_backend_graphql.schema import schema
+    from crm.models import Customer, Product
+    from crm.synthetic import generate
+
+    with test_database():
+        generate(args.customers, args.products, args.orders, seed=args.seed)
+        CORPUS['createOrder'] = (CORPUS['createOrder'][0], {
+            'customer': str(Customer.objects.order_by('pk').values_list('pk', flat=True).first()),
+            'products': [str(pk) for pk in Product.objects.filter(stock__gt=0).values_list('pk', flat=True)[:3]],
+        })
+
+        results = {}
+        print('{:<24}{:>10}{:>10}{:>10}{:>12}'.format('case', 'p50 ms', 'p95 ms', 'queries', 'peak KiB'))
+        for case, (query, variables) in CORPUS.items():
+            if args.case and case not in args.case:
+                continue
+            summary = measure(make_runner(schema, query, variables), args.repeat)
+            results[case] = summary
+            print('{:<24}{p50_ms:>10.2f}{p95_ms:>10.2f}{queries:>10.1f}{peak_kib:>12.0f}'.format(case, **summary))
+
+    run = {
+        'meta': {
+            'customers': args.customers, 'products': args.products, 'orders': args.orders,
+            'seed': args.seed, 'repeat': args.repeat,
+            'revision': git_revision(), 'python': platform.python_version(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
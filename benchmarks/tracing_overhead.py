@@ -0,0 +1,90 @@
+"""
+Cost of resolver tracing on a nested /graphql/ query.
+
+    python -m benchmarks.tracing_overhead [--requests 200]
+
+"baseline" removes the SQL hook as well, i.e. the view as it was before
+tracing existed; "tracing off" is the default production setup.
+"""
+import argparse
+from decimal import Decimal
+
+from benchmarks import format_row, setup_django, summarize, test_database, timed
+
+QUERY = """
+query {
+  allCustomers(first: 20) {
+    edges { node {
+      email
+      orders(first: 10) { edges { node { totalAmount customer { email } products { edges { node { name } } } } } }
+    } }
+  }
+}
+"""
+
+
+def seed():
+    from crm.models import Customer, Order, Product
+
+    customers = Customer.objects.bulk_create(
+        Customer(name=f"Customer {i}", email=f"customer{i}@example.com") for i in range(20)
+    )
+    products = Product.objects.bulk_create(
+        Product(name=f"Product {i}", price=Decimal('9.99'), stock=100) for i in range(3)
+    )
+    orders = Order.objects.bulk_create(
+        Order(customer=customer, total_amount=Decimal('29.97')) for customer in customers for _ in range(10)
+    )
+    Order.products.through.objects.bulk_create(
+        Order.products.through(order_id=order.pk, product_id=product.pk, unit_price=product.price)
+        for order in orders for product in products
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.test import Client, override_settings
+
+    from alx_backend_graphql.tracing import sql_hook
+
+    with test_database():
+        seed()
+        client = Client()
+
+        def request():
+            response = client.post('/graphql/', data={'query': QUERY}, content_type='application/json')
+            assert response.status_code == 200, response.content
+
+        configs = {
+            'baseline': None,
+            'tracing off': {'GRAPHQL_TRACING': False, 'DEBUG': False},
+            'tracing on': {'GRAPHQL_TRACING': True, 'DEBUG': False},
+            'tracing + extensions': {'GRAPHQL_TRACING': True, 'DEBUG': True},
+        }
+        samples = {label: [] for label in configs}
+        request()  # warm up
+        # Interleave the configurations so machine noise hits them all alike
+        for _ in range(args.requests):
+            for label, overrides in configs.items():
+                if overrides is None:
+                    connection.execute_wrappers.remove(sql_hook)
+                    samples[label].extend(timed(request, 1))
+                    connection.execute_wrappers.append(sql_hook)
+                else:
+                    with override_settings(**overrides):
+                        samples[label].extend(timed(request, 1))
+
+        baseline = summarize(samples['baseline'])
+        for label in configs:
+            summary = summarize(samples[label])
+            overhead = (summary['p50_ms'] / baseline['p50_ms'] - 1) * 100
+            print(format_row(label, summary), f' p50 {overhead:+.1f}%')
+
+
+if __name__ == '__main__':
+    main()
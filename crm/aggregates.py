@@ -0,0 +1,131 @@
+"""
+Denormalized order totals per customer and per product.
+
+``CustomerStats`` (order count, lifetime total, last order date) and
+``ProductStats`` (times ordered, units sold, revenue) let the API read and
+sort by these totals without aggregating every order per request:
+
+- ``record_order`` adds one order to both tables inside the transaction
+  that creates it (``place_order`` calls it);
+- ``forget_orders`` takes orders about to be deleted out of the product
+  totals, in the deleting transaction;
+- ``rebuild_aggregates`` recomputes both tables from the orders, for bulk
+  writes that skip ``place_order``. Run it with
+  ``manage.py rebuild_crm_aggregates``.
+
+The totals cover the orders that exist: deleting a customer drops their
+row along with their orders, and a cleanup calls ``forget_orders`` for
+the product totals.
+"""
+from django.db import connections, transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Round
+
+from alx_backend_graphql.response_cache import invalidate
+from crm.bulk import chunked
+from crm.models import Customer, CustomerStats, Order, OrderLine, Product, ProductStats
+
+
+def record_order(order, quantities, prices):
+    """Add ``order`` ({product_id: quantity} at ``prices``) to the totals.
+
+    Rows are created on first use with ``INSERT ... ON CONFLICT DO NOTHING``
+    and then incremented in place, so concurrent orders never lose an
+    update. Must run inside the order's transaction.
+    """
+    CustomerStats.objects.bulk_create([CustomerStats(customer_id=order.customer_id)], ignore_conflicts=True)
+    CustomerStats.objects.filter(pk=order.customer_id).update(
+        order_count=F('order_count') + 1,
+        # SQLite adds decimals in floating point; rounding keeps errors from piling up
+        lifetime_total=Round(F('lifetime_total') + order.total_amount, 2),
+        last_order_date=Greatest(Coalesce('last_order_date', Value(order.order_date)), Value(order.order_date)),
+    )
+
+    ProductStats.objects.bulk_create([ProductStats(product_id=pk) for pk in quantities], ignore_conflicts=True)
+    money = DecimalField(max_digits=14, decimal_places=2)
+    ProductStats.objects.filter(pk__in=quantities).update(
+        times_ordered=F('times_ordered') + 1,
+        units_sold=F('units_sold') + Case(*[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()]),
+        revenue=Round(F('revenue') + Case(
+            *[When(pk=pk, then=Value(qty * prices[pk], output_field=money)) for pk, qty in quantities.items()],
+            output_field=money,
+        ), 2),
+    )
+    # QuerySet.update() sends no signals
+    invalidate(Customer, Product)
+
+
+def forget_orders(orders, chunk_size=500):
+    """Subtract the lines of ``orders`` (a queryset) from the product totals,
+    with one ``UPDATE ... CASE`` per ``chunk_size`` products. Call it in the
+    transaction deleting them, before the delete. Returns the products
+    updated.
+    """
+    money = DecimalField(max_digits=14, decimal_places=2)
+    totals = OrderLine.objects.filter(order__in=orders).order_by().values('product_id').annotate(
+        times_ordered=Count('*'),
+        units_sold=Sum('quantity'),
+        revenue=Round(Sum(F('quantity') * F('unit_price'), output_field=money), 2),
+    ).values_list('product_id', 'times_ordered', 'units_sold', 'revenue')
+    updated = 0
+    for chunk in chunked(totals, chunk_size):
+        def by_product(column, output_field=None):
+            return Case(
+                *[When(pk=row[0], then=Value(row[column], output_field=output_field)) for row in chunk],
+                output_field=output_field,
+            )
+
+        updated += ProductStats.objects.filter(pk__in=[row[0] for row in chunk]).update(
+            times_ordered=F('times_ordered') - by_product(1),
+            units_sold=F('units_sold') - by_product(2),
+            revenue=Round(F('revenue') - by_product(3, money), 2),
+        )
+    if updated:
+        # QuerySet.update() sends no signals
+        invalidate(Product)
+    return updated
+
+
+def insert_from(model, columns, queryset):
+    """``INSERT INTO model (columns) SELECT ...`` the rows of ``queryset``."""
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(c) for c in columns)}) {sql}", params,
+        )
+        return cursor.rowcount
+
+
+def rebuild_customer_stats():
+    CustomerStats.objects.all().delete()
+    totals = Order.objects.order_by().values('customer_id').annotate(
+        order_count=Count('*'), lifetime_total=Round(Sum('total_amount'), 2), last_order_date=Max('order_date'),
+    ).values_list('customer_id', 'order_count', 'lifetime_total', 'last_order_date')
+    return insert_from(CustomerStats, ('customer_id', 'order_count', 'lifetime_total', 'last_order_date'), totals)
+
+
+def rebuild_product_stats():
+    ProductStats.objects.all().delete()
+    totals = OrderLine.objects.order_by().values('product_id').annotate(
+        times_ordered=Count('*'),
+        units_sold=Sum('quantity'),
+        revenue=Round(Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2)), 2),
+    ).values_list('product_id', 'times_ordered', 'units_sold', 'revenue')
+    return insert_from(ProductStats, ('product_id', 'times_ordered', 'units_sold', 'revenue'), totals)
+
+
+def rebuild_aggregates(customers=True, products=True):
+    """Recompute the totals from scratch, each table in one ``INSERT ... SELECT``.
+
+    Returns the number of rows written per table.
+    """
+    rebuilt = {}
+    with transaction.atomic():
+        if customers:
+            rebuilt['customers'] = rebuild_customer_stats()
+        if products:
+            rebuilt['products'] = rebuild_product_stats()
+        invalidate(Customer, Product)
+    return rebuilt
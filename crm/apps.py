@@ -1,5 +1,24 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CrmConfig(AppConfig):
     name = 'crm'
+
+    def ready(self):
+        # Hooks every database connection for GraphQL tracing as it opens
+        import alx_backend_graphql.tracing  # noqa: F401
+        # Registers the job queue's tasks
+        import crm.tasks  # noqa: F401
+        from alx_backend_graphql.response_cache import watch
+        from crm.changes import repair_change_log
+        from crm.models import Customer, Order, OrderLine, Product
+        from crm.search import repair_search_index
+
+        post_migrate.connect(repair_search_index, sender=self)
+        post_migrate.connect(repair_change_log, sender=self)
+        watch(Customer)
+        watch(Product)
+        watch(Order)
+        # Lines belong to their order; cleanup cascades them in bulk
+        watch(OrderLine, tag_model=Order, signals=False)
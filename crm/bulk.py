@@ -0,0 +1,88 @@
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+
+from alx_backend_graphql.response_cache import invalidate
+from crm.models import Customer
+
+BULK_CHUNK_SIZE = 1000
+
+
+def is_valid_phone(phone):
+    return phone.replace('-', '').replace('+', '').isdigit()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def validate_customers(rows):
+    """Validate a chunk in memory; returns (customers, errors).
+
+    Duplicates are checked against the chunk itself and against the
+    database with a single ``email__in`` query.
+    """
+    customers, errors, seen = [], [], set()
+    candidates = []
+    for row in rows:
+        if not isinstance(row, dict):
+            # e.g. an NDJSON line holding a list or a number
+            errors.append(f"Each customer must be an object, got {type(row).__name__}")
+            continue
+        name, email, phone = row.get('name'), row.get('email'), row.get('phone')
+        if not name or not email:
+            errors.append("Name and email are required")
+        elif phone and not is_valid_phone(phone):
+            errors.append(f"Invalid phone format for {email}")
+        elif email in seen:
+            errors.append(f"Email {email} is duplicated in this batch")
+        else:
+            seen.add(email)
+            candidates.append(Customer(name=name, email=email, phone=phone))
+
+    existing = set(
+        Customer.objects.filter(email__in=seen).values_list('email', flat=True)
+    )
+    for customer in candidates:
+        if customer.email in existing:
+            errors.append(f"Email {customer.email} already exists")
+        else:
+            customers.append(customer)
+    return customers, errors
+
+
+def insert_customers(customers):
+    """Insert one validated chunk, falling back to row by row on a race."""
+    try:
+        with transaction.atomic():
+            created = Customer.objects.bulk_create(customers)
+            # bulk_create() sends no signals
+            invalidate(Customer)
+            return created, []
+    except IntegrityError:
+        pass
+    # Another writer took some of these emails after validation
+    created, errors = [], []
+    for customer in customers:
+        try:
+            with transaction.atomic():
+                customer.save()
+            created.append(customer)
+        except IntegrityError:
+            errors.append(f"Email {customer.email} already exists")
+    return created, errors
+
+
+def iter_bulk_create_customers(rows, chunk_size=BULK_CHUNK_SIZE):
+    """Create customers from ``rows`` chunk by chunk.
+
+    Yields ``(created, errors)`` per chunk so callers can stream results
+    without holding the whole batch; each chunk commits on its own unless
+    the caller wraps the loop in a transaction.
+    """
+    for chunk in chunked(rows, chunk_size):
+        customers, errors = validate_customers(chunk)
+        created, insert_errors = insert_customers(customers) if customers else ([], [])
+        yield created, errors + insert_errors
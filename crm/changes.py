@@ -0,0 +1,238 @@
+"""
+Change feed for customers, products and orders, behind ``changesSince``.
+
+Triggers on the three tables append a ``Change`` row for every insert,
+update and delete, and keep ``updated_at`` current, so every write path
+(``save``, ``QuerySet.update``, the cascade deletes of the customer
+cleanup, raw SQL) is recorded. An order's ``stock_pending`` flag is left
+out: it is stock bookkeeping, not a change to the order.
+
+A sync client polls ``changesSince(cursor)`` and gets the objects changed
+after ``cursor``, each once with its current row or as a tombstone, plus
+the cursor to poll from next. ``changesSince`` without a cursor returns
+the head of the log: take it before a full download, then poll from it.
+
+- SQLite commits one writer at a time, so ``Change.id`` order is commit
+  order and the cursor is the last id read.
+- On PostgreSQL ids are handed out before commit: a transaction can commit
+  a lower id after a reader has moved past it. The triggers record the
+  transaction id, and the feed only reads changes of transactions older
+  than every running one, in (transaction id, id) order.
+
+The log is pruned after ``CRM_CHANGE_RETENTION_DAYS``; a cursor older than
+that is refused and the client has to download everything again.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Min, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from crm.models import Change, Customer, Order, Product
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_RETENTION_DAYS = 30
+
+# Change.model -> (model, columns whose writes count as changes)
+TRACKED = {
+    'customer': (Customer, ('name', 'email', 'phone', 'created_at')),
+    'product': (Product, ('name', 'price', 'stock')),
+    'order': (Order, ('customer_id', 'order_date', 'total_amount')),
+}
+
+SQLITE_NOW = "STRFTIME('%Y-%m-%d %H:%M:%f', 'NOW')"
+
+
+class ExpiredCursor(Exception):
+    pass
+
+
+def trigger_names(kind):
+    table = TRACKED[kind][0]._meta.db_table
+    return [f'{table}_{suffix}' for suffix in ('touch', 'log_ai', 'log_au', 'log_ad')]
+
+
+def sqlite_statements(kind):
+    model, columns = TRACKED[kind]
+    table = model._meta.db_table
+    touch, insert, update, delete = trigger_names(kind)
+    log = "INSERT INTO crm_change (model, object_id, deleted, txid, changed_at) VALUES ('{}', {}.id, {}, 0, {});"
+    cols = ', '.join(columns)
+    return [
+        # save() sets updated_at itself; other writes leave it as it was
+        f"CREATE TRIGGER IF NOT EXISTS {touch} AFTER UPDATE OF {cols} ON {table} "
+        f"WHEN new.updated_at IS old.updated_at BEGIN "
+        f"UPDATE {table} SET updated_at = {SQLITE_NOW} WHERE id = new.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS {insert} AFTER INSERT ON {table} BEGIN "
+        f"{log.format(kind, 'new', 0, SQLITE_NOW)} END",
+        f"CREATE TRIGGER IF NOT EXISTS {update} AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"{log.format(kind, 'new', 0, SQLITE_NOW)} END",
+        f"CREATE TRIGGER IF NOT EXISTS {delete} AFTER DELETE ON {table} BEGIN "
+        f"{log.format(kind, 'old', 1, SQLITE_NOW)} END",
+    ]
+
+
+POSTGRES_FUNCTIONS = [
+    """CREATE OR REPLACE FUNCTION crm_touch_updated_at() RETURNS trigger AS $$
+    BEGIN NEW.updated_at = now(); RETURN NEW; END $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION crm_log_change() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO crm_change (model, object_id, deleted, txid, changed_at) VALUES (
+            TG_ARGV[0], CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END, TG_OP = 'DELETE',
+            pg_current_xact_id()::text::bigint, now()
+        );
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+]
+
+
+def postgres_statements(kind):
+    model, columns = TRACKED[kind]
+    table = model._meta.db_table
+    touch, log = trigger_names(kind)[:2]
+    cols = ', '.join(columns)
+    return [
+        f"DROP TRIGGER IF EXISTS {touch} ON {table}",
+        f"CREATE TRIGGER {touch} BEFORE UPDATE OF {cols} ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION crm_touch_updated_at()",
+        f"DROP TRIGGER IF EXISTS {log} ON {table}",
+        f"CREATE TRIGGER {log} AFTER INSERT OR DELETE OR UPDATE OF {cols} ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION crm_log_change('{kind}')",
+    ]
+
+
+def missing_triggers(cursor):
+    names = [name for kind in TRACKED for name in trigger_names(kind)]
+    cursor.execute(
+        f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join(['%s'] * len(names))})",
+        names,
+    )
+    return set(names) - {row[0] for row in cursor.fetchall()}
+
+
+def install_change_log(connection):
+    """Create the change-log triggers that are missing. Idempotent."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            if not missing_triggers(cursor):
+                return
+            for kind in TRACKED:
+                for statement in sqlite_statements(kind):
+                    cursor.execute(statement)
+        elif connection.vendor == 'postgresql':
+            for statement in POSTGRES_FUNCTIONS:
+                cursor.execute(statement)
+            for kind in TRACKED:
+                for statement in postgres_statements(kind):
+                    cursor.execute(statement)
+
+
+def uninstall_change_log(connection):
+    with connection.cursor() as cursor:
+        for kind, (model, columns) in TRACKED.items():
+            for name in trigger_names(kind):
+                if connection.vendor == 'sqlite':
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+                elif connection.vendor == 'postgresql':
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {name} ON {model._meta.db_table}')
+        if connection.vendor == 'postgresql':
+            cursor.execute('DROP FUNCTION IF EXISTS crm_touch_updated_at()')
+            cursor.execute('DROP FUNCTION IF EXISTS crm_log_change()')
+
+
+def repair_change_log(sender, using, **kwargs):
+    """``post_migrate`` receiver: put back triggers a table remake dropped.
+
+    Skipped while the log isn't migrated in (or was migrated out): the
+    triggers would write to a ``crm_change`` table that isn't there.
+    """
+    connection = connections[using]
+    if router.allow_migrate(using, 'crm') and Change._meta.db_table in connection.introspection.table_names():
+        install_change_log(connection)
+
+
+def encode_cursor(txid, sequence):
+    return f'{txid}.{sequence}'
+
+
+def decode_cursor(cursor):
+    try:
+        txid, sequence = (int(part) for part in cursor.split('.'))
+    except ValueError:
+        raise ValueError(f"Invalid change cursor {cursor!r}")
+    return txid, sequence
+
+
+class Feed:
+    """The readable part of the change log, in feed order."""
+
+    def __init__(self, using='default'):
+        self.postgres = connections[using].vendor == 'postgresql'
+        self.changes = Change.objects.using(using)
+        if self.postgres:
+            # Transactions below the snapshot's xmin have all finished
+            self.changes = self.changes.filter(
+                txid__lt=RawSQL('pg_snapshot_xmin(pg_current_snapshot())::text::bigint', []),
+            )
+        self.order = ('txid', 'id') if self.postgres else ('id',)
+
+    def after(self, txid, sequence):
+        if self.postgres:
+            return self.changes.filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=sequence))
+        return self.changes.filter(id__gt=sequence)
+
+    def head(self):
+        last = self.changes.order_by(*(f'-{field}' for field in self.order)).values_list('txid', 'id').first()
+        return encode_cursor(*last) if last else encode_cursor(0, 0)
+
+    def check_retained(self, sequence):
+        # Ids are contiguous on SQLite; PostgreSQL may skip a few, which at
+        # worst sends a client that is exactly at the retention edge to resync
+        oldest = Change.objects.using(self.changes.db).aggregate(oldest=Min('id'))['oldest']
+        if oldest is not None and sequence < oldest - 1:
+            raise ExpiredCursor("Cursor is older than the change log; download everything again")
+
+
+def changes_since(cursor=None, first=DEFAULT_PAGE_SIZE, using='default'):
+    """``(changes, next cursor, has_more)`` for the changes after ``cursor``.
+
+    Each changed object appears once, at its latest change in the page; a
+    change carries its current row as ``instance``, or ``deleted`` if the
+    row is gone.
+    """
+    if not 0 < first <= MAX_PAGE_SIZE:
+        raise ValueError(f"first must be between 1 and {MAX_PAGE_SIZE}")
+    feed = Feed(using)
+    if cursor is None:
+        return [], feed.head(), False
+    txid, sequence = decode_cursor(cursor)
+    feed.check_retained(sequence)
+    page = list(feed.after(txid, sequence).order_by(*feed.order)[:first + 1])
+    has_more = len(page) > first
+    page = page[:first]
+    if not page:
+        return [], cursor, False
+    latest = {}
+    for change in page:
+        latest.pop((change.model, change.object_id), None)
+        latest[(change.model, change.object_id)] = change
+    changes = list(latest.values())
+    for kind, (model, columns) in TRACKED.items():
+        ids = [change.object_id for change in changes if change.model == kind and not change.deleted]
+        rows = model.objects.using(using).in_bulk(ids) if ids else {}
+        for change in changes:
+            if change.model == kind:
+                change.instance = rows.get(change.object_id)
+                # Deleted after this page: say so now rather than send nothing
+                change.deleted = change.instance is None
+    return changes, encode_cursor(page[-1].txid, page[-1].id), has_more
+
+
+def prune_changes(days=None):
+    """Delete changes older than ``days`` (default ``CRM_CHANGE_RETENTION_DAYS``)."""
+    if days is None:
+        days = getattr(settings, 'CRM_CHANGE_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    return Change.objects.filter(changed_at__lt=timezone.now() - timedelta(days=days)).delete()[0]
@@ -0,0 +1,52 @@
+import time
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from crm.aggregates import forget_orders
+from crm.models import Customer, Order, OrderLine
+
+CLEANUP_CHUNK_SIZE = 500
+
+
+def inactive_customers(cutoff):
+    """Customers older than ``cutoff`` without an order since.
+
+    ``NOT EXISTS`` probes ``crm_order_customer_date_idx`` once per customer
+    instead of joining every order.
+    """
+    recent_orders = Order.objects.filter(customer=OuterRef('pk'), order_date__gte=cutoff)
+    return Customer.objects.filter(created_at__lt=cutoff).filter(~Exists(recent_orders))
+
+
+def count_inactive_customers(cutoff):
+    """``(customers, orders, lines)`` a cleanup would delete."""
+    customers = inactive_customers(cutoff)
+    orders = Order.objects.filter(customer__in=customers.values('pk'))
+    lines = OrderLine.objects.filter(order__in=orders.values('pk'))
+    return customers.count(), orders.count(), lines.count()
+
+
+def iter_delete_inactive_customers(cutoff, chunk_size=CLEANUP_CHUNK_SIZE, sleep=0):
+    """Delete inactive customers ``chunk_size`` at a time, walking the primary key.
+
+    Each chunk is its own short transaction and re-checks inactivity, so a
+    customer who orders mid-run is kept. The product totals lose the
+    deleted orders in the same transaction. Yields ``{model label: deleted}``
+    per chunk and sleeps ``sleep`` seconds between chunks.
+    """
+    last_pk = 0
+    while True:
+        chunk = list(
+            inactive_customers(cutoff).filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not chunk:
+            return
+        last_pk = chunk[-1]
+        with transaction.atomic():
+            customers = inactive_customers(cutoff).filter(pk__in=chunk)
+            forget_orders(Order.objects.filter(customer__in=customers))
+            _, deleted = customers.delete()
+        yield deleted
+        if sleep:
+            time.sleep(sleep)
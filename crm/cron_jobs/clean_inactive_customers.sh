@@ -3,22 +3,8 @@
 # Navigate to the project root (assuming script is in crm/cron_jobs/)
 cd "$(dirname "$0")/../.."
 
-# Run Python code inside the Django shell
-output=$(python3 manage.py shell <<EOF
-from django.utils import timezone
-from datetime import timedelta
-from crm.models import Customer
-
-# Calculate the cutoff date (1 year ago)
-one_year_ago = timezone.now() - timedelta(days=365)
-
-# Logic: Delete customers who do NOT have any orders created after the cutoff date
-# .exclude(orders__created_at__gte=one_year_ago) finds customers with no recent orders
-count, _ = Customer.objects.exclude(orders__created_at__gte=one_year_ago).delete()
-
-print(count)
-EOF
-)
+# Customers with no order in the last year, deleted in short chunked transactions
+output=$(python3 manage.py clean_inactive_customers --days 365 --sleep 0.05 2>&1)
 
 # Log the result with a timestamp
-echo "$(date): Deleted $output customers" >> /tmp/customer_cleanup_log.txt
\ No newline at end of file
+echo "$(date): $output" >> /tmp/customer_cleanup_log.txt
@@ -1,57 +1,95 @@
+"""
+Log a reminder for every order placed in the last 7 days.
+
+The cutoff is applied by the server (``orderDate_Gte``) and orders come a
+page at a time from the keyset connection, so a run only reads recent
+orders and writes each log line as its page arrives.
+
+    python3 send_order_reminders.py [--days 7] [--per-customer]
+
+``--per-customer`` sends one reminder per customer covering all of their
+recent orders instead of one per order.
+"""
+import argparse
 import sys
-import os
-from datetime import datetime, timedelta
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
-
-def send_order_reminders():
-    url = 'http://localhost:8000/graphql/'
-    transport = RequestsHTTPTransport(url=url)
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-
-    query = gql("""
-    query {
-      allOrders {
-        id
-        orderDate
-        customer {
-          email
-        }
-      }
-    }
-    """)
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+LOG_FILE = '/tmp/order_reminders_log.txt'
+# graphene-django's RELAY_CONNECTION_MAX_LIMIT
+PAGE_SIZE = 100
+
+RECENT_ORDERS_QUERY = """
+query RecentOrders($since: DateTime!, $first: Int!, $after: String) {
+  allOrdersKeyset(orderDate_Gte: $since, first: $first, after: $after) {
+    pageInfo { hasNextPage endCursor }
+    edges { node { id customer { email } } }
+  }
+}
+"""
+
+
+def iter_recent_orders(execute, since, page_size=PAGE_SIZE):
+    """Yield orders placed at or after ``since``, fetching one page at a time.
+
+    ``execute(query, variables)`` runs a GraphQL query and returns its data.
+    """
+    after = None
+    while True:
+        page = execute(RECENT_ORDERS_QUERY, {
+            'since': since.isoformat(), 'first': page_size, 'after': after,
+        })['allOrdersKeyset']
+        for edge in page['edges']:
+            yield edge['node']
+        if not page['pageInfo']['hasNextPage']:
+            return
+        after = page['pageInfo']['endCursor']
+
+
+def send_reminders(orders, log):
+    count = 0
+    for order in orders:
+        log.write(f"{datetime.now().isoformat()}: Reminder for Order {order['id']} "
+                  f"sent to {order['customer']['email']}\n")
+        count += 1
+    return count
+
+
+def send_customer_reminders(orders, log):
+    """One reminder per customer; only order IDs are held until the end."""
+    by_customer = defaultdict(list)
+    for order in orders:
+        by_customer[order['customer']['email']].append(order['id'])
+    for email, order_ids in by_customer.items():
+        log.write(f"{datetime.now().isoformat()}: Reminder for Orders {', '.join(order_ids)} sent to {email}\n")
+    return len(by_customer)
+
+
+def run_order_reminders(client, days=7, per_customer=False, log_file=LOG_FILE):
+    """Send the reminders; returns how many were sent. Errors propagate."""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    send = send_customer_reminders if per_customer else send_reminders
+    with open(log_file, 'a') as log:
+        return send(iter_recent_orders(client.execute, since), log)
+
+
+def send_order_reminders(days=7, per_customer=False, url=None, log_file=LOG_FILE):
+    from crm.graphql_client import GRAPHQL_URL, get_client
 
     try:
-        result = client.execute(query)
-        orders = result.get('allOrders', [])
-        cutoff_date = datetime.now() - timedelta(days=7)
-        log_entries = []
-
-        for order in orders:
-            try:
-                order_date_str = order['orderDate']
-                if 'T' in order_date_str:
-                        order_date = datetime.strptime(order_date_str.split('T')[0], '%Y-%m-%d')
-                else:
-                        order_date = datetime.strptime(order_date_str, '%Y-%m-%d')
-                        
-                if order_date >= cutoff_date:
-                    customer_email = order['customer']['email']
-                    order_id = order['id']
-                    timestamp = datetime.now().isoformat()
-                    log_entries.append(f"{timestamp}: Reminder for Order {order_id} sent to {customer_email}")
-            except (ValueError, TypeError):
-                continue
-
-        if log_entries:
-            with open('/tmp/order_reminders_log.txt', 'a') as f:
-                for entry in log_entries:
-                    f.write(entry + '\n')
-        
+        run_order_reminders(get_client(url or GRAPHQL_URL), days, per_customer, log_file)
         print("Order reminders processed!")
-
     except Exception as e:
         print(f"Error fetching orders: {e}")
 
+
 if __name__ == '__main__':
-    send_order_reminders()
\ No newline at end of file
+    # Run by path from cron: make the project importable
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--per-customer', action='store_true')
+    parser.add_argument('--url')
+    args = parser.parse_args()
+    send_order_reminders(args.days, args.per_customer, args.url)
@@ -0,0 +1,21 @@
+"""
+Events behind the GraphQL subscriptions (see ``alx_backend_graphql.pubsub``).
+
+Messages only carry ids: each subscription reads the rows it needs when
+the event arrives, once for all the clients sharing its query.
+"""
+from alx_backend_graphql.pubsub import publish
+
+ORDER_CREATED = 'crm.order_created'
+STOCK_CHANGED = 'crm.stock_changed'
+
+
+def order_created(order):
+    publish(ORDER_CREATED, {'order_id': order.pk})
+
+
+def stock_changed(product_ids):
+    """``Product.stock`` of ``product_ids`` was written."""
+    product_ids = sorted(set(product_ids))
+    if product_ids:
+        publish(STOCK_CHANGED, {'product_ids': product_ids})
@@ -0,0 +1,295 @@
+import json
+from functools import partial
+from inspect import isawaitable
+
+import graphene
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from graphene.relay import PageInfo
+from graphene.relay.connection import connection_adapter, page_info_adapter
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql_relay import connection_from_array_slice, cursor_to_offset, get_offset_with_default, offset_to_cursor
+from graphql_relay.utils import base64, unbase64
+
+from crm.loaders import get_loaders, is_async
+from crm.optimizer import PAGINATION_ARGS, optimize_queryset
+
+
+def has_filter_args(args):
+    return any(v is not None for k, v in args.items() if k not in PAGINATION_ARGS)
+
+
+class CountableConnection(graphene.relay.Connection):
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(root, info):
+        # Keyset connections leave the COUNT(*) until a client asks for it
+        if getattr(root, 'length', None) is None:
+            if is_async(info):
+                return root.iterable.acount()
+            root.length = root.iterable.count()
+        return root.length
+
+
+def check_limits(info, args, max_limit, enforce_first_or_last=False):
+    first, last = args.get('first'), args.get('last')
+    if enforce_first_or_last:
+        assert first or last, (
+            f"You must provide a `first` or `last` value to properly paginate the `{info.field_name}` connection."
+        )
+    for name, value in (('first', first), ('last', last)):
+        if value is not None:
+            assert value >= 0, f"Argument `{name}` on `{info.field_name}` must be non-negative."
+            assert max_limit is None or value <= max_limit, (
+                f"Requesting {value} records on the `{info.field_name}` connection "
+                f"exceeds the `{name}` limit of {max_limit} records."
+            )
+
+
+def page_window(args, array_length, max_limit=None):
+    """Offsets ``[start, end)`` of the page, as ``resolve_connection`` slices it.
+
+    Normalizes ``offset`` into ``after`` and applies ``max_limit`` to ``args``
+    the same way graphene-django does.
+    """
+    offset = args.pop('offset', None)
+    if offset:
+        after = args.get('after')
+        if after:
+            offset += cursor_to_offset(after) + 1
+        args['after'] = offset_to_cursor(offset - 1)
+    if max_limit is not None and args.get('first') is None and args.get('last') is None:
+        args['first'] = max_limit
+
+    start = min(get_offset_with_default(args.get('after'), -1) + 1, array_length)
+    end = array_length
+    before = get_offset_with_default(args.get('before'), end)
+    if 0 <= before < array_length:
+        end = min(end, before)
+    if args.get('first') is not None:
+        end = min(end, start + args['first'])
+    if args.get('last') is not None:
+        start = max(start, end - args['last'])
+    return start, max(start, end)
+
+
+class DataLoaderConnectionField(DjangoFilterConnectionField):
+    """Filter connection that hands each resolved page to the request loaders.
+
+    Querysets are trimmed to the selection set before they run. Resolvers
+    may also return a plain list (already batched by a loader); lists skip
+    the filterset and are paginated in memory.
+    """
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class,
+                         extra_columns=()):
+        if isinstance(iterable, list):
+            return iterable
+        queryset = super().resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class
+        )
+        return optimize_queryset(queryset, info, extra_columns)
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver,
+                            max_limit, enforce_first_or_last, root, info, **args):
+        if is_async(info):
+            return cls.async_connection_resolver(
+                resolver, connection, default_manager, queryset_resolver,
+                max_limit, enforce_first_or_last, root, info, **args
+            )
+        resolved = super().connection_resolver(
+            resolver, connection, default_manager, queryset_resolver,
+            max_limit, enforce_first_or_last, root, info, **args
+        )
+        get_loaders(info).prime(edge.node for edge in resolved.edges)
+        return resolved
+
+    @classmethod
+    async def async_connection_resolver(cls, resolver, connection, default_manager, queryset_resolver,
+                                        max_limit, enforce_first_or_last, root, info, **args):
+        check_limits(info, args, max_limit, enforce_first_or_last)
+        iterable = resolver(root, info, **args)
+        if isawaitable(iterable):
+            iterable = await iterable
+        if iterable is None:
+            iterable = default_manager
+        iterable = await resolve_queryset_async(queryset_resolver, connection, iterable, info, args)
+
+        if isinstance(iterable, QuerySet):
+            array_length = await iterable.acount()
+            start, end = page_window(args, array_length, max_limit)
+            rows = [row async for row in iterable[start:end]]
+            resolved = connection_from_array_slice(
+                rows, args,
+                slice_start=start,
+                array_length=array_length,
+                array_slice_length=len(rows),
+                connection_type=partial(connection_adapter, connection),
+                edge_type=connection.Edge,
+                page_info_type=page_info_adapter,
+            )
+            resolved.iterable = iterable
+            resolved.length = array_length
+        else:
+            resolved = cls.resolve_connection(connection, args, iterable, max_limit=max_limit)
+        get_loaders(info).prime(edge.node for edge in resolved.edges)
+        return resolved
+
+
+async def resolve_queryset_async(queryset_resolver, connection, iterable, info, args):
+    iterable = maybe_queryset(iterable)
+    # Validating filter arguments can hit the database (ModelChoiceFilter)
+    if has_filter_args(args):
+        return await sync_to_async(queryset_resolver)(connection, iterable, info, args)
+    return queryset_resolver(connection, iterable, info, args)
+
+
+def keyset_to_cursor(values):
+    # isoformat() keeps the microseconds DjangoJSONEncoder would truncate
+    values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    return base64('keyset:' + json.dumps(values, cls=DjangoJSONEncoder))
+
+
+def cursor_to_keyset(model, keyset, cursor):
+    try:
+        prefix, _, payload = unbase64(cursor).partition(':')
+        values = json.loads(payload)
+        assert prefix == 'keyset' and len(values) == len(keyset)
+        return [model._meta.get_field(name).to_python(v) for name, v in zip(keyset, values)]
+    except Exception:
+        raise Exception(f"Invalid cursor {cursor!r}")
+
+
+def seek(keyset, values, reverse=False):
+    """Rows strictly after ``values`` in keyset order (before, if ``reverse``).
+
+    Expands the row-value comparison ``(a, b) > (x, y)`` into
+    ``a >= x AND (a > x OR (a = x AND b > y))`` so the leading column
+    still drives an index range scan.
+    """
+    op = 'lt' if reverse else 'gt'
+    condition = Q(**{f'{keyset[-1]}__{op}': values[-1]})
+    for name, value in zip(reversed(keyset[:-1]), reversed(values[:-1])):
+        condition = Q(**{f'{name}__{op}': value}) | (Q(**{name: value}) & condition)
+    if len(keyset) > 1:
+        condition &= Q(**{f'{keyset[0]}__{op}e': values[0]})
+    return condition
+
+
+class KeysetConnectionField(DataLoaderConnectionField):
+    """Connection paginated by seeking on an indexed key instead of OFFSET.
+
+    Cursors encode the ``keyset`` column values of the edge, so every page
+    is a ``WHERE (keyset) > (cursor) ORDER BY keyset LIMIT n`` regardless
+    of how deep the client is. ``totalCount`` only runs a COUNT(*) when it
+    is selected.
+    """
+
+    def __init__(self, type_, keyset, *args, **kwargs):
+        self.keyset = tuple(keyset)
+        super().__init__(type_, *args, **kwargs)
+        # Offsets are exactly what keyset pagination avoids
+        self._base_args.pop('offset', None)
+
+    @property
+    def filtering_args(self):
+        # Pages always come in keyset order
+        args = super().filtering_args
+        args.pop('order_by', None)
+        return args
+
+    def get_queryset_resolver(self):
+        return partial(super().get_queryset_resolver(), extra_columns=self.keyset)
+
+    def wrap_resolve(self, parent_resolver):
+        return partial(
+            self.keyset_connection_resolver,
+            self.resolver or parent_resolver,
+            self.connection_type,
+            self.get_manager(),
+            self.get_queryset_resolver(),
+            self.max_limit,
+            self.keyset,
+        )
+
+    @classmethod
+    def keyset_connection_resolver(cls, resolver, connection, default_manager, queryset_resolver,
+                                   max_limit, keyset, root, info, **args):
+        check_limits(info, args, max_limit)
+        assert args.get('first') is None or args.get('last') is None, (
+            f"Provide `first` or `last` on the `{info.field_name}` connection, not both."
+        )
+        if is_async(info):
+            return cls.async_keyset_connection_resolver(
+                resolver, connection, default_manager, queryset_resolver, max_limit, keyset, root, info, **args
+            )
+        iterable = resolver(root, info, **args)
+        if iterable is None:
+            iterable = default_manager
+        queryset = queryset_resolver(connection, iterable, info, args)
+        page, limit = cls.keyset_page(queryset, keyset, args, max_limit)
+        rows = list(page)
+        return cls.build_keyset_connection(connection, queryset, rows, limit, keyset, info, args)
+
+    @classmethod
+    async def async_keyset_connection_resolver(cls, resolver, connection, default_manager, queryset_resolver,
+                                               max_limit, keyset, root, info, **args):
+        iterable = resolver(root, info, **args)
+        if isawaitable(iterable):
+            iterable = await iterable
+        if iterable is None:
+            iterable = default_manager
+        queryset = await resolve_queryset_async(queryset_resolver, connection, iterable, info, args)
+        page, limit = cls.keyset_page(queryset, keyset, args, max_limit)
+        rows = [row async for row in page]
+        return cls.build_keyset_connection(connection, queryset, rows, limit, keyset, info, args)
+
+    @staticmethod
+    def keyset_page(queryset, keyset, args, max_limit):
+        """The queryset for one page, fetching one extra row to detect more pages."""
+        model = queryset.model
+        backward = args.get('last') is not None
+        limit = args['last'] if backward else (args.get('first') if args.get('first') is not None else max_limit)
+        ordering = [f'-{name}' for name in keyset] if backward else list(keyset)
+        page = queryset.order_by(*ordering)
+        if args.get('after'):
+            page = page.filter(seek(keyset, cursor_to_keyset(model, keyset, args['after'])))
+        if args.get('before'):
+            page = page.filter(seek(keyset, cursor_to_keyset(model, keyset, args['before']), reverse=True))
+        return (page[:limit + 1] if limit is not None else page), limit
+
+    @staticmethod
+    def build_keyset_connection(connection, queryset, rows, limit, keyset, info, args):
+        backward = args.get('last') is not None
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        if backward:
+            rows.reverse()
+
+        edges = [
+            connection.Edge(
+                node=row,
+                cursor=keyset_to_cursor([getattr(row, name) for name in keyset]),
+            )
+            for row in rows
+        ]
+        resolved = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_more if backward else bool(args.get('after')),
+                has_next_page=bool(args.get('before')) if backward else has_more,
+            ),
+        )
+        resolved.iterable = queryset
+        resolved.length = None
+        get_loaders(info).prime(rows)
+        return resolved
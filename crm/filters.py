@@ -1,7 +1,38 @@
 import django_filters
+from django.db.models import F
+from django_filters.constants import EMPTY_VALUES
 from .models import Customer, Product, Order
+from .search import search
+
+
+def search_filter():
+    # Relevance ordering only holds on offset connections; keyset ones re-sort by their key
+    return django_filters.CharFilter(method=lambda queryset, name, value: search(queryset, value))
+
+def updated_since_filter():
+    # Rows written after the given time; changesSince also reports deletes
+    return django_filters.DateTimeFilter(field_name='updated_at', lookup_expr='gt')
+
+class TotalsOrderingFilter(django_filters.OrderingFilter):
+    """``orderBy: "-lifetimeTotal,name"``; ties are broken by id.
+
+    Rows without a stats row (never ordered) sort lowest in both
+    directions, on every database, as if their totals were zero.
+    """
+
+    def filter(self, queryset, value):
+        if value in EMPTY_VALUES:
+            return queryset
+        ordering = []
+        for param in value:
+            field = F(self.get_ordering_value(param).lstrip('-'))
+            ordering.append(field.desc(nulls_last=True) if param.startswith('-') else field.asc(nulls_first=True))
+        return queryset.order_by(*ordering, 'pk')
 
 class CustomerFilter(django_filters.FilterSet):
+    # Full-text match on name and email, best matches first
+    search = search_filter()
+
     # Case-insensitive partial matches
     name = django_filters.CharFilter(lookup_expr='icontains')
     email = django_filters.CharFilter(lookup_expr='icontains')
@@ -9,12 +40,23 @@ class CustomerFilter(django_filters.FilterSet):
     # Date range filters
     created_at__gte = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='gte')
     created_at__lte = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='lte')
+    updated_since = updated_since_filter()
+
+    # Overrides search relevance when both are given
+    order_by = TotalsOrderingFilter(fields=(
+        'name', 'created_at',
+        ('stats__order_count', 'order_count'),
+        ('stats__lifetime_total', 'lifetime_total'),
+        ('stats__last_order_date', 'last_order_date'),
+    ))
 
     class Meta:
         model = Customer
         fields = ['name', 'email', 'phone', 'created_at']
 
 class ProductFilter(django_filters.FilterSet):
+    search = search_filter()
+
     name = django_filters.CharFilter(lookup_expr='icontains')
     
     # Price ranges
@@ -24,12 +66,23 @@ class ProductFilter(django_filters.FilterSet):
     # Stock ranges
     stock__gte = django_filters.NumberFilter(field_name='stock', lookup_expr='gte')
     stock__lte = django_filters.NumberFilter(field_name='stock', lookup_expr='lte')
+    updated_since = updated_since_filter()
+
+    order_by = TotalsOrderingFilter(fields=(
+        'name', 'price', 'stock',
+        ('stats__times_ordered', 'times_ordered'),
+        ('stats__units_sold', 'units_sold'),
+        ('stats__revenue', 'revenue'),
+    ))
 
     class Meta:
         model = Product
         fields = ['name', 'price', 'stock']
 
 class OrderFilter(django_filters.FilterSet):
+    # Matches the customer's name or any product name
+    search = search_filter()
+
     # Date ranges
     order_date__gte = django_filters.DateTimeFilter(field_name='order_date', lookup_expr='gte')
     order_date__lte = django_filters.DateTimeFilter(field_name='order_date', lookup_expr='lte')
@@ -37,6 +90,7 @@ class OrderFilter(django_filters.FilterSet):
     # Amount ranges
     total_amount__gte = django_filters.NumberFilter(field_name='total_amount', lookup_expr='gte')
     total_amount__lte = django_filters.NumberFilter(field_name='total_amount', lookup_expr='lte')
+    updated_since = updated_since_filter()
 
     # Related field filtering (Magic happens here!)
     customer_name = django_filters.CharFilter(field_name='customer__name', lookup_expr='icontains')
@@ -0,0 +1,154 @@
+"""
+GraphQL client shared by the cron jobs.
+
+``get_client()`` returns an ``InProcessClient`` when Django is loaded and
+the API URL points at this host, so jobs run by django-crontab skip HTTP
+entirely. Anywhere else it returns an ``HTTPClient``:
+
+- one pooled ``requests.Session`` per URL, reused across calls;
+- queries are validated locally against an SDL file cached on disk;
+- the server stamps every response with the hash of its schema, and the
+  SDL is only fetched again (from ``graphql/schema.graphql``) once that
+  hash stops matching the cached copy. There is no introspection query.
+"""
+import hashlib
+import os
+import socket
+from functools import lru_cache
+from urllib.parse import urljoin, urlparse
+
+from graphql import build_schema, parse, validate
+
+GRAPHQL_URL = os.environ.get('CRM_GRAPHQL_URL', 'http://localhost:8000/graphql/')
+SCHEMA_CACHE = os.environ.get('CRM_GRAPHQL_SCHEMA_CACHE', '/tmp/crm_graphql_schema.graphql')
+SCHEMA_HASH_HEADER = 'X-GraphQL-Schema-Hash'
+TIMEOUT = 30
+
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+
+class GraphQLClientError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(str(e.get('message', e)) if isinstance(e, dict) else str(e) for e in errors))
+
+
+@lru_cache(maxsize=256)
+def parse_query(query):
+    return parse(query)
+
+
+def sdl_hash(sdl):
+    return hashlib.sha256(sdl.encode('utf-8')).hexdigest()
+
+
+class HTTPClient:
+    def __init__(self, url=GRAPHQL_URL, schema_cache=SCHEMA_CACHE, session=None):
+        self.url = url
+        self.schema_cache = schema_cache
+        self.session = session or self.make_session()
+        self._schema = None
+        self._schema_hash = None
+
+    @staticmethod
+    def make_session():
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        return session
+
+    @property
+    def schema(self):
+        if self._schema is None:
+            try:
+                with open(self.schema_cache, encoding='utf-8') as f:
+                    self.load_schema(f.read())
+            except (OSError, ValueError, TypeError):
+                self.refresh_schema()
+        return self._schema
+
+    def load_schema(self, sdl):
+        self._schema = build_schema(sdl)
+        self._schema_hash = sdl_hash(sdl)
+
+    def refresh_schema(self):
+        response = self.session.get(urljoin(self.url, 'schema.graphql'), timeout=TIMEOUT)
+        response.raise_for_status()
+        sdl = response.text
+        self.load_schema(sdl)
+        tmp = f'{self.schema_cache}.{os.getpid()}'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(sdl)
+        os.replace(tmp, self.schema_cache)
+
+    def validate(self, document):
+        errors = validate(self.schema, document)
+        if errors:
+            # The server may have moved on since the SDL was cached
+            self.refresh_schema()
+            errors = validate(self.schema, document)
+        if errors:
+            raise GraphQLClientError(errors)
+
+    def execute(self, query, variables=None):
+        self.validate(parse_query(query))
+        response = self.session.post(self.url, json={'query': query, 'variables': variables}, timeout=TIMEOUT)
+        server_hash = response.headers.get(SCHEMA_HASH_HEADER)
+        if server_hash and server_hash != self._schema_hash:
+            self.refresh_schema()
+        body = response.json()
+        if body.get('errors'):
+            raise GraphQLClientError(body['errors'])
+        response.raise_for_status()
+        return body['data']
+
+
+class InProcessClient:
+    """Runs queries against ``alx_backend_graphql.schema`` in this process."""
+
+    def __init__(self, schema=None):
+        if schema is None:
+            from alx_backend_graphql.schema import schema
+        self.schema = schema
+
+    def execute(self, query, variables=None):
+        from django.http import HttpRequest
+
+        # A fresh request per call gives every query its own loaders
+        result = self.schema.execute(query, variable_values=variables, context_value=HttpRequest())
+        if result.errors:
+            raise GraphQLClientError(result.errors)
+        return result.data
+
+
+def is_local(url):
+    host = urlparse(url).hostname
+    return host in LOCAL_HOSTS or host == socket.gethostname()
+
+
+def django_ready():
+    try:
+        from django.apps import apps
+    except ImportError:
+        return False
+    return apps.ready
+
+
+_clients = {}
+
+
+def get_client(url=GRAPHQL_URL, in_process=None):
+    """The shared client for ``url``.
+
+    ``in_process=None`` picks in-process execution when Django is loaded
+    and ``url`` is local; pass ``False`` to force a real HTTP round trip.
+    """
+    if in_process is None:
+        in_process = django_ready() and is_local(url)
+    key = (url, in_process)
+    if key not in _clients:
+        _clients[key] = InProcessClient() if in_process else HTTPClient(url)
+    return _clients[key]
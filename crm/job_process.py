@@ -0,0 +1,17 @@
+"""
+Start-up of the job worker's pool processes.
+
+A spawned process imports this module before Django is set up, so it must
+not import models, directly or through ``crm.jobs``.
+"""
+
+
+def setup_process(databases):
+    """Set up Django on the databases the worker uses (which may not be the
+    settings' own, e.g. under the test runner)."""
+    import django
+    from django.db import connections
+
+    django.setup()
+    for alias, name in databases.items():
+        connections[alias].settings_dict['NAME'] = name
@@ -0,0 +1,363 @@
+"""
+A small database-backed job queue for side effects and recurring jobs.
+
+Tasks are functions registered with ``@task(name)`` (see ``crm.tasks``).
+``enqueue(name, **kwargs)`` adds a ``Job`` row in the caller's transaction,
+so a mutation that rolls back leaves no job behind, and a worker
+(``manage.py run_crm_worker``) runs it:
+
+- a worker claims due jobs with a conditional ``UPDATE`` per job (behind
+  ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database has it), so any
+  number of workers can poll the same table; a claim is a lease, and a job
+  whose worker died is picked up again once it lapses;
+- jobs run in a long-lived thread or process pool: no interpreter start per
+  job or per cron tick;
+- a job that raises is retried after an exponential backoff
+  (``CRM_JOB_RETRY_BACKOFF`` seconds, doubling) until ``max_attempts``;
+- ``CRM_JOB_SCHEDULE`` lists recurring jobs as ``(cron expression, task
+  name[, kwargs])``. Each tick is enqueued once, by whichever worker moves
+  the entry's ``JobSchedule.next_run_at`` on first; ticks missed while no
+  worker ran collapse into one.
+
+``job_stats()`` reports queue depth, throughput and lag from the table, so
+it covers every worker process (``manage.py crm_job_stats``).
+"""
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import traceback
+import uuid
+from calendar import monthrange
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Min, Q
+from django.utils import timezone
+
+from alx_backend_graphql.batch import release_connections
+from crm.job_process import setup_process
+from crm.models import Job, JobSchedule
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_LEASE = 300
+DEFAULT_RETRY_BACKOFF = 10
+MAX_RETRY_DELAY = 3600
+
+TASKS = {}
+
+
+class Task:
+    def __init__(self, name, func, max_attempts=DEFAULT_MAX_ATTEMPTS, lease=None):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        # Seconds a run may take before another worker may start it again
+        # (default ``CRM_JOB_LEASE``)
+        self.lease = lease
+
+
+def task(name, max_attempts=DEFAULT_MAX_ATTEMPTS, lease=None):
+    """Register the decorated function as the task ``name``."""
+    def register(func):
+        TASKS[name] = Task(name, func, max_attempts, lease)
+        return func
+    return register
+
+
+def enqueue(name, *, run_at=None, max_attempts=None, **kwargs):
+    """Queue a run of task ``name`` with JSON-serializable ``kwargs``.
+
+    The row is written in the current transaction: it only becomes visible
+    to workers when that commits.
+    """
+    if name not in TASKS:
+        raise LookupError(f"Unknown task {name!r}")
+    return Job.objects.create(
+        name=name, kwargs=kwargs, run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or TASKS[name].max_attempts,
+    )
+
+
+def retry_delay(attempts):
+    """Seconds before attempt ``attempts + 1``."""
+    backoff = getattr(settings, 'CRM_JOB_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF)
+    return min(backoff * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def claimable(now):
+    # Due jobs, and jobs whose worker let the lease lapse
+    return Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+
+
+def claim(worker_id, limit, now=None):
+    """Take up to ``limit`` due jobs for ``worker_id``, oldest first."""
+    now = now or timezone.now()
+    claimed = []
+    with transaction.atomic():
+        candidates = Job.objects.filter(claimable(now)).order_by('run_at', 'pk')
+        if connections[candidates.db].features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        for job in candidates.only('pk', 'name')[:limit]:
+            task = TASKS.get(job.name)
+            lease = (task and task.lease) or getattr(settings, 'CRM_JOB_LEASE', DEFAULT_LEASE)
+            # Loses (updates nothing) if another worker got there first
+            if Job.objects.filter(claimable(now), pk=job.pk).update(
+                status=Job.RUNNING, attempts=F('attempts') + 1, started_at=now,
+                locked_by=worker_id, locked_until=now + timedelta(seconds=lease),
+            ):
+                claimed.append(job.pk)
+    return claimed
+
+
+def finish(job, worker_id, **fields):
+    # Only the lease holder may finish a job; if the lease lapsed and another
+    # worker took it over, that run's outcome counts
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=worker_id).update(
+        locked_by='', locked_until=None, **fields,
+    )
+
+
+def run_job(job_id, worker_id):
+    """Run a claimed job and record the outcome: succeeded, retried or failed."""
+    job = Job.objects.get(pk=job_id)
+    task = TASKS.get(job.name)
+    try:
+        if task is None:
+            raise LookupError(f"Unknown task {job.name!r}")
+        if job.attempts > job.max_attempts:
+            raise RuntimeError("Lease lapsed on the last attempt")
+        task.func(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if task is not None and job.attempts < job.max_attempts:
+            outcome = 'retried'
+            finish(job, worker_id, status=Job.QUEUED, last_error=error,
+                   run_at=now + timedelta(seconds=retry_delay(job.attempts)))
+        else:
+            outcome = 'failed'
+            finish(job, worker_id, status=Job.FAILED, last_error=error, finished_at=now)
+    else:
+        outcome = 'succeeded'
+        finish(job, worker_id, status=Job.SUCCEEDED, finished_at=timezone.now())
+    finally:
+        release_connections()
+    return outcome
+
+
+class Cron:
+    """A five-field cron expression (minute hour day month weekday), read in
+    ``TIME_ZONE``. Fields take ``*``, numbers, ranges, lists and ``/step``;
+    weekdays run 0-6 from Sunday (7 is Sunday too)."""
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected 5 cron fields, got {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self.parse_field(field, low, high) for field, (low, high) in zip(fields, self.RANGES)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        # With both restricted, a day matches either (as in cron)
+        self.either_day = fields[2] != '*' and fields[4] != '*'
+
+    @staticmethod
+    def parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            part, _, step = part.partition('/')
+            if part == '*':
+                start, end = low, high
+            else:
+                start, _, end = part.partition('-')
+                start = int(start)
+                end = int(end) if end else (high if step else start)
+            step = int(step) if step else 1
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Invalid cron field {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = moment.isoweekday() % 7 in self.weekdays
+        return (day or weekday) if self.either_day else (day and weekday)
+
+    def next_after(self, moment):
+        """The first matching minute after ``moment``."""
+        moment = timezone.localtime(moment).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Skips whole months, days and hours; gives up after ~5 years
+        for _ in range(50000):
+            if moment.month not in self.months:
+                days_left = monthrange(moment.year, moment.month)[1] - moment.day + 1
+                moment = (moment + timedelta(days=days_left)).replace(hour=0, minute=0)
+            elif not self.day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression {self.expression!r} never matches")
+
+
+@lru_cache(maxsize=64)
+def parse_cron(expression):
+    return Cron(expression)
+
+
+def schedule_entries(schedule=None):
+    """``{key: (cron, name, kwargs)}`` for ``schedule`` (default ``CRM_JOB_SCHEDULE``)."""
+    if schedule is None:
+        schedule = getattr(settings, 'CRM_JOB_SCHEDULE', ())
+    entries = {}
+    for cron, name, *kwargs in schedule:
+        kwargs = kwargs[0] if kwargs else {}
+        key = f"{cron} {name}" + (f" {json.dumps(kwargs, sort_keys=True)}" if kwargs else '')
+        entries[key] = (parse_cron(cron), name, kwargs)
+    return entries
+
+
+def enqueue_due(now=None, schedule=None):
+    """Enqueue the recurring jobs that are due; returns the new jobs.
+
+    An entry seen for the first time is due at its next tick, not now.
+    """
+    now = now or timezone.now()
+    entries = schedule_entries(schedule)
+    if not entries:
+        return []
+    due = dict(JobSchedule.objects.filter(key__in=entries).values_list('key', 'next_run_at'))
+    JobSchedule.objects.bulk_create([
+        JobSchedule(key=key, next_run_at=cron.next_after(now))
+        for key, (cron, name, kwargs) in entries.items() if key not in due
+    ], ignore_conflicts=True)
+    jobs = []
+    for key, next_run_at in due.items():
+        if next_run_at > now:
+            continue
+        cron, name, kwargs = entries[key]
+        with transaction.atomic():
+            # Whoever moves the entry on enqueues the tick
+            if JobSchedule.objects.filter(key=key, next_run_at=next_run_at).update(
+                next_run_at=cron.next_after(now),
+            ):
+                jobs.append(enqueue(name, run_at=next_run_at, **kwargs))
+    return jobs
+
+
+class Worker:
+    """Claims due jobs and runs up to ``concurrency`` of them at a time in a
+    thread or process pool."""
+
+    def __init__(self, concurrency=4, pool='thread', poll_interval=1.0, schedule=None, log=None):
+        if pool not in ('thread', 'process'):
+            raise ValueError(f"Unknown pool {pool!r}")
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.pool_kind = pool
+        self.poll_interval = poll_interval
+        self.schedule = schedule
+        self.log = log or (lambda message: None)
+        self.outcomes = {}
+        self._stopping = threading.Event()
+
+    def make_pool(self):
+        if self.pool_kind == 'thread':
+            return ThreadPoolExecutor(self.concurrency, thread_name_prefix='crm-worker')
+        databases = {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+        # Spawned, not forked: a child must not share the parent's connections
+        return ProcessPoolExecutor(
+            self.concurrency, mp_context=multiprocessing.get_context('spawn'),
+            initializer=setup_process, initargs=(databases,),
+        )
+
+    def stop(self):
+        """Stop claiming; ``run`` returns once running jobs finish."""
+        self._stopping.set()
+
+    def run(self, burst=False):
+        """Work until ``stop()``, or with ``burst`` until no job is due."""
+        pool = self.make_pool()
+        running = set()
+        try:
+            while not self._stopping.is_set():
+                enqueue_due(schedule=self.schedule)
+                free = self.concurrency - len(running)
+                claimed = claim(self.id, free) if free else []
+                running.update(pool.submit(run_job, pk, self.id) for pk in claimed)
+                if not running:
+                    if burst:
+                        break
+                    self._stopping.wait(self.poll_interval)
+                    continue
+                done, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                if self.collect(done):
+                    # A pool process died: its jobs come back when their lease lapses
+                    pool.shutdown(wait=True)
+                    pool, running = self.make_pool(), set()
+        finally:
+            pool.shutdown(wait=True)
+            self.collect(running)
+        return self.outcomes
+
+    def collect(self, futures):
+        broken = False
+        for future in futures:
+            try:
+                outcome = future.result()
+            except BrokenProcessPool:
+                broken = True
+                outcome = 'lost'
+            except Exception as e:
+                outcome = 'error'
+                self.log(f"Worker error: {e!r}")
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        return broken
+
+
+def job_stats(window=timedelta(minutes=5), now=None):
+    """Queue depth, throughput and lag over the last ``window``."""
+    now = now or timezone.now()
+    by_status = dict(Job.objects.order_by().values_list('status').annotate(Count('pk')))
+    oldest_due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).aggregate(
+        count=Count('pk'), oldest=Min('run_at'),
+    )
+    # Lag: from when a job was due to when its last run started
+    lag = ExpressionWrapper(F('started_at') - F('run_at'), output_field=DurationField())
+    finished = Job.objects.filter(finished_at__gte=now - window)
+    recent = finished.aggregate(
+        succeeded=Count('pk', filter=Q(status=Job.SUCCEEDED)),
+        failed=Count('pk', filter=Q(status=Job.FAILED)),
+        avg_lag=Avg(lag), max_lag=Max(lag),
+    )
+    seconds = lambda delta: delta.total_seconds() if delta else 0.0
+    return {
+        'queued': by_status.get(Job.QUEUED, 0),
+        'due': oldest_due['count'],
+        'running': by_status.get(Job.RUNNING, 0),
+        'succeeded': by_status.get(Job.SUCCEEDED, 0),
+        'failed': by_status.get(Job.FAILED, 0),
+        'window_seconds': window.total_seconds(),
+        'succeeded_in_window': recent['succeeded'],
+        'failed_in_window': recent['failed'],
+        'throughput_per_minute': (recent['succeeded'] + recent['failed']) * 60 / window.total_seconds(),
+        'oldest_due_seconds': seconds(now - oldest_due['oldest'] if oldest_due['oldest'] else None),
+        'avg_start_lag_seconds': seconds(recent['avg_lag']),
+        'max_start_lag_seconds': seconds(recent['max_lag']),
+    }
+
+
+def prune_jobs(days=7):
+    """Delete jobs that finished more than ``days`` days ago."""
+    cutoff = timezone.now() - timedelta(days=days)
+    return Job.objects.filter(status__in=(Job.SUCCEEDED, Job.FAILED), finished_at__lt=cutoff).delete()[0]
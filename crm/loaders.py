@@ -0,0 +1,183 @@
+import threading
+from collections import defaultdict
+
+from graphene.utils.dataloader import DataLoader as AsyncDataLoader
+
+from crm.models import Customer, Order
+
+
+class DataLoader:
+    """Per-request batching loader that works under synchronous execution.
+
+    Keys are queued as soon as a parent list is resolved (see
+    ``Loaders.prime``), so the first ``load()`` on a cache miss fetches
+    every pending key with a single call to ``batch_load_fn``. Safe to
+    share between the threads running the queries of a batched request.
+    """
+
+    def __init__(self, batch_load_fn, default=None, on_batch=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self.on_batch = on_batch
+        self._cache = {}
+        self._queue = set()
+        self._lock = threading.RLock()
+
+    def enqueue(self, keys):
+        with self._lock:
+            self._queue.update(key for key in keys if key not in self._cache)
+
+    def prime(self, key, value):
+        with self._lock:
+            self._cache.setdefault(key, value)
+            self._queue.discard(key)
+
+    def load(self, key):
+        with self._lock:
+            if key not in self._cache:
+                keys = self._queue | {key}
+                self._queue = set()
+                values = self.batch_load_fn(list(keys))
+                for k in keys:
+                    self._cache[k] = values.get(k, self._default_value())
+                if self.on_batch is not None:
+                    self.on_batch(values)
+            return self._cache[key]
+
+    def load_many(self, keys):
+        keys = list(keys)
+        self.enqueue(keys)
+        return [self.load(key) for key in keys]
+
+    def clear(self, key=None):
+        with self._lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+    def _default_value(self):
+        return self.default() if callable(self.default) else self.default
+
+
+def group_by(rows, key, value=lambda row: row):
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[key(row)].append(value(row))
+    return grouped
+
+
+def customers_queryset(customer_ids):
+    # The aggregate fields read the stats row; join it rather than fetch it per customer
+    return Customer.objects.filter(pk__in=customer_ids).select_related('stats')
+
+
+def order_lines_queryset(order_ids):
+    # One query on the M2M through table, joined to the product rows
+    return (
+        Order.products.through.objects.filter(order_id__in=order_ids)
+        .select_related('product__stats')
+        .order_by('order_id', 'product_id')
+    )
+
+
+def orders_queryset(customer_ids):
+    return Order.objects.filter(customer_id__in=customer_ids).order_by('pk')
+
+
+def load_customers(customer_ids):
+    return {customer.pk: customer for customer in customers_queryset(customer_ids)}
+
+
+def load_products_by_order(order_ids):
+    return group_by(order_lines_queryset(order_ids), lambda line: line.order_id, lambda line: line.product)
+
+
+def load_orders_by_customer(customer_ids):
+    return group_by(orders_queryset(customer_ids), lambda order: order.customer_id)
+
+
+class Loaders:
+    """The set of loaders shared by every resolver of one request."""
+
+    def __init__(self):
+        self.customer_by_id = DataLoader(load_customers)
+        self.products_by_order = DataLoader(load_products_by_order, default=list)
+        self.orders_by_customer = DataLoader(
+            load_orders_by_customer, default=list,
+            on_batch=lambda values: self.prime(o for orders in values.values() for o in orders),
+        )
+
+    def prime(self, objs):
+        """Queue the relations of freshly resolved rows for the next batch.
+
+        Relations the queryset already fetched (``select_related`` or
+        ``prefetch_related``) are served from the row instead.
+        """
+        for obj in objs:
+            if isinstance(obj, Order):
+                if 'customer_id' in obj.__dict__ and not Order.customer.is_cached(obj):
+                    self.customer_by_id.enqueue([obj.customer_id])
+                if not is_prefetched(obj, 'products'):
+                    self.products_by_order.enqueue([obj.pk])
+            elif isinstance(obj, Customer):
+                # Rows trimmed with only() must not stand in for full customers
+                if not obj.get_deferred_fields():
+                    self.customer_by_id.prime(obj.pk, obj)
+                if not is_prefetched(obj, 'orders'):
+                    self.orders_by_customer.enqueue([obj.pk])
+
+
+def is_prefetched(obj, name):
+    return name in getattr(obj, '_prefetched_objects_cache', {})
+
+
+async def aload_customers(customer_ids):
+    customers = {customer.pk: customer async for customer in customers_queryset(customer_ids)}
+    return [customers.get(pk) for pk in customer_ids]
+
+
+async def aload_products_by_order(order_ids):
+    lines = [line async for line in order_lines_queryset(order_ids)]
+    products = group_by(lines, lambda line: line.order_id, lambda line: line.product)
+    return [products.get(pk, []) for pk in order_ids]
+
+
+async def aload_orders_by_customer(customer_ids):
+    orders = group_by([order async for order in orders_queryset(customer_ids)], lambda order: order.customer_id)
+    return [orders.get(pk, []) for pk in customer_ids]
+
+
+class AsyncLoaders:
+    """Loaders for the async view.
+
+    ``load()`` returns a future and every key requested in the same
+    event-loop tick goes out in one batch, so unlike ``Loaders`` nothing
+    has to be queued ahead of time.
+    """
+
+    def __init__(self):
+        self.customer_by_id = AsyncDataLoader(aload_customers)
+        self.products_by_order = AsyncDataLoader(aload_products_by_order)
+        self.orders_by_customer = AsyncDataLoader(aload_orders_by_customer)
+
+    def prime(self, objs):
+        for obj in objs:
+            if isinstance(obj, Customer) and not obj.get_deferred_fields():
+                self.customer_by_id.prime(obj.pk, obj)
+
+
+def is_async(info):
+    """Whether the request is being executed by the async view."""
+    return getattr(info.context, 'graphql_async', False)
+
+
+def get_loaders(info):
+    context = info.context
+    if context is None:
+        return Loaders()
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
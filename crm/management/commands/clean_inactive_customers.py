@@ -0,0 +1,42 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crm.cleanup import CLEANUP_CHUNK_SIZE, count_inactive_customers, iter_delete_inactive_customers
+
+
+class Command(BaseCommand):
+    help = "Delete customers (and their orders) with no order in the last --days days."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--chunk-size', type=int, default=CLEANUP_CHUNK_SIZE)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Seconds to pause between chunks to let other writers in.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be deleted.")
+
+    def handle(self, *args, days, chunk_size, sleep, dry_run, **options):
+        cutoff = timezone.now() - timedelta(days=days)
+        start = time.perf_counter()
+
+        if dry_run:
+            customers, orders, lines = count_inactive_customers(cutoff)
+            self.stdout.write(
+                f"Would delete {customers} customers, {orders} orders and {lines} order lines "
+                f"({time.perf_counter() - start:.2f}s)"
+            )
+            return
+
+        totals, chunks = Counter(), 0
+        for deleted in iter_delete_inactive_customers(cutoff, chunk_size, sleep):
+            totals.update(deleted)
+            chunks += 1
+            if options['verbosity'] >= 2:
+                self.stdout.write(f"chunk {chunks}: {deleted.get('crm.Customer', 0)} customers")
+        self.stdout.write(
+            f"Deleted {totals['crm.Customer']} customers, {totals['crm.Order']} orders and "
+            f"{totals['crm.OrderLine']} order lines in {chunks} chunks ({time.perf_counter() - start:.2f}s)"
+        )
@@ -0,0 +1,32 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from crm.jobs import job_stats
+
+
+class Command(BaseCommand):
+    help = "Job queue depth, throughput and lag, across all workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=300, help="Seconds of history for throughput and lag.")
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, window, **options):
+        stats = job_stats(timedelta(seconds=window))
+        if options['json']:
+            self.stdout.write(json.dumps(stats))
+            return
+        self.stdout.write(
+            f"queued {stats['queued']} (due {stats['due']}), running {stats['running']}, "
+            f"succeeded {stats['succeeded']}, failed {stats['failed']}"
+        )
+        self.stdout.write(
+            f"last {window}s: {stats['succeeded_in_window']} succeeded, {stats['failed_in_window']} failed, "
+            f"{stats['throughput_per_minute']:.1f} jobs/min"
+        )
+        self.stdout.write(
+            f"lag: oldest due {stats['oldest_due_seconds']:.1f}s, start lag avg "
+            f"{stats['avg_start_lag_seconds']:.2f}s / max {stats['max_start_lag_seconds']:.2f}s"
+        )
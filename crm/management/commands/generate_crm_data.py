@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.models import Customer, Order, Product
+from crm.synthetic import SYNTHETIC_BATCH_SIZE, generate
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a reproducible synthetic CRM dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--max-lines', type=int, default=3, help="Most products per order.")
+        parser.add_argument('--days', type=int, default=365, help="Spread dates over this many days.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=SYNTHETIC_BATCH_SIZE)
+        parser.add_argument('--flush', action='store_true', help="Delete all customers, products and orders first.")
+
+    def handle(self, *args, customers, products, orders, max_lines, days, seed, batch_size, flush, **options):
+        if orders and not (customers and products):
+            raise CommandError("Orders need at least one customer and one product.")
+        if flush:
+            Order.objects.all().delete()
+            Customer.objects.all().delete()
+            Product.objects.all().delete()
+
+        start = time.perf_counter()
+        created = generate(customers, products, orders, max_lines, days, seed, batch_size)
+        self.stdout.write(
+            "Created {customers} customers, {products} products, {orders} orders and {lines} order lines".format(
+                **created
+            ) + f" in {time.perf_counter() - start:.1f}s"
+        )
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.aggregates import rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-customer and per-product order totals from the orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=('customers', 'products'), help="Rebuild one table only.")
+
+    def handle(self, *args, only, **options):
+        start = time.perf_counter()
+        rebuilt = rebuild_aggregates(customers=only != 'products', products=only != 'customers')
+        self.stdout.write(
+            ', '.join(f"{rows} {table}" for table, rows in rebuilt.items())
+            + f" rebuilt in {time.perf_counter() - start:.2f}s"
+        )
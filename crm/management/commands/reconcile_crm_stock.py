@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from crm.reservations import reconcile_stock
+
+
+class Command(BaseCommand):
+    help = "Take the quantities of orders placed but never flushed (e.g. before a crash) off product stock."
+
+    def handle(self, *args, **options):
+        deltas = reconcile_stock()
+        if not deltas:
+            self.stdout.write("Stock is up to date")
+            return
+        self.stdout.write(f"Took {sum(deltas.values())} units off {len(deltas)} products")
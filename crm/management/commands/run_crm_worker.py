@@ -0,0 +1,49 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from alx_backend_graphql.response_cache import is_process_local
+from crm.jobs import Worker, job_stats
+
+
+class Command(BaseCommand):
+    help = "Run queued and scheduled jobs (CRM_JOB_SCHEDULE) in a pool of threads or processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="Jobs run at once.")
+        parser.add_argument('--pool', choices=('thread', 'process'), default='thread',
+                            help="Processes suit CPU-bound jobs; threads start faster and share connections.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds between looks at the queue when it is idle.")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due.")
+        parser.add_argument('--no-schedule', action='store_true',
+                            help="Only run queued jobs; leave recurring ones to other workers.")
+
+    def handle(self, *args, concurrency, pool, poll_interval, burst, no_schedule, **options):
+        if is_process_local():
+            raise CommandError(
+                "The GraphQL response cache is a LocMemCache, which the worker's writes can't invalidate "
+                "for the web process. Point CACHES['graphql'] at a shared backend, or set "
+                "GRAPHQL_RESPONSE_CACHE= to turn the cache off."
+            )
+        worker = Worker(
+            concurrency, pool, poll_interval, schedule=() if no_schedule else None, log=self.stderr.write,
+        )
+        # Finish the running jobs, then exit
+        previous = {
+            signum: signal.signal(signum, lambda *_: worker.stop()) for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        self.stdout.write(f"Worker {worker.id}: {pool} pool of {concurrency}")
+        start = time.perf_counter()
+        try:
+            outcomes = worker.run(burst=burst)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(
+            ', '.join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items())) or "No jobs run",
+        )
+        self.stdout.write(f"Stopped after {time.perf_counter() - start:.2f}s")
+        if options['verbosity'] >= 2:
+            self.stdout.write(str(job_stats()))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from alx_backend_graphql.routing import sync_sqlite_replicas
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database over the replica files (DB_REPLICAS), standing in for replication."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Copy again every this many seconds, until interrupted; 0 copies once.")
+
+    def handle(self, *args, interval, **options):
+        while True:
+            aliases = sync_sqlite_replicas()
+            self.stdout.write(f"Copied the primary to {', '.join(aliases) or 'no replicas'}")
+            if not interval or not aliases:
+                return
+            time.sleep(interval)
@@ -0,0 +1,58 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def snapshot_unit_prices(apps, schema_editor):
+    OrderLine = apps.get_model('crm', 'OrderLine')
+    Product = apps.get_model('crm', 'Product')
+    OrderLine.objects.update(
+        unit_price=models.Subquery(
+            Product.objects.filter(pk=models.OuterRef('product_id')).values('price')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_customer_order_keyset_indexes'),
+    ]
+
+    operations = [
+        # Reuse the auto-created M2M table as the explicit through model
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderLine',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='crm.order')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm.product')),
+                    ],
+                    options={
+                        'db_table': 'crm_order_products',
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(through='crm.OrderLine', to='crm.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(snapshot_unit_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+# The search objects as this migration created them, copied here so later
+# edits to crm/search.py can't change it; crm.search.repair_search_index
+# brings them up to date after migrating.
+FTS_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS crm_customer_fts "
+    "USING fts5(name, email, content='crm_customer', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS crm_customer_fts_ai AFTER INSERT ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(rowid, name, email) VALUES (new.id, new.name, new.email); END",
+    "CREATE TRIGGER IF NOT EXISTS crm_customer_fts_ad AFTER DELETE ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(crm_customer_fts, rowid, name, email) "
+    "VALUES ('delete', old.id, old.name, old.email); END",
+    "CREATE TRIGGER IF NOT EXISTS crm_customer_fts_au AFTER UPDATE OF name, email ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(crm_customer_fts, rowid, name, email) "
+    "VALUES ('delete', old.id, old.name, old.email); "
+    "INSERT INTO crm_customer_fts(rowid, name, email) VALUES (new.id, new.name, new.email); END",
+    "INSERT INTO crm_customer_fts(crm_customer_fts) VALUES ('rebuild')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS crm_product_fts "
+    "USING fts5(name, content='crm_product', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS crm_product_fts_ai AFTER INSERT ON crm_product BEGIN "
+    "INSERT INTO crm_product_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS crm_product_fts_ad AFTER DELETE ON crm_product BEGIN "
+    "INSERT INTO crm_product_fts(crm_product_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS crm_product_fts_au AFTER UPDATE OF name ON crm_product BEGIN "
+    "INSERT INTO crm_product_fts(crm_product_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO crm_product_fts(rowid, name) VALUES (new.id, new.name); END",
+    "INSERT INTO crm_product_fts(crm_product_fts) VALUES ('rebuild')",
+]
+FTS_OBJECTS = [
+    ('TRIGGER', f'{table}_{suffix}') for table in ('crm_customer_fts', 'crm_product_fts') for suffix in ('ai', 'ad', 'au')
+] + [('TABLE', 'crm_customer_fts'), ('TABLE', 'crm_product_fts')]
+
+TRIGRAM_STATEMENTS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS crm_customer_name_trgm ON crm_customer USING gin (UPPER(name) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS crm_customer_email_trgm ON crm_customer USING gin (UPPER(email) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS crm_product_name_trgm ON crm_product USING gin (UPPER(name) gin_trgm_ops)',
+]
+TRIGRAM_INDEXES = ['crm_customer_name_trgm', 'crm_customer_email_trgm', 'crm_product_name_trgm']
+
+
+def fts_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def install_search_index(apps, schema_editor):
+    """FTS5 tables and triggers on SQLite, pg_trgm indexes on PostgreSQL."""
+    connection = schema_editor.connection
+    if fts_available(connection):
+        statements = FTS_STATEMENTS
+    elif connection.vendor == 'postgresql':
+        statements = TRIGRAM_STATEMENTS
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement, params=None)
+
+
+def uninstall_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        statements = [f'DROP {kind} IF EXISTS {name}' for kind, name in FTS_OBJECTS]
+    elif schema_editor.connection.vendor == 'postgresql':
+        statements = [f'DROP INDEX IF EXISTS {name}' for name in TRIGRAM_INDEXES]
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0005_order_customer_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='crm_product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['stock'], name='crm_product_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['total_amount'], name='crm_order_total_amount_idx'),
+        ),
+        # FTS5 tables and triggers on SQLite, pg_trgm indexes on PostgreSQL
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def rebuild_aggregates(apps, schema_editor):
+    from crm.aggregates import rebuild_aggregates
+    rebuild_aggregates()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_search_and_range_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='crm.customer')),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('lifetime_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('last_order_date', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='crm.product')),
+                ('times_ordered', models.PositiveIntegerField(default=0)),
+                ('units_sold', models.PositiveBigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        # Totals of the orders placed so far
+        migrations.RunPython(rebuild_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_pending',
+            field=models.BooleanField(db_default=False),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('stock_pending', True)), fields=['id'], name='crm_order_stock_pending_idx'),
+        ),
+    ]
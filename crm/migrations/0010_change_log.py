@@ -0,0 +1,140 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:30
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+# The change-log triggers as this migration created them, copied here so
+# later edits to crm/changes.py can't change it; crm.changes.repair_change_log
+# brings them up to date after migrating.
+SQLITE_NOW = "STRFTIME('%Y-%m-%d %H:%M:%f', 'NOW')"
+TRACKED = [
+    ('customer', 'crm_customer', 'name, email, phone, created_at'),
+    ('product', 'crm_product', 'name, price, stock'),
+    ('order', 'crm_order', 'customer_id, order_date, total_amount'),
+]
+SQLITE_LOG = (
+    "INSERT INTO crm_change (model, object_id, deleted, txid, changed_at) "
+    "VALUES ('{kind}', {row}.id, {deleted}, 0, " + SQLITE_NOW + ");"
+)
+SQLITE_STATEMENTS = [
+    statement
+    for kind, table, cols in TRACKED
+    for statement in (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_touch AFTER UPDATE OF {cols} ON {table} "
+        f"WHEN new.updated_at IS old.updated_at BEGIN "
+        f"UPDATE {table} SET updated_at = {SQLITE_NOW} WHERE id = new.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_log_ai AFTER INSERT ON {table} BEGIN "
+        f"{SQLITE_LOG.format(kind=kind, row='new', deleted=0)} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_log_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"{SQLITE_LOG.format(kind=kind, row='new', deleted=0)} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_log_ad AFTER DELETE ON {table} BEGIN "
+        f"{SQLITE_LOG.format(kind=kind, row='old', deleted=1)} END",
+    )
+]
+POSTGRES_STATEMENTS = [
+    """CREATE OR REPLACE FUNCTION crm_touch_updated_at() RETURNS trigger AS $$
+    BEGIN NEW.updated_at = now(); RETURN NEW; END $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION crm_log_change() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO crm_change (model, object_id, deleted, txid, changed_at) VALUES (
+            TG_ARGV[0], CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END, TG_OP = 'DELETE',
+            pg_current_xact_id()::text::bigint, now()
+        );
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+] + [
+    statement
+    for kind, table, cols in TRACKED
+    for statement in (
+        f"DROP TRIGGER IF EXISTS {table}_touch ON {table}",
+        f"CREATE TRIGGER {table}_touch BEFORE UPDATE OF {cols} ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION crm_touch_updated_at()",
+        f"DROP TRIGGER IF EXISTS {table}_log_ai ON {table}",
+        f"CREATE TRIGGER {table}_log_ai AFTER INSERT OR DELETE OR UPDATE OF {cols} ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION crm_log_change('{kind}')",
+    )
+]
+
+
+def install_change_log(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = SQLITE_STATEMENTS
+    elif vendor == 'postgresql':
+        statements = POSTGRES_STATEMENTS
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement, params=None)
+
+
+def uninstall_change_log(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        return
+    for _, table, _ in TRACKED:
+        on = f' ON {table}' if vendor == 'postgresql' else ''
+        for suffix in ('touch', 'log_ai', 'log_au', 'log_ad'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_{suffix}{on}', params=None)
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP FUNCTION IF EXISTS crm_touch_updated_at()', params=None)
+        schema_editor.execute('DROP FUNCTION IF EXISTS crm_log_change()', params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_order_stock_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('txid', models.BigIntegerField(default=0)),
+                ('changed_at', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+            ],
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now()),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now()),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now()),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['updated_at'], name='crm_customer_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='crm_order_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='crm_product_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['txid', 'id'], name='crm_change_txid_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['changed_at'], name='crm_change_changed_at_idx'),
+        ),
+        # Triggers logging changes and bumping updated_at
+        migrations.RunPython(install_change_log, uninstall_change_log),
+    ]
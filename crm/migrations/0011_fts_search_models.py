@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:05
+
+import crm.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSearch',
+            fields=[
+                ('customer', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='fts', serialize=False, to='crm.customer')),
+                ('document', crm.models.FTSDocumentField(db_column='crm_customer_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'crm_customer_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearch',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='fts', serialize=False, to='crm.product')),
+                ('document', crm.models.FTSDocumentField(db_column='crm_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'crm_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
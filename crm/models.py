@@ -1,10 +1,24 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import Now
+from django.utils import timezone
 
 class Customer(models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField(unique=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Also bumped by triggers on writes that skip save() (see crm.changes)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='crm_customer_created_id_idx'),
+            models.Index(fields=['updated_at'], name='crm_customer_updated_at_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -13,15 +27,192 @@ class Product(models.Model):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+
+    class Meta:
+        indexes = [
+            # Range filters (price_Gte, stock_Lte, ...) and low-stock restocking
+            models.Index(fields=['price'], name='crm_product_price_idx'),
+            models.Index(fields=['stock'], name='crm_product_stock_idx'),
+            models.Index(fields=['updated_at'], name='crm_product_updated_at_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
-    products = models.ManyToManyField(Product)
+    products = models.ManyToManyField(Product, through='OrderLine')
     order_date = models.DateTimeField(auto_now_add=True)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # Quantities reserved in memory, not yet taken off Product.stock (see crm.reservations)
+    stock_pending = models.BooleanField(db_default=False)
+    # Not bumped by stock_pending, which is bookkeeping
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (order_date, id)
+            models.Index(fields=['order_date', 'id'], name='crm_order_date_id_idx'),
+            # Inactive-customer cleanup probes (customer, order_date >= cutoff)
+            models.Index(fields=['customer', 'order_date'], name='crm_order_customer_date_idx'),
+            models.Index(fields=['total_amount'], name='crm_order_total_amount_idx'),
+            # Only the few orders awaiting a stock flush
+            models.Index(fields=['id'], condition=models.Q(stock_pending=True), name='crm_order_stock_pending_idx'),
+            models.Index(fields=['updated_at'], name='crm_order_updated_at_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.customer.name}"
+
+    def compute_total(self):
+        """Sum of quantity * unit price over the order's lines, computed in the database."""
+        total = self.lines.aggregate(
+            total=Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=10, decimal_places=2))
+        )['total']
+        return round(total, 2) if total is not None else Decimal('0.00')
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    # Price at the time of ordering; later price changes don't rewrite history
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        # Took over the table Django created for the plain Order.products M2M
+        db_table = 'crm_order_products'
+        unique_together = [('order', 'product')]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} on order {self.order_id}"
+
+class CustomerStats(models.Model):
+    """Order totals of one customer, kept current by ``crm.aggregates``.
+
+    Customers without orders have no row.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    order_count = models.PositiveIntegerField(default=0)
+    lifetime_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_order_date = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.order_count} orders by {self.customer_id}"
+
+class ProductStats(models.Model):
+    """Sales totals of one product, kept current by ``crm.aggregates``.
+
+    Products never ordered have no row.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    # Orders with a line for the product
+    times_ordered = models.PositiveIntegerField(default=0)
+    units_sold = models.PositiveBigIntegerField(default=0)
+    # Quantity * unit price at the time of each order
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.units_sold} x {self.product_id} sold"
+
+class Job(models.Model):
+    """A queued call of a registered task (see ``crm.jobs``)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(s, s) for s in (QUEUED, RUNNING, SUCCEEDED, FAILED)]
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # Not picked up before this; pushed back on every retry
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Worker running the job, and until when; a lapsed lease is picked up again
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim by (status, run_at); stats scan finished jobs by time
+            models.Index(fields=['status', 'run_at'], name='crm_job_status_run_at_idx'),
+            models.Index(fields=['finished_at'], name='crm_job_finished_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+class JobSchedule(models.Model):
+    """When a recurring job from ``CRM_JOB_SCHEDULE`` is next due."""
+    key = models.CharField(max_length=255, unique=True)
+    next_run_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key} at {self.next_run_at}"
+
+class Change(models.Model):
+    """An insert, update or delete of a customer, product or order, logged
+    by database triggers (see ``crm.changes``)."""
+    # The sequence number the change feed pages by
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=10)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    # Id of the writing transaction on PostgreSQL, 0 elsewhere
+    txid = models.BigIntegerField(default=0)
+    changed_at = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        indexes = [
+            # PostgreSQL pages by (txid, id); see crm.changes
+            models.Index(fields=['txid', 'id'], name='crm_change_txid_id_idx'),
+            models.Index(fields=['changed_at'], name='crm_change_changed_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} {'deleted' if self.deleted else 'changed'} (#{self.id})"
+
+class FTSDocumentField(models.TextField):
+    """The hidden column an FTS5 table has under its own name; ``__match``
+    runs a full-text query over all of the table's columns."""
+
+@FTSDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+class CustomerSearch(models.Model):
+    """A row of the SQLite FTS5 table ``crm_customer_fts`` (see ``crm.search``),
+    which its triggers keep in step with ``Customer``."""
+    customer = models.OneToOneField(
+        Customer, models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='fts',
+    )
+    document = FTSDocumentField(db_column='crm_customer_fts')
+    # bm25: negative, lower is better
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'crm_customer_fts'
+
+class ProductSearch(models.Model):
+    """A row of the SQLite FTS5 table ``crm_product_fts``."""
+    product = models.OneToOneField(
+        Product, models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='fts',
+    )
+    document = FTSDocumentField(db_column='crm_product_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'crm_product_fts'
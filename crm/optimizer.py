@@ -0,0 +1,132 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+PAGINATION_ARGS = ('first', 'last', 'before', 'after', 'offset')
+
+
+def collect_fields(selection_set, fragments, into=None):
+    """Flatten a selection set, fragments included, into ``{name: [FieldNode]}``."""
+    fields = {} if into is None else into
+    if selection_set is None:
+        return fields
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            fields.setdefault(selection.name.value, []).append(selection)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                collect_fields(fragment.selection_set, fragments, fields)
+        elif isinstance(selection, InlineFragmentNode):
+            collect_fields(selection.selection_set, fragments, fields)
+    return fields
+
+
+def sub_fields(nodes, fragments):
+    fields = {}
+    for node in nodes:
+        collect_fields(node.selection_set, fragments, fields)
+    return fields
+
+
+def node_fields(nodes, fragments):
+    """Selections made on ``edges { node { ... } }`` of a connection field."""
+    edges = sub_fields(nodes, fragments).get('edges', [])
+    return sub_fields(sub_fields(edges, fragments).get('node', []), fragments)
+
+
+def is_filtered(nodes):
+    return any(arg.name.value not in PAGINATION_ARGS for node in nodes for arg in node.arguments)
+
+
+def get_model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        pass
+    # Reverse relations are exposed under their accessor name (e.g. order_set)
+    for rel in model._meta.related_objects:
+        if rel.get_accessor_name() == name:
+            return rel
+    return None
+
+
+# GraphQL fields computed from a one-to-one relation's columns:
+# {(model, field name): 'relation__column'}
+_related_columns = {}
+
+
+def select_through(model, relation, names):
+    """Declare that the fields ``names`` of ``model``'s type read the
+    same-named columns of ``relation``; selecting any of them joins it."""
+    for name in names:
+        _related_columns[model, name] = f'{relation}__{name}'
+
+
+class QueryPlan:
+    def __init__(self):
+        self.only = []
+        self.select_related = []
+        self.prefetch_related = []
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset.only(*self.only)
+
+
+def build_plan(model, fields, fragments, prefix='', plan=None):
+    plan = QueryPlan() if plan is None else plan
+    plan.only.append(prefix + model._meta.pk.name)
+    for name, nodes in fields.items():
+        field = get_model_field(model, to_snake_case(name))
+        if field is None:
+            column = _related_columns.get((model, to_snake_case(name)))
+            if column is not None:
+                relation = prefix + column.rpartition('__')[0]
+                if relation not in plan.select_related:
+                    plan.select_related.append(relation)
+                plan.only.append(prefix + column)
+            continue
+        if field.many_to_one and field.concrete:
+            plan.only.append(prefix + field.name)
+            related = sub_fields(nodes, fragments)
+            if related:
+                plan.select_related.append(prefix + field.name)
+                build_plan(field.related_model, related, fragments, f'{prefix}{field.name}__', plan)
+        elif field.many_to_many or field.one_to_many:
+            # Filtered sub-connections are resolved with their own queryset
+            if is_filtered(nodes):
+                continue
+            lookup = field.name if field.concrete else field.get_accessor_name()
+            extra = [] if field.concrete or field.many_to_many else [field.field.name]
+            # Connections select through edges/node, plain lists directly
+            nested = node_fields(nodes, fragments) or sub_fields(nodes, fragments)
+            queryset = optimize(
+                field.related_model._default_manager.order_by('pk'), nested, fragments, extra,
+            )
+            plan.prefetch_related.append(Prefetch(prefix + lookup, queryset=queryset))
+        elif field.concrete:
+            plan.only.append(prefix + field.name)
+    return plan
+
+
+def optimize(queryset, fields, fragments, extra=()):
+    plan = build_plan(queryset.model, fields, fragments)
+    plan.only.extend(extra)
+    return plan.apply(queryset)
+
+
+def optimize_queryset(queryset, info, extra=()):
+    """Trim ``queryset`` to what the connection's selection set will read.
+
+    Selected foreign keys (and relations declared with ``select_through``)
+    become ``select_related``, selected to-many
+    connections become ``Prefetch`` objects (optimized recursively) and
+    every other model column that isn't selected (or listed in ``extra``)
+    is deferred.
+    """
+    return optimize(queryset, node_fields(info.field_nodes, info.fragments), info.fragments, extra)
@@ -0,0 +1,110 @@
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Sum, Value, When
+
+from alx_backend_graphql.response_cache import invalidate
+from crm.aggregates import record_order
+from crm.events import stock_changed
+from crm.models import Order, OrderLine, Product
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def merge_quantities(product_ids=None, lines=None):
+    """Collapse ``productIds`` (one unit each) and ``lines`` into {product_id: quantity}."""
+    quantities = {}
+    for product_id in product_ids or []:
+        quantities[int(product_id)] = quantities.get(int(product_id), 0) + 1
+    for line in lines or []:
+        if line.quantity <= 0:
+            raise Exception("Quantity must be positive")
+        quantities[int(line.product_id)] = quantities.get(int(line.product_id), 0) + line.quantity
+    return quantities
+
+
+def quantity_case(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def decrement_stock(quantities, held=None):
+    """Take ``quantities`` off stock in one conditional UPDATE.
+
+    Each row only matches while ``stock >= quantity``, so concurrent orders
+    can never oversell; if any product falls short nothing is decremented
+    and ``InsufficientStock`` is raised. ``held`` ({product_id: quantity})
+    is stock already promised elsewhere, which must be left over. Must run
+    inside a transaction.
+    """
+    wanted = quantity_case(quantities)
+    needed = quantity_case({pk: qty + (held or {}).get(pk, 0) for pk, qty in quantities.items()})
+    updated = Product.objects.filter(pk__in=quantities, stock__gte=needed).update(stock=F('stock') - wanted)
+    if updated != len(quantities):
+        short = Product.objects.filter(pk__in=quantities, stock__lt=needed).values_list('name', flat=True)
+        raise InsufficientStock(f"Insufficient stock for {', '.join(sorted(short))}")
+    # QuerySet.update() sends no signals
+    invalidate(Product)
+    stock_changed(quantities)
+
+
+def create_order(customer, quantities, stock_pending=False):
+    """The order rows for ``quantities``: the order with its DB-computed
+    total, its lines, and its share of the aggregates. Stock is left alone.
+    Must run inside a transaction."""
+    products = Product.objects.filter(pk__in=quantities)
+    prices = dict(products.values_list('pk', 'price'))
+    total = products.aggregate(
+        total=Sum(F('price') * quantity_case(quantities), output_field=DecimalField(max_digits=10, decimal_places=2))
+    )['total']
+    # SQLite does decimal arithmetic in floating point
+    order = Order.objects.create(customer=customer, total_amount=round(total, 2), stock_pending=stock_pending)
+    OrderLine.objects.bulk_create(
+        OrderLine(order=order, product_id=pk, quantity=qty, unit_price=prices[pk])
+        for pk, qty in quantities.items()
+    )
+    invalidate(OrderLine)
+    record_order(order, quantities, prices)
+    return order
+
+
+def place_order(customer, quantities, engine=None):
+    """Create an order with one line per product and a DB-computed total,
+    and add it to the customer and product aggregates.
+
+    With a ``StockEngine`` (``crm.reservations``) the stock is reserved in
+    memory and written back later; otherwise, or inside a caller's
+    transaction (whose rollback the engine would not see), it is taken off
+    ``Product.stock`` in the order's transaction. In that case an engine
+    still reserves it, so its counters and unflushed orders count.
+
+    ``quantities`` must only reference existing products.
+    """
+    if engine is not None and not transaction.get_connection().in_atomic_block:
+        reservation = engine.reserve(quantities)
+        try:
+            with transaction.atomic():
+                order = create_order(customer, quantities, stock_pending=True)
+        except BaseException:
+            engine.release(reservation)
+            raise
+        engine.commit(reservation, order.pk)
+        return order
+    if engine is None:
+        with transaction.atomic():
+            # Write first: on SQLite this takes the write lock before any read
+            decrement_stock(quantities)
+            return create_order(customer, quantities)
+    reservation = engine.reserve(quantities)
+    try:
+        with transaction.atomic():
+            decrement_stock(quantities, held=engine.pending_for(quantities))
+            order = create_order(customer, quantities)
+    except BaseException:
+        engine.release(reservation)
+        raise
+    # Should the caller roll back, the next flush's rebase returns the stock
+    engine.settle_taken(reservation)
+    return order
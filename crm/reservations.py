@@ -0,0 +1,321 @@
+"""
+Write-behind stock reservations for ``place_order``.
+
+With ``CRM_STOCK_RESERVATIONS`` on, an order takes its quantities from
+in-memory counters instead of decrementing ``Product.stock`` in its own
+transaction, so orders for the same few products stop queueing on those
+rows:
+
+- each product's available stock is split over ``CRM_STOCK_SHARDS``
+  counters with a lock each; a thread reserves from its own shard and only
+  takes the product lock to pool the shards when its shard runs short;
+- the order is written with ``stock_pending`` set. A flusher thread applies
+  the net quantities of the orders committed since its last run every
+  ``CRM_STOCK_FLUSH_INTERVAL`` seconds, in one ``UPDATE`` of the products,
+  and clears their flags in the same transaction;
+- after a flush the counters are reset from the database (minus what is
+  reserved or committed but not yet flushed), which picks up restocks and
+  other writes to ``stock``;
+- if the process dies, the orders still flagged carry the quantities it
+  never flushed: ``reconcile_stock()`` (run when the engine starts, and by
+  ``manage.py reconcile_crm_stock``) applies them exactly once.
+
+The counters are this process's view of the stock, so only one process may
+place orders through the engine. ``Product.stock`` lags behind by up to a
+flush interval; ``checkStockAvailability`` reports the live numbers.
+"""
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from alx_backend_graphql.batch import release_connections
+from alx_backend_graphql.response_cache import invalidate
+from crm.bulk import chunked
+from crm.events import stock_changed
+from crm.models import Order, OrderLine, Product
+from crm.orders import InsufficientStock, quantity_case
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARDS = 4
+DEFAULT_FLUSH_INTERVAL = 0.5
+# Order ids per UPDATE when clearing their flags
+FLUSH_CHUNK_SIZE = 500
+
+
+class Shard:
+    __slots__ = ('lock', 'available', 'in_flight')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.available = 0
+        # Reserved by orders whose transaction hasn't finished
+        self.in_flight = 0
+
+
+class ProductCounter:
+    """Available stock of one product, split over shards."""
+
+    def __init__(self, stock, shards=DEFAULT_SHARDS):
+        self.lock = threading.Lock()
+        self.shards = [Shard() for _ in range(shards)]
+        self.spread(stock)
+
+    def spread(self, available):
+        # Caller holds every shard lock (or owns the counter)
+        share, extra = divmod(max(available, 0), len(self.shards))
+        for i, shard in enumerate(self.shards):
+            shard.available = share + (i < extra)
+
+    def take(self, quantity, index):
+        """Reserve ``quantity`` on shard ``index``; False if the product
+        doesn't have that much left."""
+        shard = self.shards[index]
+        with shard.lock:
+            if shard.available >= quantity:
+                shard.available -= quantity
+                shard.in_flight += quantity
+                return True
+        # Short on this shard: pool all of them
+        with self.lock:
+            for other in self.shards:
+                other.lock.acquire()
+            try:
+                total = sum(other.available for other in self.shards)
+                if total < quantity:
+                    return False
+                self.spread(total - quantity)
+                shard.in_flight += quantity
+                return True
+            finally:
+                for other in self.shards:
+                    other.lock.release()
+
+    def settle(self, quantity, index, committed):
+        """End a reservation: committed, or given back."""
+        shard = self.shards[index]
+        with shard.lock:
+            shard.in_flight -= quantity
+            if not committed:
+                shard.available += quantity
+
+    def rebase(self, stock):
+        """Reset from ``stock`` (database stock minus committed, unflushed
+        quantities), keeping what is in flight reserved."""
+        with self.lock:
+            for shard in self.shards:
+                shard.lock.acquire()
+            try:
+                self.spread(stock - sum(shard.in_flight for shard in self.shards))
+            finally:
+                for shard in self.shards:
+                    shard.lock.release()
+
+    def totals(self):
+        available = in_flight = 0
+        for shard in self.shards:
+            with shard.lock:
+                available += shard.available
+                in_flight += shard.in_flight
+        return available, in_flight
+
+
+class Reservation:
+    def __init__(self, quantities, shard):
+        self.quantities = quantities
+        self.shard = shard
+
+
+def apply_pending(orders, using='default'):
+    """Take the quantities of ``orders`` ({order_id: {product_id: quantity}})
+    that are still flagged off stock, and clear their flags. Must run inside
+    a transaction. Returns the quantities applied per product."""
+    lock = transaction.get_connection(using).features.has_select_for_update
+    still_pending = []
+    for chunk in chunked(orders, FLUSH_CHUNK_SIZE):
+        pending = Order.objects.using(using).filter(pk__in=chunk, stock_pending=True)
+        still_pending.extend((pending.select_for_update() if lock else pending).values_list('pk', flat=True))
+    deltas = Counter()
+    for pk in still_pending:
+        deltas.update(orders[pk])
+    if deltas:
+        wanted = quantity_case(deltas)
+        products = Product.objects.using(using).filter(pk__in=deltas)
+        short = list(products.filter(stock__lt=wanted).values_list('name', flat=True))
+        if short:
+            # The orders are committed; all that is left is not to go negative
+            logger.error("Flushed orders took more than the stock of %s; clamped at 0", ', '.join(sorted(short)))
+        products.update(stock=Greatest(F('stock') - wanted, Value(0)))
+        stock_changed(deltas)
+    for chunk in chunked(still_pending, FLUSH_CHUNK_SIZE):
+        Order.objects.using(using).filter(pk__in=chunk).update(stock_pending=False)
+    return deltas
+
+
+def reconcile_stock(using='default'):
+    """Apply the quantities of every order still flagged ``stock_pending``,
+    e.g. after the process that placed them died before flushing.
+
+    Returns the quantities applied per product.
+    """
+    with transaction.atomic(using):
+        lines = OrderLine.objects.using(using).filter(order__stock_pending=True).values_list(
+            'order_id', 'product_id', 'quantity',
+        )
+        orders = {}
+        for order_id, product_id, quantity in lines:
+            orders.setdefault(order_id, {})[product_id] = quantity
+        deltas = apply_pending(orders, using)
+    if deltas:
+        invalidate(Product)
+    return deltas
+
+
+class StockEngine:
+    def __init__(self, shards=DEFAULT_SHARDS, using='default'):
+        self.shard_count = shards
+        self.using = using
+        self.counters = {}
+        # Committed orders not yet flushed: {order_id: quantities}, and their sum
+        self.pending_orders = {}
+        self.pending = Counter()
+        # Order: flush -> pending -> product -> shard
+        self._flush_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def counters_for(self, product_ids):
+        missing = [pk for pk in product_ids if pk not in self.counters]
+        if missing:
+            # Not while a flush is between its UPDATE and its rebase
+            with self._flush_lock:
+                stock = dict(Product.objects.using(self.using).filter(pk__in=missing).values_list('pk', 'stock'))
+                for pk in missing:
+                    if pk not in self.counters:
+                        self.counters[pk] = ProductCounter(stock.get(pk, 0), self.shard_count)
+        return {pk: self.counters[pk] for pk in product_ids}
+
+    def reserve(self, quantities):
+        """Reserve ``quantities`` ({product_id: quantity}), all or nothing."""
+        shard = threading.get_ident() % self.shard_count
+        counters = self.counters_for(quantities)
+        taken = []
+        for pk in sorted(quantities):
+            if not counters[pk].take(quantities[pk], shard):
+                for done in taken:
+                    counters[done].settle(quantities[done], shard, committed=False)
+                name = Product.objects.using(self.using).filter(pk=pk).values_list('name', flat=True).first()
+                raise InsufficientStock(f"Insufficient stock for {name}")
+            taken.append(pk)
+        return Reservation(quantities, shard)
+
+    def release(self, reservation):
+        """Give back a reservation whose order wasn't written."""
+        for pk, quantity in reservation.quantities.items():
+            self.counters[pk].settle(quantity, reservation.shard, committed=False)
+
+    def settle_taken(self, reservation):
+        """End a reservation whose quantities the order took off
+        ``Product.stock`` itself: nothing is left for the flush."""
+        for pk, quantity in reservation.quantities.items():
+            self.counters[pk].settle(quantity, reservation.shard, committed=True)
+
+    def pending_for(self, product_ids):
+        """{product_id: quantity} committed through the engine but not flushed."""
+        with self._pending_lock:
+            return {pk: self.pending[pk] for pk in product_ids}
+
+    def commit(self, reservation, order_id):
+        """Record that ``order_id`` was committed with ``reservation``; its
+        quantities go to ``Product.stock`` at the next flush."""
+        with self._pending_lock:
+            self.pending_orders[order_id] = reservation.quantities
+            self.pending.update(reservation.quantities)
+            for pk, quantity in reservation.quantities.items():
+                self.counters[pk].settle(quantity, reservation.shard, committed=True)
+
+    def flush(self):
+        """Apply the committed orders' quantities to ``Product.stock`` and
+        reset the counters from the database. Returns the orders flushed."""
+        with self._flush_lock:
+            with self._pending_lock:
+                orders, self.pending_orders = self.pending_orders, {}
+                deltas, self.pending = self.pending, Counter()
+            try:
+                with transaction.atomic(self.using):
+                    if orders:
+                        # Orders reconciled by someone else are skipped
+                        apply_pending(orders, self.using)
+                    stock = dict(
+                        Product.objects.using(self.using).filter(pk__in=list(self.counters)).values_list('pk', 'stock')
+                    )
+            except BaseException:
+                with self._pending_lock:
+                    self.pending_orders.update(orders)
+                    self.pending.update(deltas)
+                raise
+            if orders:
+                # QuerySet.update() sends no signals
+                invalidate(Product)
+            with self._pending_lock:
+                for pk, counter in self.counters.items():
+                    counter.rebase(stock.get(pk, 0) - self.pending[pk])
+        return len(orders)
+
+    def availability(self, product_ids):
+        """{product_id: (available, in_flight, pending)} as the engine sees them."""
+        counters = self.counters_for(product_ids)
+        pending = self.pending_for(product_ids)
+        return {pk: (*counters[pk].totals(), pending[pk]) for pk in product_ids}
+
+    def start(self, interval=DEFAULT_FLUSH_INTERVAL):
+        """Flush every ``interval`` seconds in a background thread, and once
+        more at exit."""
+        def run():
+            while not self._stopping.wait(interval):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Stock flush failed; retrying at the next interval")
+                finally:
+                    release_connections()
+
+        self._thread = threading.Thread(target=run, name='crm-stock-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Final stock flush failed; reconcile_stock() will apply it")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The process's engine, started on first use; ``None`` when
+    ``CRM_STOCK_RESERVATIONS`` is off."""
+    global _engine
+    if not getattr(settings, 'CRM_STOCK_RESERVATIONS', False):
+        return None
+    with _engine_lock:
+        if _engine is None:
+            # Orders a previous process placed but never flushed
+            reconcile_stock()
+            _engine = StockEngine(getattr(settings, 'CRM_STOCK_SHARDS', DEFAULT_SHARDS))
+            _engine.start(getattr(settings, 'CRM_STOCK_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+        return _engine
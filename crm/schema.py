@@ -1,31 +1,131 @@
+from decimal import Decimal
+
 import graphene
-from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField 
-from crm.models import Customer, Order
+from asgiref.sync import sync_to_async
+from graphene_django import DjangoListField, DjangoObjectType
+from crm.models import Customer, Order, OrderLine
 from crm.models import Product
 from crm.filters import CustomerFilter, ProductFilter, OrderFilter
-from django.db import transaction
+from crm.bulk import BULK_CHUNK_SIZE, is_valid_phone, iter_bulk_create_customers
+from crm.changes import DEFAULT_PAGE_SIZE, changes_since
+from crm.events import ORDER_CREATED, STOCK_CHANGED, order_created, stock_changed
+from crm.fields import CountableConnection, DataLoaderConnectionField, KeysetConnectionField, has_filter_args
+from crm.loaders import get_loaders, is_async, is_prefetched
+from crm.optimizer import select_through
+from crm.orders import merge_quantities, place_order
+from crm.reservations import get_engine
+from alx_backend_graphql.pubsub import subscribe
+from alx_backend_graphql.response_cache import invalidate
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction
+from django.db.models import F
+from graphql import GraphQLError
+
+def get_stats(obj):
+    """The ``stats`` row of a customer or product; ``None`` until its first order."""
+    try:
+        return obj.stats
+    except ObjectDoesNotExist:
+        return None
 
 class CustomerType(DjangoObjectType):
+    orders = DataLoaderConnectionField(lambda: OrderType, required=True)
+    # Served from CustomerStats, not aggregated per request
+    order_count = graphene.Int(required=True)
+    lifetime_total = graphene.Decimal(required=True)
+    last_order_date = graphene.DateTime()
+
     class Meta:
         model = Customer
         fields = "__all__"
         interfaces = (graphene.relay.Node, )
         filterset_class = CustomerFilter
+        connection_class = CountableConnection
+
+    def resolve_orders(root, info, **kwargs):
+        # Filtered sub-queries can't share the batch, so they hit the ORM directly
+        if has_filter_args(kwargs):
+            return root.orders.all()
+        if is_prefetched(root, 'orders'):
+            return list(root.orders.all())
+        return get_loaders(info).orders_by_customer.load(root.pk)
+
+    def resolve_order_count(root, info):
+        stats = get_stats(root)
+        return stats.order_count if stats else 0
+
+    def resolve_lifetime_total(root, info):
+        stats = get_stats(root)
+        return stats.lifetime_total if stats else Decimal('0.00')
+
+    def resolve_last_order_date(root, info):
+        stats = get_stats(root)
+        return stats.last_order_date if stats else None
 
 class ProductType(DjangoObjectType):
+    # Served from ProductStats
+    times_ordered = graphene.Int(required=True)
+    units_sold = graphene.Int(required=True)
+    revenue = graphene.Decimal(required=True)
+
     class Meta:
         model = Product
         fields = "__all__"
         interfaces = (graphene.relay.Node, )
         filterset_class = ProductFilter
+        connection_class = CountableConnection
+
+    def resolve_times_ordered(root, info):
+        stats = get_stats(root)
+        return stats.times_ordered if stats else 0
+
+    def resolve_units_sold(root, info):
+        stats = get_stats(root)
+        return stats.units_sold if stats else 0
+
+    def resolve_revenue(root, info):
+        stats = get_stats(root)
+        return stats.revenue if stats else Decimal('0.00')
+
+select_through(Customer, 'stats', ('order_count', 'lifetime_total', 'last_order_date'))
+select_through(Product, 'stats', ('times_ordered', 'units_sold', 'revenue'))
+
+class OrderLineType(DjangoObjectType):
+    class Meta:
+        model = OrderLine
+        fields = ("product", "quantity", "unit_price")
 
 class OrderType(DjangoObjectType):
+    products = DataLoaderConnectionField(ProductType, required=True)
+    lines = DjangoListField(OrderLineType)
+
     class Meta:
         model = Order
         fields = "__all__"
         interfaces = (graphene.relay.Node, )
         filterset_class = OrderFilter
+        connection_class = CountableConnection
+
+    def resolve_customer(root, info):
+        if Order.customer.is_cached(root):
+            return root.customer
+        return get_loaders(info).customer_by_id.load(root.customer_id)
+
+    def resolve_products(root, info, **kwargs):
+        if has_filter_args(kwargs):
+            return root.products.all()
+        if is_prefetched(root, 'products'):
+            return list(root.products.all())
+        return get_loaders(info).products_by_order.load(root.pk)
+
+    def resolve_lines(root, info):
+        if is_prefetched(root, 'lines'):
+            return list(root.lines.all())
+        lines = root.lines.select_related('product')
+        if is_async(info):
+            # The product's aggregate fields can't fetch their row lazily here
+            return sync_to_async(list)(lines.select_related('product__stats'))
+        return lines
 
 class CustomerInput(graphene.InputObjectType):
     name = graphene.String(required=True)
@@ -37,9 +137,14 @@ class ProductInput(graphene.InputObjectType):
     price = graphene.Decimal(required=True)
     stock = graphene.Int()
 
+class OrderLineInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(required=True)
+
 class OrderInput(graphene.InputObjectType):
     customerId = graphene.ID(required=True)
-    productIds = graphene.List(graphene.ID, required=True)
+    productIds = graphene.List(graphene.ID)
+    lines = graphene.List(OrderLineInput)
 
 class CreateCustomer(graphene.Mutation):
     class Arguments:
@@ -51,7 +156,7 @@ class CreateCustomer(graphene.Mutation):
     def mutate(root, info, input):
         if Customer.objects.filter(email=input.email).exists():
             raise Exception("Email already exists")
-        if input.phone and not input.phone.replace('-', '').replace('+', '').isdigit():
+        if input.phone and not is_valid_phone(input.phone):
              raise Exception("Invalid phone format")
 
         customer = Customer(name=input.name, email=input.email, phone=input.phone)
@@ -61,22 +166,20 @@ class CreateCustomer(graphene.Mutation):
 class BulkCreateCustomers(graphene.Mutation):
     class Arguments:
         inputs = graphene.List(CustomerInput, required=True)
+        chunk_size = graphene.Int()
 
     customers = graphene.List(CustomerType)
     errors = graphene.List(graphene.String)
 
-    def mutate(root, info, inputs):
+    def mutate(root, info, inputs, chunk_size=None):
+        if chunk_size is not None and chunk_size < 1:
+            raise GraphQLError("chunkSize must be at least 1")
         created_customers = []
         error_messages = []
-        for data in inputs:
-            try:
-                if Customer.objects.filter(email=data.email).exists():
-                    raise Exception(f"Email {data.email} already exists")
-                customer = Customer(name=data.name, email=data.email, phone=data.phone)
-                customer.save()
-                created_customers.append(customer)
-            except Exception as e:
-                error_messages.append(str(e))
+        with transaction.atomic():
+            for created, errors in iter_bulk_create_customers(inputs, chunk_size or BULK_CHUNK_SIZE):
+                created_customers.extend(created)
+                error_messages.extend(errors)
         return BulkCreateCustomers(customers=created_customers, errors=error_messages)
 
 class CreateProduct(graphene.Mutation):
@@ -88,6 +191,7 @@ class CreateProduct(graphene.Mutation):
         if input.price <= 0: raise Exception("Price must be positive")
         product = Product(name=input.name, price=input.price, stock=input.stock or 0)
         product.save()
+        stock_changed([product.pk])
         return CreateProduct(product=product)
 
 class CreateOrder(graphene.Mutation):
@@ -100,29 +204,96 @@ class CreateOrder(graphene.Mutation):
             customer = Customer.objects.get(pk=input.customerId)
         except:
             raise Exception("Invalid Customer ID")
-            
-        products = Product.objects.filter(id__in=input.productIds)
-        if not products: raise Exception("No valid products found")
-        
-        with transaction.atomic():
-            total = sum(p.price for p in products)
-            order = Order.objects.create(customer=customer, total_amount=total)
-            order.products.set(products)
-            order.save()
+
+        quantities = merge_quantities(input.productIds, input.lines)
+        valid_ids = set(Product.objects.filter(id__in=quantities).values_list('id', flat=True))
+        quantities = {pk: qty for pk, qty in quantities.items() if pk in valid_ids}
+        if not quantities: raise Exception("No valid products found")
+
+        order = place_order(customer, quantities, engine=get_engine())
+        order_created(order)
         return CreateOrder(order=order)
 
+class StockAvailability(graphene.ObjectType):
+    product_id = graphene.ID(required=True)
+    # What new orders can still take
+    available = graphene.Int(required=True)
+    # Held by orders being written
+    reserved = graphene.Int(required=True)
+    # Ordered, but not yet taken off the product's stock field
+    pending = graphene.Int(required=True)
+
+class CheckStockAvailability(graphene.Mutation):
+    """Live stock, counting the in-memory reservations. A mutation so the
+    response cache never serves it."""
+    class Arguments:
+        product_ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    availability = graphene.List(graphene.NonNull(StockAvailability))
+
+    def mutate(root, info, product_ids):
+        stock = dict(Product.objects.filter(pk__in=[int(pk) for pk in product_ids]).values_list('pk', 'stock'))
+        engine = get_engine()
+        if engine is None:
+            live = {pk: (quantity, 0, 0) for pk, quantity in stock.items()}
+        else:
+            live = engine.availability(list(stock))
+        return CheckStockAvailability(availability=[
+            StockAvailability(product_id=pk, available=available, reserved=reserved, pending=pending)
+            for pk, (available, reserved, pending) in sorted(live.items())
+        ])
+
+def supports_update_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+def restock_product_ids(threshold, increment):
+    """Add ``increment`` to every product below ``threshold``; returns their ids."""
+    if supports_update_returning():
+        table = connection.ops.quote_name(Product._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {table} SET stock = stock + %s WHERE stock < %s RETURNING id", [increment, threshold])
+            return [row[0] for row in cursor.fetchall()]
+    # No UPDATE ... RETURNING: lock the rows, then update them as a set
+    ids = list(Product.objects.select_for_update().filter(stock__lt=threshold).values_list('pk', flat=True))
+    Product.objects.filter(pk__in=ids).update(stock=F('stock') + increment)
+    return ids
+
+def restock_products(threshold, increment):
+    """Add ``increment`` to every product below ``threshold`` in one statement."""
+    if supports_update_returning():
+        table = connection.ops.quote_name(Product._meta.db_table)
+        return list(Product.objects.raw(
+            f"UPDATE {table} SET stock = stock + %s WHERE stock < %s RETURNING *",
+            [increment, threshold],
+        ))
+    return list(Product.objects.filter(pk__in=restock_product_ids(threshold, increment)))
+
 class UpdateLowStockProducts(graphene.Mutation):
+    class Arguments:
+        threshold = graphene.Int(default_value=10)
+        increment = graphene.Int(default_value=10)
+        count_only = graphene.Boolean(default_value=False)
+
     success = graphene.Boolean()
+    updated_count = graphene.Int()
     updated_products = graphene.List(ProductType)
 
-    def mutate(self, info):
-        low_stock_products = Product.objects.filter(stock__lt=10)
-        updated_list = []
-        for product in low_stock_products:
-            product.stock += 10
-            product.save()
-            updated_list.append(product)
-        return UpdateLowStockProducts(success=True, updated_products=updated_list)
+    def mutate(self, info, threshold, increment, count_only):
+        if increment <= 0: raise Exception("Increment must be positive")
+        updated_list = None
+        with transaction.atomic():
+            if count_only:
+                updated_ids = restock_product_ids(threshold, increment)
+            else:
+                updated_list = restock_products(threshold, increment)
+                updated_ids = [product.pk for product in updated_list]
+            updated_count = len(updated_ids)
+            if updated_count:
+                invalidate(Product)
+                stock_changed(updated_ids)
+        return UpdateLowStockProducts(success=True, updated_count=updated_count, updated_products=updated_list)
 
 class Mutation(graphene.ObjectType):
     create_customer = CreateCustomer.Field()
@@ -130,10 +301,73 @@ class Mutation(graphene.ObjectType):
     create_product = CreateProduct.Field()
     create_order = CreateOrder.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
+    check_stock_availability = CheckStockAvailability.Field()
+
+class ChangeType(graphene.ObjectType):
+    # Position in the change log; increases with every write
+    sequence = graphene.Int(required=True)
+    model = graphene.String(required=True)
+    object_id = graphene.ID(required=True)
+    # A tombstone: the row is gone
+    deleted = graphene.Boolean(required=True)
+    changed_at = graphene.DateTime(required=True)
+    # The current row, on the field matching ``model``
+    customer = graphene.Field(CustomerType)
+    product = graphene.Field(ProductType)
+    order = graphene.Field(OrderType)
+
+    def resolve_sequence(root, info):
+        return root.id
+
+    def resolve_customer(root, info):
+        return root.instance if root.model == 'customer' else None
+
+    def resolve_product(root, info):
+        return root.instance if root.model == 'product' else None
+
+    def resolve_order(root, info):
+        return root.instance if root.model == 'order' else None
+
+class ChangeFeed(graphene.ObjectType):
+    changes = graphene.List(graphene.NonNull(ChangeType), required=True)
+    # Pass back as ``cursor`` on the next poll
+    cursor = graphene.String(required=True)
+    has_more = graphene.Boolean(required=True)
 
 class Query(graphene.ObjectType):
-    all_customers = DjangoFilterConnectionField(CustomerType)
-    all_products = DjangoFilterConnectionField(ProductType)
-    all_orders = DjangoFilterConnectionField(OrderType)
+    all_customers = DataLoaderConnectionField(CustomerType)
+    all_products = DataLoaderConnectionField(ProductType)
+    all_orders = DataLoaderConnectionField(OrderType)
+    all_customers_keyset = KeysetConnectionField(CustomerType, keyset=('created_at', 'id'))
+    all_orders_keyset = KeysetConnectionField(OrderType, keyset=('order_date', 'id'))
+    changes_since = graphene.Field(
+        ChangeFeed, required=True, cursor=graphene.String(), first=graphene.Int(default_value=DEFAULT_PAGE_SIZE),
+    )
+
+    def resolve_changes_since(root, info, cursor=None, first=DEFAULT_PAGE_SIZE):
+        changes, cursor, has_more = changes_since(cursor, first)
+        return ChangeFeed(changes=changes, cursor=cursor, has_more=has_more)
+
+class Subscription(graphene.ObjectType):
+    """Served over WebSockets (see ``alx_backend_graphql.subscriptions``)."""
+    order_created = graphene.Field(OrderType, required=True)
+    # Products whose stock was written; with ``threshold``, only those now below it
+    stock_changed = graphene.Field(ProductType, required=True, threshold=graphene.Int())
+
+    async def subscribe_order_created(root, info):
+        async with subscribe(ORDER_CREATED) as messages:
+            async for message in messages:
+                order = await Order.objects.select_related('customer__stats').filter(pk=message['order_id']).afirst()
+                if order is not None:
+                    yield order
+
+    async def subscribe_stock_changed(root, info, threshold=None):
+        async with subscribe(STOCK_CHANGED) as messages:
+            async for message in messages:
+                products = Product.objects.select_related('stats').filter(pk__in=message['product_ids'])
+                if threshold is not None:
+                    products = products.filter(stock__lt=threshold)
+                async for product in products.order_by('pk'):
+                    yield product
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
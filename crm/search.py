@@ -0,0 +1,225 @@
+"""
+Full-text search behind the ``search`` argument of the list connections.
+
+- SQLite: FTS5 tables (``crm_customer_fts`` on name and email,
+  ``crm_product_fts`` on name) mirror their model tables through triggers,
+  so every write path (``save``, ``bulk_create``, ``update``, raw SQL)
+  keeps them in sync. Every word of the query must match as a prefix
+  ("ali exa" finds alice@example.com); customers and products are ranked
+  by bm25, orders by how many of their customer and products match.
+- PostgreSQL: ``pg_trgm`` GIN indexes on ``UPPER(name)``/``UPPER(email)``,
+  which also serve the plain ``icontains`` filters (Django compares
+  ``UPPER(column) LIKE UPPER(%s)``); relevance is trigram word similarity.
+- Any other database, or SQLite built without FTS5, falls back to
+  ``icontains`` with no ranking.
+
+Orders match on their customer's name and on the names of their products.
+Results come most relevant first, ties by id.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models import Case, Count, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from crm.models import Customer, CustomerSearch, Order, OrderLine, Product, ProductSearch
+
+# Columns indexed per FTS5 table, in the order they were declared
+FTS_TABLES = {
+    'crm_customer_fts': (Customer, ('name', 'email')),
+    'crm_product_fts': (Product, ('name',)),
+}
+
+TRIGRAM_INDEXES = {
+    'crm_customer_name_trgm': (Customer, 'name'),
+    'crm_customer_email_trgm': (Customer, 'email'),
+    'crm_product_name_trgm': (Product, 'name'),
+}
+
+
+def fts_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def fts_statements(table, model, columns):
+    content = model._meta.db_table
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    return [
+        # Prefix indexes keep short prefix terms ("al"*) from scanning the whole vocabulary
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+        f"USING fts5({cols}, content='{content}', content_rowid='id', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {content} BEGIN "
+        f"INSERT INTO {table}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {content} BEGIN "
+        f"INSERT INTO {table}({table}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF {cols} ON {content} BEGIN "
+        f"INSERT INTO {table}({table}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {table}(rowid, {cols}) VALUES (new.id, {new}); END",
+    ]
+
+
+def missing_fts_objects(cursor):
+    names = [table for table in FTS_TABLES] + [
+        f'{table}_{suffix}' for table in FTS_TABLES for suffix in ('ai', 'ad', 'au')
+    ]
+    cursor.execute(
+        f"SELECT name FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(names))})", names,
+    )
+    return set(names) - {row[0] for row in cursor.fetchall()}
+
+
+def install_search_index(connection):
+    """Create whatever search tables, triggers and indexes are missing.
+
+    Idempotent. On SQLite the FTS tables are rebuilt from their content
+    tables when anything had to be (re)created: Django drops the triggers
+    whenever a migration remakes ``crm_customer`` or ``crm_product``.
+    """
+    _fts_ready.clear()
+    if fts_available(connection):
+        with connection.cursor() as cursor:
+            if not missing_fts_objects(cursor):
+                return
+            for table, (model, columns) in FTS_TABLES.items():
+                for statement in fts_statements(table, model, columns):
+                    cursor.execute(statement)
+                cursor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for name, (model, column) in TRIGRAM_INDEXES.items():
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {name} ON {model._meta.db_table} '
+                    f'USING gin (UPPER({column}) gin_trgm_ops)'
+                )
+
+
+def uninstall_search_index(connection):
+    _fts_ready.clear()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for table in FTS_TABLES:
+                for suffix in ('ai', 'ad', 'au'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {table}_{suffix}')
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+        elif connection.vendor == 'postgresql':
+            for name in TRIGRAM_INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def repair_search_index(sender, using, **kwargs):
+    """``post_migrate`` receiver: put back triggers a table remake dropped."""
+    if router.allow_migrate(using, 'crm'):
+        install_search_index(connections[using])
+
+
+def fts_query(text):
+    """Every word as a quoted prefix term; FTS5 ANDs them together."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+class FTSBackend:
+    @staticmethod
+    def ranked(queryset, query):
+        # Joining the FTS table (``CustomerSearch``/``ProductSearch`` through
+        # the ``fts`` relation) ranks every match in the same pass that finds
+        # them; a correlated bm25() subquery would redo the search per row
+        return queryset.filter(fts__document__match=query).annotate(relevance=-F('fts__rank'))
+
+    def customers(self, queryset, text):
+        return self.ranked(queryset, fts_query(text))
+
+    def products(self, queryset, text):
+        return self.ranked(queryset, fts_query(text))
+
+    def orders(self, queryset, text):
+        # bm25 would cost one FTS lookup per matching order. Rank orders by how
+        # many of their customer and products match instead: SQLite builds
+        # both match lists once per query.
+        query = fts_query(text)
+        customers = CustomerSearch.objects.filter(document__match=query).values('customer_id')
+        products = ProductSearch.objects.filter(document__match=query).values('product_id')
+        matching_lines = OrderLine.objects.filter(order_id=OuterRef('pk'), product_id__in=products).order_by().values(
+            'order_id',
+        ).annotate(count=Count('*')).values('count')
+        return queryset.filter(
+            Q(customer_id__in=customers) | Q(pk__in=OrderLine.objects.filter(product_id__in=products).values('order_id'))
+        ).annotate(relevance=(
+            Case(When(customer_id__in=customers, then=1.0), default=0.0, output_field=FloatField())
+            + Coalesce(Subquery(matching_lines, output_field=FloatField()), 0.0)
+        ))
+
+
+class ContainsBackend:
+    """``icontains`` on the same columns; unranked."""
+
+    def customers(self, queryset, text):
+        return queryset.filter(Q(name__icontains=text) | Q(email__icontains=text)).annotate(
+            relevance=self.customer_relevance(text),
+        )
+
+    def products(self, queryset, text):
+        return queryset.filter(name__icontains=text).annotate(relevance=self.product_relevance(text))
+
+    def orders(self, queryset, text):
+        return queryset.filter(
+            Q(customer__name__icontains=text)
+            | Q(pk__in=OrderLine.objects.filter(product__name__icontains=text).values('order_id'))
+        ).annotate(relevance=self.order_relevance(text))
+
+    def customer_relevance(self, text):
+        return Value(0.0, output_field=FloatField())
+
+    product_relevance = order_relevance = customer_relevance
+
+
+class TrigramBackend(ContainsBackend):
+    def customer_relevance(self, text):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        return Greatest(TrigramWordSimilarity(text, 'name'), TrigramWordSimilarity(text, 'email'))
+
+    def product_relevance(self, text):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        return TrigramWordSimilarity(text, 'name')
+
+    def order_relevance(self, text):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        best_product = OrderLine.objects.filter(order_id=OuterRef('pk')).annotate(
+            score=TrigramWordSimilarity(text, 'product__name'),
+        ).order_by('-score').values('score')[:1]
+        return Greatest(TrigramWordSimilarity(text, 'customer__name'), Coalesce(Subquery(best_product), 0.0))
+
+
+_fts_ready = {}
+
+
+def fts_ready(connection):
+    """Whether the FTS tables and triggers exist; checked once per database."""
+    key = (connection.alias, str(connection.settings_dict['NAME']))
+    if key not in _fts_ready:
+        with connection.cursor() as cursor:
+            _fts_ready[key] = fts_available(connection) and not missing_fts_objects(cursor)
+    return _fts_ready[key]
+
+
+def get_backend(connection):
+    if connection.vendor == 'postgresql':
+        return TrigramBackend()
+    if fts_ready(connection):
+        return FTSBackend()
+    return ContainsBackend()
+
+
+def search(queryset, text):
+    """Restrict ``queryset`` to rows matching ``text``, most relevant first."""
+    if not re.search(r'\w', text):
+        return queryset.none()
+    backend = get_backend(connections[queryset.db])
+    method = {Customer: backend.customers, Product: backend.products, Order: backend.orders}[queryset.model]
+    return method(queryset, text).order_by('-relevance', 'pk')
@@ -0,0 +1,108 @@
+"""
+Reproducible synthetic CRM data for load tests and benchmarks.
+
+The same ``seed`` and scale always produce the same rows (dates are
+relative to ``now``). Everything goes in with ``bulk_create`` in batches,
+so memory stays flat however many orders are asked for.
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from alx_backend_graphql.response_cache import invalidate
+from crm.aggregates import rebuild_aggregates
+from crm.bulk import chunked
+from crm.models import Customer, Order, OrderLine, Product
+
+SYNTHETIC_BATCH_SIZE = 5000
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let ``bulk_create`` keep the values set on ``auto_now_add`` fields."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def generate(customers, products, orders, max_lines=3, days=365, seed=0, batch_size=SYNTHETIC_BATCH_SIZE,
+             now=None):
+    """Insert ``customers``, ``products`` and ``orders`` (1..``max_lines`` lines each).
+
+    Orders and signups are spread over the last ``days`` days. Returns the
+    number of rows created per model. The customer and product aggregates
+    are rebuilt when any orders were added.
+    """
+    rng = random.Random(seed)
+    now = now or timezone.now()
+    window = timedelta(days=days).total_seconds()
+
+    def past():
+        return now - timedelta(seconds=rng.random() * window)
+
+    created = {'customers': 0, 'products': 0, 'orders': 0, 'lines': 0}
+    with transaction.atomic(), explicit_timestamps(
+        Customer._meta.get_field('created_at'), Order._meta.get_field('order_date')
+    ):
+        customer_ids = []
+        for batch in chunked(range(customers), batch_size):
+            rows = Customer.objects.bulk_create(
+                Customer(
+                    name=f"Customer {seed}-{i}",
+                    email=f"customer{i}.s{seed}@example.com",
+                    phone=f"+1{rng.randrange(10**9, 10**10)}",
+                    created_at=past(),
+                )
+                for i in batch
+            )
+            customer_ids.extend(c.pk for c in rows)
+        created['customers'] = len(customer_ids)
+
+        catalog = Product.objects.bulk_create(
+            (Product(
+                name=f"Product {seed}-{i}",
+                price=Decimal(rng.randrange(100, 50000)) / 100,
+                stock=rng.randrange(0, 200),
+            ) for i in range(products)),
+            batch_size=batch_size,
+        )
+        created['products'] = len(catalog)
+
+        lines_cap = min(max_lines, len(catalog))
+        for batch in chunked(range(orders), batch_size):
+            # Draw each order in one go so the output doesn't depend on batch_size
+            drafts = [
+                (
+                    rng.choice(customer_ids),
+                    past(),
+                    {product: rng.randint(1, 5) for product in rng.sample(catalog, rng.randint(1, lines_cap))},
+                )
+                for _ in batch
+            ]
+            rows = Order.objects.bulk_create(
+                Order(
+                    customer_id=customer_id,
+                    order_date=order_date,
+                    total_amount=sum(product.price * qty for product, qty in basket.items()),
+                )
+                for customer_id, order_date, basket in drafts
+            )
+            lines = OrderLine.objects.bulk_create(
+                OrderLine(order_id=order.pk, product_id=product.pk, quantity=qty, unit_price=product.price)
+                for order, (_, _, basket) in zip(rows, drafts)
+                for product, qty in basket.items()
+            )
+            created['orders'] += len(rows)
+            created['lines'] += len(lines)
+        if created['orders']:
+            rebuild_aggregates()
+        invalidate(Customer, Product, Order)
+    return created
@@ -0,0 +1,57 @@
+"""
+Tasks for the job worker (``crm.jobs``): the cron jobs, runnable on a
+schedule without starting an interpreter per tick, and maintenance.
+
+Unlike the django-crontab entry points in ``crm.cron`` they execute their
+GraphQL in-process, never over HTTP to this same server, and let errors
+propagate so a failed run is retried.
+"""
+import io
+from datetime import datetime
+
+from django.core.management import call_command
+
+from crm.aggregates import rebuild_aggregates
+from crm.changes import prune_changes
+from crm.cron import check_heartbeat, restock_low_stock
+from crm.cron_jobs.send_order_reminders import run_order_reminders
+from crm.graphql_client import get_client
+from crm.jobs import prune_jobs, task
+
+
+@task('crm.heartbeat', max_attempts=1)
+def heartbeat():
+    check_heartbeat(get_client(in_process=True))
+
+
+@task('crm.update_low_stock')
+def update_low_stock():
+    restock_low_stock(get_client(in_process=True))
+
+
+@task('crm.send_order_reminders')
+def send_order_reminders(days=7, per_customer=False):
+    run_order_reminders(get_client(in_process=True), days, per_customer)
+
+
+@task('crm.clean_inactive_customers', max_attempts=1, lease=3600)
+def clean_inactive_customers(days=365, sleep=0.05, log_file='/tmp/customer_cleanup_log.txt'):
+    out = io.StringIO()
+    call_command('clean_inactive_customers', days=days, sleep=sleep, stdout=out)
+    with open(log_file, 'a') as log:
+        log.write(f"{datetime.now().strftime('%a %b %d %H:%M:%S %Y')}: {out.getvalue()}")
+
+
+@task('crm.rebuild_aggregates', lease=3600)
+def rebuild(customers=True, products=True):
+    rebuild_aggregates(customers, products)
+
+
+@task('crm.prune_jobs')
+def prune(days=7):
+    prune_jobs(days)
+
+
+@task('crm.prune_changes')
+def prune_change_log(days=None):
+    prune_changes(days)
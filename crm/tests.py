@@ -1,3 +1,1836 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import resource
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from alx_backend_graphql.batch import BatchExecutor
+from alx_backend_graphql.documents import DocumentCache, get_document_cache, query_hash
+from alx_backend_graphql.metrics import registry
+from alx_backend_graphql.pubsub import SubscriptionOverflow, hub, publish, subscribe
+from alx_backend_graphql.response_cache import ResponseCache
+from alx_backend_graphql.routing import STICKY_COOKIE, ReadRouting, ReplicaPool, sync_sqlite_replicas
+from alx_backend_graphql.schema import schema
+from alx_backend_graphql.subscriptions import PROTOCOL, GraphQLWebSocketApp, Socket
+from alx_backend_graphql.views import CRMGraphQLView
+from crm.aggregates import rebuild_aggregates
+from crm.changes import ExpiredCursor, changes_since, prune_changes
+from crm.cleanup import inactive_customers
+from crm.cron_jobs import send_order_reminders
+from crm.events import ORDER_CREATED, STOCK_CHANGED
+from crm.export import iter_row_chunks
+from crm.graphql_client import GraphQLClientError, HTTPClient, InProcessClient, get_client
+from crm.jobs import Cron, Worker, claim, enqueue, enqueue_due, job_stats, run_job, task
+from crm.models import Change, Customer, CustomerStats, Job, JobSchedule, Order, OrderLine, Product, ProductStats
+from crm.orders import InsufficientStock, place_order
+from crm.reservations import StockEngine, reconcile_stock
+
+
+def seed_orders(customers, orders_per_customer, products_per_order=2):
+    customer_objs = Customer.objects.bulk_create(
+        Customer(name=f"Customer {i}", email=f"customer{i}@example.com")
+        for i in range(customers)
+    )
+    products = Product.objects.bulk_create(
+        Product(name=f"Product {i}", price=Decimal('9.99'), stock=50)
+        for i in range(products_per_order)
+    )
+    orders = Order.objects.bulk_create(
+        Order(customer=customer, total_amount=Decimal('19.98'))
+        for customer in customer_objs
+        for _ in range(orders_per_customer)
+    )
+    Order.products.through.objects.bulk_create(
+        Order.products.through(order_id=order.pk, product_id=product.pk, unit_price=product.price)
+        for order in orders
+        for product in products
+    )
+    return orders
+
+
+def execute(query, **kwargs):
+    return schema.execute(query, context_value=RequestFactory().post('/graphql/'), **kwargs)
+
+
+NESTED_ORDERS_QUERY = """
+query {
+  allCustomers(first: 100) {
+    edges { node {
+      email
+      orders(first: 100) {
+        edges { node {
+          totalAmount
+          customer { email }
+          products { edges { node { name } } }
+        } }
+      }
+    } }
+  }
+}
+"""
+
+
+class DataLoaderTests(TestCase):
+    def count_queries(self, query):
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(query)
+        self.assertIsNone(result.errors)
+        return len(ctx.captured_queries), result.data
+
+    def test_query_count_is_flat_from_10_to_1000_orders(self):
+        seed_orders(customers=10, orders_per_customer=1)
+        small_count, small = self.count_queries(NESTED_ORDERS_QUERY)
+
+        Order.objects.all().delete()
+        Customer.objects.all().delete()
+        seed_orders(customers=10, orders_per_customer=100)
+        large_count, large = self.count_queries(NESTED_ORDERS_QUERY)
+
+        edges = [e for c in large['allCustomers']['edges'] for e in c['node']['orders']['edges']]
+        self.assertEqual(len(edges), 1000)
+        self.assertEqual(edges[0]['node']['customer']['email'], large['allCustomers']['edges'][0]['node']['email'])
+        self.assertEqual(len(edges[0]['node']['products']['edges']), 2)
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(large_count, 4)
+
+    def test_all_orders_batches_customer_and_products(self):
+        seed_orders(customers=50, orders_per_customer=2)
+        count, data = self.count_queries("""
+            query {
+              allOrders(first: 100) {
+                edges { node { customer { email } products { edges { node { name } } } } }
+              }
+            }
+        """)
+        self.assertEqual(len(data['allOrders']['edges']), 100)
+        # COUNT + page joined to customers, then one products prefetch
+        self.assertEqual(count, 3)
+
+    def test_filtered_nested_connection_falls_back_to_queryset(self):
+        seed_orders(customers=1, orders_per_customer=3)
+        Order.objects.filter(pk=Order.objects.order_by('pk').first().pk).update(total_amount=Decimal('500'))
+        result = execute("""
+            query {
+              allCustomers {
+                edges { node { orders(totalAmount_Gte: 100) { edges { node { totalAmount } } } } }
+              }
+            }
+        """)
+        self.assertIsNone(result.errors)
+        orders = result.data['allCustomers']['edges'][0]['node']['orders']['edges']
+        self.assertEqual([o['node']['totalAmount'] for o in orders], ['500.00'])
+
+
+class QueryOptimizerTests(TestCase):
+    def capture(self, query):
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(query)
+        self.assertIsNone(result.errors)
+        return [q['sql'] for q in ctx.captured_queries], result.data
+
+    def test_scalar_selection_skips_customer_and_unused_columns(self):
+        seed_orders(customers=5, orders_per_customer=2)
+        sql, data = self.capture("query { allOrders { edges { node { id totalAmount } } } }")
+        self.assertEqual(len(data['allOrders']['edges']), 10)
+        self.assertEqual(len(sql), 2)
+        page = sql[1]
+        self.assertNotIn('crm_customer', page)
+        self.assertNotIn('order_date', page)
+        self.assertIn('total_amount', page)
+
+    def test_fragments_select_and_prefetch_related_columns(self):
+        seed_orders(customers=5, orders_per_customer=2)
+        sql, data = self.capture("""
+            query {
+              allOrders { edges { node { ...OrderCustomer ... on OrderType { products { edges { node { name } } } } } } }
+            }
+            fragment OrderCustomer on OrderType { customer { email } }
+        """)
+        node = data['allOrders']['edges'][0]['node']
+        self.assertTrue(node['customer']['email'].endswith('@example.com'))
+        self.assertEqual(len(node['products']['edges']), 2)
+        self.assertEqual(len(sql), 3)
+        page, products = sql[1], sql[2]
+        self.assertIn('INNER JOIN "crm_customer"', page)
+        self.assertIn('"crm_customer"."email"', page)
+        self.assertNotIn('"crm_customer"."name"', page)
+        self.assertNotIn('"crm_product"."price"', products)
+
+    def test_nested_connections_are_prefetched(self):
+        seed_orders(customers=20, orders_per_customer=3)
+        sql, data = self.capture("""
+            query {
+              allCustomers {
+                edges { node { name orders { edges { node { totalAmount products { edges { node { name } } } } } } } }
+              }
+            }
+        """)
+        orders = data['allCustomers']['edges'][0]['node']['orders']['edges']
+        self.assertEqual(len(orders), 3)
+        # COUNT, customers, orders prefetch, products prefetch
+        self.assertEqual(len(sql), 4)
+        self.assertNotIn('"crm_customer"."email"', sql[1])
+
+
+class KeysetPaginationTests(TestCase):
+    PAGE_QUERY = """
+        query($after: String) {
+          allOrdersKeyset(first: 7, after: $after) {
+            edges { cursor node { id totalAmount } }
+            pageInfo { hasNextPage endCursor }
+          }
+        }
+    """
+
+    def setUp(self):
+        seed_orders(customers=10, orders_per_customer=5)
+        # Force ties on order_date so the id tie-breaker matters
+        first_half = Order.objects.order_by('pk').values_list('pk', flat=True)[:25]
+        Order.objects.filter(pk__in=list(first_half)).update(order_date='2026-01-01T00:00:00Z')
+
+    def test_walks_every_order_once_without_offset_or_count(self):
+        seen, after, sql = [], None, []
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                result = execute(self.PAGE_QUERY, variables={'after': after})
+            self.assertIsNone(result.errors)
+            sql.extend(q['sql'] for q in ctx.captured_queries)
+            self.assertEqual(len(ctx.captured_queries), 1)
+            page = result.data['allOrdersKeyset']
+            seen.extend(edge['node']['id'] for edge in page['edges'])
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = page['pageInfo']['endCursor']
+
+        self.assertEqual(len(seen), 50)
+        self.assertEqual(len(set(seen)), 50)
+        self.assertFalse(any('OFFSET' in q or 'COUNT(' in q for q in sql))
+
+    def test_backward_pagination_and_opt_in_total_count(self):
+        result = execute("""
+            query {
+              allOrdersKeyset(last: 3) {
+                totalCount
+                edges { node { id } }
+                pageInfo { hasPreviousPage hasNextPage startCursor }
+              }
+            }
+        """)
+        self.assertIsNone(result.errors)
+        page = result.data['allOrdersKeyset']
+        self.assertEqual(page['totalCount'], 50)
+        self.assertTrue(page['pageInfo']['hasPreviousPage'])
+        self.assertFalse(page['pageInfo']['hasNextPage'])
+
+        before = execute("""
+            query($before: String) { allOrdersKeyset(last: 100, before: $before) { edges { node { id } } } }
+        """, variables={'before': page['pageInfo']['startCursor']})
+        self.assertEqual(len(before.data['allOrdersKeyset']['edges']), 47)
+
+    def test_invalid_cursor_is_rejected(self):
+        result = execute('query { allCustomersKeyset(after: "bogus") { edges { node { id } } } }')
+        self.assertIn('Invalid cursor', result.errors[0].message)
+
+
+class BulkCreateCustomersTests(TestCase):
+    MUTATION = """
+        mutation($inputs: [CustomerInput]!, $chunkSize: Int) {
+          bulkCreateCustomers(inputs: $inputs, chunkSize: $chunkSize) { customers { email } errors }
+        }
+    """
+
+    def test_bulk_insert_uses_one_lookup_and_insert_per_chunk(self):
+        inputs = [{'name': f"Lead {i}", 'email': f"lead{i}@example.com"} for i in range(2500)]
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(self.MUTATION, variables={'inputs': inputs, 'chunkSize': 1000})
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data['bulkCreateCustomers']['customers']), 2500)
+        self.assertEqual(Customer.objects.count(), 2500)
+        lookups = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(lookups), 3)
+        # SQLite's parameter limit may split a chunk into a few multi-row INSERTs
+        self.assertLess(len(inserts), 25)
+
+    def test_reports_errors_per_row(self):
+        Customer.objects.create(name="Existing", email="taken@example.com")
+        result = execute(self.MUTATION, variables={'inputs': [
+            {'name': "Ann", 'email': "ann@example.com", 'phone': "+1-555-0100"},
+            {'name': "Ann again", 'email': "ann@example.com"},
+            {'name': "Taken", 'email': "taken@example.com"},
+            {'name': "Bad phone", 'email': "bad@example.com", 'phone': "call me"},
+        ]})
+        data = result.data['bulkCreateCustomers']
+        self.assertEqual([c['email'] for c in data['customers']], ["ann@example.com"])
+        self.assertEqual(sorted(data['errors']), [
+            "Email ann@example.com is duplicated in this batch",
+            "Email taken@example.com already exists",
+            "Invalid phone format for bad@example.com",
+        ])
+
+    def test_streaming_import_endpoint(self):
+        body = '\n'.join(
+            '{"name": "Lead %d", "email": "lead%d@example.com"}' % (i % 5, i % 5) for i in range(7)
+        )
+        response = self.client.post(
+            '/crm/customers/import/?chunk_size=3', data=body, content_type='application/x-ndjson'
+        )
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[-1], {'done': True, 'created': 5, 'errors': 2})
+        self.assertEqual(Customer.objects.count(), 5)
+
+    def test_import_reports_records_that_are_not_objects(self):
+        body = '[1]\n"x"\n3\n{"name": "Ann", "email": "ann@example.com"}\n'
+        response = self.client.post('/crm/customers/import/', data=body, content_type='application/x-ndjson')
+        first, done = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(first['errors'], [
+            "Each customer must be an object, got list",
+            "Each customer must be an object, got str",
+            "Each customer must be an object, got int",
+        ])
+        self.assertEqual(done, {'done': True, 'created': 1, 'errors': 3})
+
+    def test_chunk_size_must_be_positive(self):
+        for chunk_size in (0, -1):
+            result = execute(self.MUTATION, variables={
+                'inputs': [{'name': "Ann", 'email': "ann@example.com"}], 'chunkSize': chunk_size,
+            })
+            self.assertEqual(result.errors[0].message, "chunkSize must be at least 1")
+        self.assertFalse(Customer.objects.exists())
+
+
+class UpdateLowStockProductsTests(TestCase):
+    def setUp(self):
+        Product.objects.bulk_create(
+            Product(name=f"Stock {stock}", price=Decimal('1.00'), stock=stock) for stock in (0, 5, 9, 10, 20)
+        )
+
+    def stocks(self):
+        return list(Product.objects.order_by('pk').values_list('stock', flat=True))
+
+    def test_restocks_in_a_single_statement(self):
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute("""
+                mutation { updateLowStockProducts { success updatedCount updatedProducts { name stock } } }
+            """)
+        self.assertIsNone(result.errors)
+        data = result.data['updateLowStockProducts']
+        self.assertEqual(data['updatedCount'], 3)
+        self.assertEqual(sorted(p['stock'] for p in data['updatedProducts']), [10, 15, 19])
+        self.assertEqual(self.stocks(), [10, 15, 19, 10, 20])
+        statements = [q['sql'] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('UPDATE'))
+
+    def test_count_only_with_custom_threshold_and_increment(self):
+        result = execute("""
+            mutation { updateLowStockProducts(threshold: 6, increment: 4, countOnly: true) { updatedCount updatedProducts { id } } }
+        """)
+        data = result.data['updateLowStockProducts']
+        self.assertEqual(data, {'updatedCount': 2, 'updatedProducts': None})
+        self.assertEqual(self.stocks(), [4, 9, 9, 10, 20])
+
+    def test_fallback_without_update_returning(self):
+        with mock.patch('crm.schema.supports_update_returning', return_value=False):
+            result = execute("mutation { updateLowStockProducts { updatedProducts { stock } } }")
+        self.assertEqual(sorted(p['stock'] for p in result.data['updateLowStockProducts']['updatedProducts']), [10, 15, 19])
+        self.assertEqual(self.stocks(), [10, 15, 19, 10, 20])
+
+
+class CreateOrderTests(TestCase):
+    MUTATION = """
+        mutation($input: OrderInput!) {
+          createOrder(input: $input) { order { totalAmount lines { product { name } quantity unitPrice } } }
+        }
+    """
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        self.pen = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=10)
+        self.pad = Product.objects.create(name="Pad", price=Decimal('4.00'), stock=3)
+
+    def create_order(self, product_ids=None, lines=None):
+        return execute(self.MUTATION, variables={'input': {
+            'customerId': self.customer.pk, 'productIds': product_ids, 'lines': lines,
+        }})
+
+    def test_lines_snapshot_prices_and_total(self):
+        result = self.create_order(product_ids=[self.pen.pk], lines=[{'productId': self.pad.pk, 'quantity': 2}])
+        self.assertIsNone(result.errors)
+        order = result.data['createOrder']['order']
+        self.assertEqual(order['totalAmount'], '9.50')
+        self.assertEqual(
+            sorted((line['product']['name'], line['quantity'], line['unitPrice']) for line in order['lines']),
+            [('Pad', 2, '4.00'), ('Pen', 1, '1.50')],
+        )
+        self.pen.refresh_from_db()
+        self.pad.refresh_from_db()
+        self.assertEqual((self.pen.stock, self.pad.stock), (9, 1))
+
+        Product.objects.filter(pk=self.pad.pk).update(price=Decimal('100'))
+        self.assertEqual(Order.objects.get().compute_total(), Decimal('9.50'))
+
+    def test_insufficient_stock_rolls_back(self):
+        result = self.create_order(lines=[{'productId': self.pen.pk, 'quantity': 1}, {'productId': self.pad.pk, 'quantity': 4}])
+        self.assertEqual(result.errors[0].message, "Insufficient stock for Pad")
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Product.objects.get(pk=self.pen.pk).stock, 10)
+
+
+class CreateOrderConcurrencyTests(TransactionTestCase):
+    def test_concurrent_orders_never_oversell(self):
+        self.assertFalse(connection.creation.is_in_memory_db(connection.settings_dict['NAME']))
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        product = Product.objects.create(name="Hot item", price=Decimal('5.00'), stock=10)
+        outcomes = []
+
+        def buy():
+            try:
+                result = execute(
+                    "mutation($input: OrderInput!) { createOrder(input: $input) { order { id } } }",
+                    variables={'input': {'customerId': customer.pk, 'lines': [{'productId': product.pk, 'quantity': 1}]}},
+                )
+                outcomes.append(result.errors[0].message if result.errors else 'ok')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy) for _ in range(25)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count('ok'), 10)
+        self.assertEqual(outcomes.count("Insufficient stock for Hot item"), 15)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), 10)
+
+
+class ConcurrentWritersTests(TransactionTestCase):
+    def test_sqlite_connections_use_wal(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite only")
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_mixed_writers_never_hit_a_locked_database(self):
+        self.assertFalse(connection.creation.is_in_memory_db(connection.settings_dict['NAME']))
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        product = Product.objects.create(name="Stocked", price=Decimal('2.50'), stock=1000)
+        writes = [
+            ("mutation($email: String!) { createCustomer(input: {name: \"Writer\", email: $email}) { customer { id } } }",
+             lambda n: {'email': f"writer{n}@example.com"}),
+            ("mutation($input: OrderInput!) { createOrder(input: $input) { order { id } } }",
+             lambda n: {'input': {'customerId': customer.pk, 'lines': [{'productId': product.pk, 'quantity': 1}]}}),
+            ("mutation($inputs: [CustomerInput]!) { bulkCreateCustomers(inputs: $inputs) { customers { id } } }",
+             lambda n: {'inputs': [{'name': "Bulk", 'email': f"bulk{n}-{k}@example.com"} for k in range(5)]}),
+            ("mutation { updateLowStockProducts { success } }", lambda n: {}),
+        ]
+        errors = []
+
+        def writer(worker):
+            try:
+                for step in range(12):
+                    query, variables = writes[step % len(writes)]
+                    result = execute(query, variables=variables(worker * 100 + step))
+                    errors.extend(str(e) for e in result.errors or [])
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.count(), 8 * 3)
+        self.assertEqual(Customer.objects.count(), 1 + 8 * 3 + 8 * 3 * 5)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 1000 - 8 * 3)
+
+
+class DocumentCacheTests(TestCase):
+    QUERY = "query { allProducts { edges { node { name } } } }"
+
+    def setUp(self):
+        get_document_cache().clear()
+        caches['default'].clear()
+
+    def post(self, payload):
+        return self.client.post('/graphql/', data=payload, content_type='application/json').json()
+
+    def test_repeated_queries_hit_the_cache(self):
+        for _ in range(3):
+            self.assertNotIn('errors', self.post({'query': self.QUERY}))
+        stats = get_document_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 1, 1))
+
+    def test_invalid_documents_are_not_cached(self):
+        response = self.post({'query': "query { noSuchField }"})
+        self.assertIn('errors', response)
+        self.assertEqual(get_document_cache().stats()['size'], 0)
+
+    def test_lru_eviction(self):
+        cache = DocumentCache(maxsize=2)
+        graphql_schema = schema.graphql_schema
+        for query in ("{ allProducts { totalCount } }", "{ allOrders { totalCount } }",
+                      "{ allProducts { totalCount } }", "{ allCustomers { totalCount } }"):
+            cache.get(graphql_schema, query)
+        self.assertEqual(cache.stats()['size'], 2)
+        cache.get(graphql_schema, "{ allOrders { totalCount } }")
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_automatic_persisted_queries(self):
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(self.QUERY)}}
+        missing = self.post({'extensions': extensions})
+        self.assertEqual(missing['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        registered = self.post({'query': self.QUERY, 'extensions': extensions})
+        self.assertEqual(registered['data'], {'allProducts': {'edges': []}})
+
+        by_hash = self.client.get('/graphql/', {'extensions': json.dumps(extensions)}, HTTP_ACCEPT='application/json')
+        self.assertEqual(by_hash.json()['data'], {'allProducts': {'edges': []}})
+
+        mismatch = self.post({'query': "{ allOrders { totalCount } }", 'extensions': extensions})
+        self.assertEqual(mismatch['errors'][0]['extensions']['code'], 'PERSISTED_QUERY_HASH_MISMATCH')
+
+    def test_malformed_extensions_are_bad_requests(self):
+        for extensions, code in (
+            (['x'], 'BAD_REQUEST'),
+            (3, 'BAD_REQUEST'),
+            ('["x"]', 'BAD_REQUEST'),
+            ({'persistedQuery': 'x'}, 'PERSISTED_QUERY_NOT_SUPPORTED'),
+            ({'persistedQuery': [1]}, 'PERSISTED_QUERY_NOT_SUPPORTED'),
+            ({'persistedQuery': {'version': 1, 'sha256Hash': 5}}, 'PERSISTED_QUERY_NOT_SUPPORTED'),
+        ):
+            with self.subTest(extensions=extensions):
+                response = self.client.post('/graphql/', data={'query': self.QUERY, 'extensions': extensions},
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['errors'][0]['extensions']['code'], code)
+        response = self.client.get('/graphql/', {'query': self.QUERY, 'extensions': '[1]'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ResponseCacheTests(TransactionTestCase):
+    PRODUCTS = "query { allProducts { edges { node { name stock } } } }"
+
+    def setUp(self):
+        caches['graphql'].clear()
+        self.pen = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=10)
+        self.customer = Customer.objects.create(name="Ada", email="ada@example.com")
+
+    def post(self, query, path='/graphql/', **variables):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(path, data={'query': query, 'variables': variables},
+                                        content_type='application/json')
+        body = response.json()
+        self.assertNotIn('errors', body)
+        return body, response, len(ctx.captured_queries)
+
+    def test_repeated_query_is_served_from_the_cache(self):
+        before = ResponseCache.stats()
+        first, response, first_queries = self.post(self.PRODUCTS)
+        # Same operation, different whitespace
+        second, _, second_queries = self.post("query {\n  allProducts { edges { node { name stock } } }\n}")
+        self.assertEqual(first['data'], second['data'])
+        self.assertEqual((first_queries, second_queries), (2, 0))
+        self.assertEqual(first['extensions']['cacheControl'], {'maxAge': 300, 'hit': False})
+        self.assertEqual(second['extensions']['cacheControl'], {'maxAge': 300, 'hit': True})
+        self.assertEqual(response['Cache-Control'], 'private, max-age=300')
+        after = ResponseCache.stats()
+        self.assertEqual((after['hits'] - before['hits'], after['misses'] - before['misses']), (1, 1))
+
+    def test_writes_invalidate_only_dependent_responses(self):
+        self.post(self.PRODUCTS)
+        customers = "query { allCustomers { edges { node { email } } } }"
+        self.post(customers)
+
+        self.pen.name = "Fountain pen"
+        self.pen.save()
+        products, _, queries = self.post(self.PRODUCTS)
+        self.assertEqual(products['data']['allProducts']['edges'][0]['node']['name'], "Fountain pen")
+        self.assertGreater(queries, 0)
+        self.assertEqual(self.post(customers)[2], 0)
+
+        # Orders update stock with QuerySet.update(), which sends no signal
+        self.post("mutation($input: OrderInput!) { createOrder(input: $input) { order { id } } }",
+                  input={'customerId': self.customer.pk, 'productIds': [self.pen.pk]})
+        products, _, _ = self.post(self.PRODUCTS)
+        self.assertEqual(products['data']['allProducts']['edges'][0]['node']['stock'], 9)
+
+        orders = "query { allOrders { edges { node { customer { name } lines { quantity } } } } }"
+        self.assertEqual(self.post(orders)[0]['extensions']['cacheControl']['maxAge'], 30)
+        Customer.objects.filter(pk=self.customer.pk).delete()
+        self.assertEqual(self.post(orders)[0]['data']['allOrders']['edges'], [])
+
+    def test_variables_and_hints_split_or_skip_entries(self):
+        query = "query($n: String) { allProducts(name: $n) { edges { node { name } } } }"
+        self.assertEqual(self.post(query, n="Pen")[2], 2)
+        self.assertGreater(self.post(query, n="Ink")[2], 0)
+        self.assertEqual(self.post(query, n="Pen")[2], 0)
+        with override_settings(GRAPHQL_CACHE_CONTROL={'CustomerType.email': 0}):
+            emails = "query { allCustomers { edges { node { email } } } }"
+            self.post(emails)
+            body, response, queries = self.post(emails)
+        self.assertGreater(queries, 0)
+        self.assertNotIn('cacheControl', body.get('extensions', {}))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_async_view_shares_the_cache(self):
+        self.post(self.PRODUCTS)
+        body, _, queries = self.post(self.PRODUCTS, path='/graphql/async/')
+        self.assertEqual((body['extensions']['cacheControl']['hit'], queries), (True, 0))
+
+
+class BatchedRequestTests(TestCase):
+    PRODUCTS = "query { allProducts { edges { node { name } } } }"
+    CREATE = "mutation($email: String!) { createCustomer(input: {name: \"X\", email: $email}) { customer { email } } }"
+
+    def setUp(self):
+        Product.objects.create(name="Pen", price=Decimal('1.50'), stock=10)
+        Customer.objects.create(name="Ada", email="ada@example.com")
+
+    def batch(self, *operations, **headers):
+        return self.client.post('/graphql/', data=list(operations), content_type='application/json', **headers)
+
+    def test_partial_failure_only_affects_its_item(self):
+        response = self.batch(
+            {'id': 'a', 'query': self.PRODUCTS},
+            {'id': 'b', 'query': "query { noSuchField }"},
+            {'id': 'c', 'query': self.CREATE, 'variables': {'email': 'ada@example.com'}},
+            {'id': 'd', 'query': self.CREATE, 'variables': {'email': 'bo@example.com'}},
+            {'id': 'e', 'query': "query { allCustomers { edges { node { email } } } }"},
+        )
+        self.assertEqual(response.status_code, 400)
+        a, b, c, d, e = response.json()
+        self.assertEqual([item['id'] for item in (a, b, c, d, e)], ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual([item['status'] for item in (a, b, c, d, e)], [200, 400, 200, 200, 200])
+        self.assertEqual(a['data'], {'allProducts': {'edges': [{'node': {'name': "Pen"}}]}})
+        self.assertIn('noSuchField', b['errors'][0]['message'])
+        self.assertEqual(c['errors'][0]['message'], "Email already exists")
+        self.assertEqual(d['data']['createCustomer']['customer']['email'], 'bo@example.com')
+        # Reads after a mutation see its writes
+        self.assertEqual(len(e['data']['allCustomers']['edges']), 2)
+        # Cost analysis still applies per operation
+        self.assertIn('cost', a['extensions'])
+
+    def test_atomic_batch_rolls_back_on_first_failure(self):
+        response = self.batch(
+            {'query': self.CREATE, 'variables': {'email': 'bo@example.com'}},
+            {'query': self.CREATE, 'variables': {'email': 'ada@example.com'}},
+            {'query': self.CREATE, 'variables': {'email': 'cy@example.com'}},
+            HTTP_X_GRAPHQL_BATCH_ATOMIC='true',
+        )
+        first, second, third = response.json()
+        self.assertEqual(first['errors'][0]['message'], "Rolled back: operation 1 of the batch failed")
+        self.assertEqual(second['errors'][0]['message'], "Email already exists")
+        self.assertEqual(third['errors'][0]['message'], "Not executed: operation 1 of the batch failed")
+        self.assertEqual(list(Customer.objects.values_list('email', flat=True)), ['ada@example.com'])
+
+        response = self.batch(
+            {'query': self.CREATE, 'variables': {'email': 'bo@example.com'}},
+            {'query': self.PRODUCTS},
+            HTTP_X_GRAPHQL_BATCH_ATOMIC='true',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Customer.objects.count(), 2)
+
+    def test_operations_share_loaders_until_a_mutation(self):
+        view = CRMGraphQLView(batch=True)
+        entries = [{'query': self.PRODUCTS}, {'query': self.PRODUCTS},
+                   {'query': self.CREATE, 'variables': {'email': 'bo@example.com'}}, {'query': self.PRODUCTS}]
+        first, second, mutation, after = BatchExecutor(view, RequestFactory().post('/graphql/'), entries).run()
+        self.assertIs(first.request.loaders, second.request.loaders)
+        self.assertIs(first.request.loaders, mutation.request.loaders)
+        self.assertIsNot(mutation.request.loaders, after.request.loaders)
+        # Per-operation state doesn't leak between them
+        self.assertIsNot(first.request, second.request)
+
+    def test_malformed_batches_are_rejected(self):
+        self.assertEqual(self.batch().status_code, 400)
+        self.assertEqual(self.batch({'query': self.PRODUCTS}, "query { allProducts { totalCount } }").status_code, 400)
+        with override_settings(GRAPHQL_BATCH_MAX_SIZE=2):
+            response = self.batch(*[{'query': self.PRODUCTS}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['message'], "Batches are limited to 2 operations.")
+
+
+class ParallelBatchTests(TransactionTestCase):
+    def test_queries_run_in_parallel_between_mutations(self):
+        caches['graphql'].clear()
+        Product.objects.create(name="Pen", price=Decimal('1.50'), stock=10)
+        products = {'query': "query { allProducts { totalCount } }"}
+        create = {'query': 'mutation { createProduct(input: {name: "Ink", price: 2}) { product { name } } }'}
+        with override_settings(GRAPHQL_BATCH_THREADS=4), mock.patch(
+            'alx_backend_graphql.batch.BatchExecutor.execute_in_worker',
+            side_effect=BatchExecutor.execute_in_worker, autospec=True,
+        ) as in_worker:
+            response = self.client.post(
+                '/graphql/', data=[products, products, create, products, {'query': "{ allCustomers { totalCount } }"}],
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+        counts = [item['data'].get('allProducts', {}).get('totalCount') for item in response.json()]
+        self.assertEqual(counts, [1, 1, None, 2, None])
+        # Two runs of two queries each went to the pool
+        self.assertEqual(in_worker.call_count, 4)
+
+
+class AsyncGraphQLViewTests(TestCase):
+    async def apost(self, query, **variables):
+        response = await self.async_client.post(
+            '/graphql/async/', data={'query': query, 'variables': variables}, content_type='application/json'
+        )
+        return response.json()
+
+    def test_nested_query_matches_sync_view(self):
+        seed_orders(customers=5, orders_per_customer=4)
+        sync = self.client.post('/graphql/', data={'query': NESTED_ORDERS_QUERY}, content_type='application/json')
+        with CaptureQueriesContext(connection) as ctx:
+            result = async_to_sync(self.apost)(NESTED_ORDERS_QUERY)
+        self.assertNotIn('errors', result)
+        self.assertEqual(result['data'], sync.json()['data'])
+        # Same batching as the sync loaders: COUNT, page, then one query per level
+        self.assertEqual(len(ctx.captured_queries), 4)
+
+    async def test_keyset_connection_and_total_count(self):
+        await sync_to_async(seed_orders)(customers=3, orders_per_customer=2)
+        result = await self.apost("""
+            query { allOrdersKeyset(first: 4) { totalCount pageInfo { hasNextPage } edges { node { id } } } }
+        """)
+        self.assertNotIn('errors', result)
+        page = result['data']['allOrdersKeyset']
+        self.assertEqual((page['totalCount'], page['pageInfo']['hasNextPage'], len(page['edges'])), (6, True, 4))
+
+    async def test_mutations_run_through_the_async_view(self):
+        result = await self.apost("""
+            mutation($input: CustomerInput!) { createCustomer(input: $input) { customer { email } } }
+        """, input={'name': 'Ada', 'email': 'ada@example.com'})
+        self.assertEqual(result['data']['createCustomer']['customer']['email'], 'ada@example.com')
+        self.assertTrue(await Customer.objects.filter(email='ada@example.com').aexists())
+
+
+class QueryCostTests(TestCase):
+    def post(self, query, **variables):
+        return self.client.post(
+            '/graphql/', data={'query': query, 'variables': variables}, content_type='application/json'
+        )
+
+    def test_cost_is_reported_in_extensions(self):
+        response = self.post(NESTED_ORDERS_QUERY)
+        # allCustomers + 100 x (orders + 100 x (customer + products))
+        self.assertEqual(response.json()['extensions']['cost']['requested'], 1 + 100 * (1 + 100 * 2))
+        self.assertEqual(response.json()['extensions']['cost']['depth'], 10)
+
+    def test_page_sizes_come_from_variables(self):
+        query = """
+            query($n: Int = 5) { allOrders(first: $n) { totalCount edges { node { customer { name } } } } }
+        """
+        self.assertEqual(self.post(query).json()['extensions']['cost']['requested'], 1 + 1 + 5)
+        self.assertEqual(self.post(query, n=50).json()['extensions']['cost']['requested'], 1 + 1 + 50)
+
+    def test_expensive_query_is_rejected_before_any_sql(self):
+        seed_orders(customers=2, orders_per_customer=2)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post("""
+                query { allCustomers(first: 10000) { edges { node {
+                  orders { edges { node { products { edges { node { name } } } } } }
+                } } } }
+            """)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['extensions']['code'], 'QUERY_TOO_EXPENSIVE')
+        self.assertNotIn('data', response.json())
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    @override_settings(GRAPHQL_MAX_QUERY_DEPTH=4)
+    def test_depth_limit(self):
+        self.assertNotIn('errors', self.post("{ allOrders { edges { node { id } } } }").json())
+        response = self.post("{ allOrders { edges { node { customer { name } } } } }").json()
+        self.assertEqual(response['errors'][0]['extensions']['code'], 'QUERY_TOO_DEEP')
+        self.assertEqual(response['extensions']['cost']['depth'], 5)
+
+
+class TracingTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        seed_orders(customers=3, orders_per_customer=2)
+
+    def post(self, query, path='/graphql/'):
+        return self.client.post(path, data={'query': query}, content_type='application/json').json()
+
+    @override_settings(DEBUG=True)
+    def test_debug_returns_resolver_trace(self):
+        tracing = self.post(NESTED_ORDERS_QUERY)['extensions']['tracing']
+        resolvers = {tuple(r['path']): r for r in tracing['resolvers']}
+        self.assertEqual(tracing['sqlCount'], 4)
+        # Every statement is charged to the resolver that issued it
+        self.assertEqual(sum(r['sqlCount'] for r in resolvers.values()), 4)
+        # COUNT, page and the two prefetches planned by the optimizer
+        self.assertEqual(resolvers[('allCustomers',)]['sqlCount'], 4)
+        self.assertEqual(resolvers[('allCustomers', 'edges', 0, 'node', 'orders')]['sqlCount'], 0)
+        self.assertEqual(resolvers[('allCustomers',)]['returnType'], 'CustomerTypeConnection')
+
+    @override_settings(DEBUG=True)
+    def test_async_view_is_traced(self):
+        tracing = self.post(NESTED_ORDERS_QUERY, path='/graphql/async/')['extensions']['tracing']
+        self.assertEqual(tracing['sqlCount'], 4)
+        self.assertEqual(sum(r['sqlCount'] for r in tracing['resolvers']), 4)
+
+    @override_settings(GRAPHQL_TRACING=True)
+    def test_metrics_endpoint(self):
+        self.assertNotIn('tracing', self.post(NESTED_ORDERS_QUERY)['extensions'])
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('graphql_request_duration_seconds_count{operation="query"} 1', body)
+        self.assertIn('graphql_request_sql_queries_total{operation="query"} 4', body)
+        self.assertIn('graphql_resolver_sql_queries_total{field="Query.allCustomers"} 4', body)
+        self.assertIn('graphql_resolver_duration_seconds_bucket{field="OrderType.customer",le="+Inf"} 6', body)
+
+    def test_disabled_tracing_records_nothing(self):
+        self.assertNotIn('tracing', self.post(NESTED_ORDERS_QUERY)['extensions'])
+        self.assertNotIn('graphql_request_duration_seconds_count', self.client.get('/metrics').content.decode())
+
+
+class OrderRemindersTests(TestCase):
+    def setUp(self):
+        seed_orders(customers=3, orders_per_customer=3)
+        self.old = list(Order.objects.order_by('pk')[:4].values_list('pk', flat=True))
+        Order.objects.filter(pk__in=self.old).update(order_date=timezone.now() - timedelta(days=30))
+        self.pages = 0
+
+    def execute(self, query, variables):
+        self.pages += 1
+        response = self.client.post('/graphql/', data={'query': query, 'variables': variables},
+                                    content_type='application/json')
+        self.assertNotIn('errors', response.json())
+        return response.json()['data']
+
+    def recent_orders(self):
+        since = timezone.now() - timedelta(days=7)
+        return send_order_reminders.iter_recent_orders(self.execute, since, page_size=2)
+
+    def test_only_recent_orders_are_fetched_page_by_page(self):
+        log = io.StringIO()
+        self.assertEqual(send_order_reminders.send_reminders(self.recent_orders(), log), 5)
+        self.assertEqual(self.pages, 3)
+        lines = log.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(all('Reminder for Order ' in line for line in lines))
+
+    def test_per_customer_mode(self):
+        log = io.StringIO()
+        # The first customer's orders are all old, the second has two recent ones
+        self.assertEqual(send_order_reminders.send_customer_reminders(self.recent_orders(), log), 2)
+        lines = log.getvalue().splitlines()
+        self.assertEqual(sorted(line.count(',') for line in lines), [1, 2])
+
+
+class TestClientSession:
+    """Serves ``requests``-style calls from the Django test client."""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def get(self, url, timeout=None):
+        self.calls.append(('GET', url))
+        return self.wrap(self.client.get(url))
+
+    def post(self, url, json=None, timeout=None):
+        self.calls.append(('POST', url))
+        return self.wrap(self.client.post(url, data=json, content_type='application/json'))
+
+    @staticmethod
+    def wrap(response):
+        response.text = response.content.decode()
+        response.raise_for_status = lambda: None
+        return response
+
+
+class GraphQLClientTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.schema_cache = os.path.join(tmp.name, 'schema.graphql')
+        self.session = TestClientSession(self.client)
+
+    def http_client(self):
+        return HTTPClient('http://testserver/graphql/', self.schema_cache, session=self.session)
+
+    def test_schema_is_fetched_once_then_served_from_the_cache_file(self):
+        Product.objects.create(name="Widget", price=Decimal('1.00'), stock=3)
+        query = "{ allProducts { edges { node { name } } } }"
+        self.assertEqual(self.http_client().execute(query)['allProducts']['edges'][0]['node']['name'], 'Widget')
+        self.http_client().execute(query)
+        self.assertEqual([method for method, _ in self.session.calls], ['GET', 'POST', 'POST'])
+
+    def test_stale_cache_is_refreshed_when_the_schema_hash_changes(self):
+        with open(self.schema_cache, 'w') as f:
+            f.write("type Query { allProducts: Int }")
+        client = self.http_client()
+        client.execute("{ __typename }")
+        self.assertEqual([method for method, _ in self.session.calls], ['POST', 'GET'])
+        with open(self.schema_cache) as f:
+            self.assertIn('allOrdersKeyset', f.read())
+
+    def test_invalid_queries_never_reach_the_server(self):
+        client = self.http_client()
+        with self.assertRaises(GraphQLClientError):
+            client.execute("{ noSuchField }")
+        self.assertNotIn('POST', [method for method, _ in self.session.calls])
+
+    def test_schema_endpoint_supports_conditional_get(self):
+        response = self.client.get('/graphql/schema.graphql')
+        self.assertIn('type Query', response.content.decode())
+        self.assertEqual(self.client.get('/graphql/schema.graphql', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_local_urls_run_in_process(self):
+        client = get_client('http://localhost:8000/graphql/')
+        self.assertIsInstance(client, InProcessClient)
+        self.assertIs(get_client('http://localhost:8000/graphql/'), client)
+        self.assertIsInstance(get_client('http://localhost:8000/graphql/', in_process=False), HTTPClient)
+        with CaptureQueriesContext(connection) as ctx:
+            data = client.execute("{ allOrders { totalCount } }")
+        self.assertEqual((data, len(ctx.captured_queries)), ({'allOrders': {'totalCount': 0}}, 1))
+
+
+class CleanInactiveCustomersTests(TestCase):
+    def setUp(self):
+        # 3000 customers with two orders each; every third one last ordered two years ago
+        seed_orders(customers=3000, orders_per_customer=2, products_per_order=1)
+        long_ago = timezone.now() - timedelta(days=730)
+        Customer.objects.update(created_at=long_ago)
+        self.inactive = set(Customer.objects.order_by('pk').values_list('pk', flat=True)[::3])
+        Order.objects.filter(customer__in=self.inactive).update(order_date=long_ago)
+
+    def clean(self, *args):
+        out = io.StringIO()
+        call_command('clean_inactive_customers', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_only_counts(self):
+        self.assertIn("Would delete 1000 customers, 2000 orders and 2000 order lines", self.clean('--dry-run'))
+        self.assertEqual(Customer.objects.count(), 3000)
+
+    def test_deletes_inactive_customers_in_chunks(self):
+        Customer.objects.create(name="New", email="new@example.com")
+        rebuild_aggregates()
+        with CaptureQueriesContext(connection) as ctx:
+            output = self.clean('--chunk-size', '300')
+        self.assertIn("Deleted 1000 customers, 2000 orders and 2000 order lines in 4 chunks", output)
+        self.assertFalse(Customer.objects.filter(pk__in=self.inactive).exists())
+        # Active and brand-new customers stay
+        self.assertEqual(Customer.objects.count(), 2001)
+        self.assertEqual(Order.objects.count(), 4000)
+        # Per chunk: select, product totals (sum, update), collect, then DELETEs
+        # in Django's batches of 100 ids; nothing table-wide
+        self.assertLess(len(ctx.captured_queries), 4 * 19)
+        self.assertFalse([q for q in ctx.captured_queries if 'INSERT INTO "crm_productstats"' in q['sql']])
+
+        # The deleted orders left the product totals, as a rebuild would have it
+        stats = list(ProductStats.objects.order_by('pk').values_list('pk', 'times_ordered', 'units_sold', 'revenue'))
+        self.assertEqual(stats[0][1:], (4000, 4000, Decimal('39960.00')))
+        rebuild_aggregates()
+        self.assertEqual(
+            list(ProductStats.objects.order_by('pk').values_list('pk', 'times_ordered', 'units_sold', 'revenue')),
+            stats,
+        )
+
+    def test_anti_join_uses_the_customer_order_date_index(self):
+        plan = inactive_customers(timezone.now()).explain()
+        self.assertIn('crm_order_customer_date_idx', plan)
+
+
+class GenerateCrmDataTests(TestCase):
+    def snapshot(self):
+        return (
+            list(Customer.objects.order_by('pk').values_list('name', 'email', 'phone')),
+            list(Order.objects.order_by('pk').values_list('customer__email', 'total_amount')),
+            list(OrderLine.objects.order_by('pk').values_list('product__name', 'quantity', 'unit_price')),
+        )
+
+    def test_same_seed_same_dataset(self):
+        out = io.StringIO()
+        call_command('generate_crm_data', customers=50, products=10, orders=300, seed=7, batch_size=64, stdout=out)
+        self.assertIn("Created 50 customers, 10 products, 300 orders", out.getvalue())
+        first = self.snapshot()
+        # Dates are spread over the last year, not stamped with now()
+        self.assertTrue(Order.objects.filter(order_date__lt=timezone.now() - timedelta(days=300)).exists())
+        # Totals match their lines
+        order = Order.objects.first()
+        self.assertEqual(order.total_amount, order.compute_total())
+
+        call_command('generate_crm_data', customers=50, products=10, orders=300, seed=7, flush=True, stdout=out)
+        self.assertEqual(self.snapshot(), first)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.alice = Customer.objects.create(name="Alice Smith", email="alice@example.com")
+        self.bob = Customer.objects.create(name="Bob Alison", email="bob@shop.test")
+        Customer.objects.create(name="Carol", email="carol@example.org")
+        self.lamp = Product.objects.create(name="Desk Lamp", price=Decimal('25.00'), stock=5)
+        self.chair = Product.objects.create(name="Office Chair", price=Decimal('99.00'), stock=5)
+
+    def names(self, field, search, key='name'):
+        result = execute(f'query($q: String) {{ {field}(search: $q) {{ totalCount edges {{ node {{ {key} }} }} }} }}',
+                         variables={'q': search})
+        self.assertIsNone(result.errors)
+        connection_ = result.data[field]
+        names = [edge['node'][key] for edge in connection_['edges']]
+        self.assertEqual(connection_['totalCount'], len(names))
+        return names
+
+    def test_matches_word_prefixes_best_first(self):
+        # Both match "ali"; Alice also matches on her email, so she ranks first
+        self.assertEqual(self.names('allCustomers', 'ali'), ["Alice Smith", "Bob Alison"])
+        self.assertEqual(self.names('allCustomers', 'shop'), ["Bob Alison"])
+        self.assertEqual(self.names('allCustomers', 'alice example'), ["Alice Smith"])
+        self.assertEqual(self.names('allCustomers', '@@'), [])
+
+    def test_index_follows_every_write_path(self):
+        Customer.objects.bulk_create([Customer(name="Dave Lamport", email="dave@example.com")])
+        Customer.objects.filter(pk=self.bob.pk).update(name="Robert")
+        self.alice.delete()
+        self.assertEqual(self.names('allCustomers', 'ali'), [])
+        self.assertEqual(self.names('allCustomers', 'robert'), ["Robert"])
+        self.assertEqual(self.names('allCustomers', 'lamp'), ["Dave Lamport"])
+
+    def test_orders_match_customer_or_product_names(self):
+        place = lambda customer, *products: Order.objects.create(customer=customer).products.add(
+            *products, through_defaults={'unit_price': Decimal('1.00')})
+        place(self.alice, self.lamp)
+        place(self.bob, self.chair)
+        place(self.bob, self.chair, self.lamp)
+        result = execute('query { allOrders(search: "lamp") { edges { node { customer { name } } } } }')
+        self.assertIsNone(result.errors)
+        self.assertEqual([e['node']['customer']['name'] for e in result.data['allOrders']['edges']],
+                         ["Alice Smith", "Bob Alison"])
+        self.assertEqual(self.names('allProducts', 'chair'), ["Office Chair"])
+        result = execute('query { allOrdersKeyset(search: "alison") { edges { node { id } } } }')
+        self.assertEqual(len(result.data['allOrdersKeyset']['edges']), 2)
+
+    def test_range_filters_use_indexes(self):
+        self.assertIn('crm_product_price_idx', Product.objects.filter(price__gte=50).explain())
+        self.assertIn('crm_order_total_amount_idx', Order.objects.filter(total_amount__lte=10).explain())
+
+
+class AggregateTests(TestCase):
+    ORDER = 'mutation($input: OrderInput!) { createOrder(input: $input) { order { id } } }'
+
+    def setUp(self):
+        self.alice = Customer.objects.create(name="Alice", email="alice@example.com")
+        self.bob = Customer.objects.create(name="Bob", email="bob@example.com")
+        self.carol = Customer.objects.create(name="Carol", email="carol@example.com")
+        self.pen = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=100)
+        self.pad = Product.objects.create(name="Pad", price=Decimal('4.00'), stock=100)
+
+    def order(self, customer, **quantities):
+        lines = [{'productId': getattr(self, name).pk, 'quantity': qty} for name, qty in quantities.items()]
+        result = execute(self.ORDER, variables={'input': {'customerId': customer.pk, 'lines': lines}})
+        self.assertIsNone(result.errors)
+
+    def customers(self, order_by=None):
+        result = execute("""query($orderBy: String) { allCustomers(orderBy: $orderBy) { edges { node {
+            name orderCount lifetimeTotal lastOrderDate
+        } } } }""", variables={'orderBy': order_by})
+        self.assertIsNone(result.errors)
+        return [edge['node'] for edge in result.data['allCustomers']['edges']]
+
+    def products(self, order_by=None):
+        result = execute("""query($orderBy: String) { allProducts(orderBy: $orderBy) { edges { node {
+            name timesOrdered unitsSold revenue
+        } } } }""", variables={'orderBy': order_by})
+        self.assertIsNone(result.errors)
+        return [(e['node']['name'], e['node']['timesOrdered'], e['node']['unitsSold'], e['node']['revenue'])
+                for e in result.data['allProducts']['edges']]
+
+    def test_create_order_updates_totals(self):
+        self.order(self.alice, pen=2)
+        self.order(self.bob, pen=1, pad=3)
+        self.order(self.alice, pad=1)
+        alice, bob, carol = self.customers()
+        self.assertEqual((alice['orderCount'], alice['lifetimeTotal']), (2, '7.00'))
+        self.assertEqual((bob['orderCount'], bob['lifetimeTotal']), (1, '13.50'))
+        self.assertEqual((carol['orderCount'], carol['lifetimeTotal'], carol['lastOrderDate']), (0, '0.00', None))
+        latest = Order.objects.filter(customer=self.alice).latest('order_date').order_date
+        self.assertEqual(alice['lastOrderDate'], latest.isoformat())
+        self.assertEqual(self.products(), [('Pen', 2, 3, '4.50'), ('Pad', 2, 4, '16.00')])
+
+        # Price changes don't rewrite history, and a rebuild agrees with the increments
+        Product.objects.filter(pk=self.pad.pk).update(price=Decimal('9.00'))
+        before = self.customers(), self.products()
+        out = io.StringIO()
+        call_command('rebuild_crm_aggregates', stdout=out)
+        self.assertIn("2 customers, 2 products rebuilt", out.getvalue())
+        self.assertEqual((self.customers(), self.products()), before)
+
+    def test_sort_by_totals(self):
+        self.order(self.alice, pen=2)
+        self.order(self.bob, pad=3)
+        self.order(self.bob, pen=1)
+        names = lambda nodes: [node['name'] for node in nodes]
+        self.assertEqual(names(self.customers('-lifetimeTotal')), ["Bob", "Alice", "Carol"])
+        self.assertEqual(names(self.customers('lifetimeTotal')), ["Carol", "Alice", "Bob"])
+        self.assertEqual(names(self.customers('-orderCount,name')), ["Bob", "Alice", "Carol"])
+        self.assertEqual([p[0] for p in self.products('-unitsSold')], ["Pen", "Pad"])
+        self.assertEqual([p[0] for p in self.products('-revenue')], ["Pad", "Pen"])
+        result = execute('query { allCustomers(orderBy: "-phone") { edges { node { id } } } }')
+        self.assertIsNotNone(result.errors)
+
+    def test_totals_are_joined_not_aggregated(self):
+        self.order(self.alice, pen=2)
+        with CaptureQueriesContext(connection) as ctx:
+            self.customers('-lifetimeTotal')
+        # COUNT(*) and the page, with the stats row joined in
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertIn('crm_customerstats', ctx.captured_queries[1]['sql'])
+        self.assertNotIn('crm_order', ctx.captured_queries[1]['sql'])
+
+    def test_cleanup_drops_deleted_orders_from_totals(self):
+        self.order(self.alice, pen=2)
+        self.order(self.bob, pen=1)
+        Customer.objects.filter(pk=self.alice.pk).update(created_at=timezone.now() - timedelta(days=400))
+        Order.objects.filter(customer=self.alice).update(order_date=timezone.now() - timedelta(days=400))
+        call_command('clean_inactive_customers', days=365, stdout=io.StringIO())
+        self.assertEqual(self.products()[0], ('Pen', 1, 1, '1.50'))
+
+
+def current_rss_mb():
+    """Resident set size of this process, or None where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return None
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.ada = Customer.objects.create(name="Ada", email="ada@example.com", phone="+123")
+        self.bob = Customer.objects.create(name="Bob", email="bob@example.com")
+        self.pen = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=100)
+        self.pad = Product.objects.create(name="Pad", price=Decimal('4.00'), stock=100)
+        place_order(self.ada, {self.pen.pk: 2, self.pad.pk: 1})
+        place_order(self.bob, {self.pen.pk: 1})
+
+    def export(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode(), response
+
+    def test_customers_ndjson_with_filters_and_totals(self):
+        Customer.objects.create(name="Cy", email="cy@example.com")
+        body, response = self.export('/crm/customers/export/', order_by='-lifetime_total')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(r['name'], r['order_count'], r['lifetime_total']) for r in rows],
+                         [("Ada", 1, '7.00'), ("Bob", 1, '1.50'), ("Cy", 0, '0.00')])
+        body, _ = self.export('/crm/customers/export/', email='bob', chunk_size=1)
+        self.assertEqual([json.loads(line)['email'] for line in body.splitlines()], ['bob@example.com'])
+
+    def test_orders_csv_with_lines(self):
+        body, response = self.export('/crm/orders/export/', format='csv', lines='1', total_amount__gte='5')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.csv"')
+        header, *rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(header, ['id', 'order_date', 'customer_id', 'customer_name', 'customer_email',
+                                  'total_amount', 'product_id', 'product_name', 'quantity', 'unit_price'])
+        self.assertEqual([row[3:6] + row[7:] for row in rows],
+                         [['Ada', 'ada@example.com', '7.00', 'Pen', '2', '1.50'],
+                          ['Ada', 'ada@example.com', '7.00', 'Pad', '1', '4.00']])
+
+        body, _ = self.export('/crm/orders/export/', lines='1', customer_name='bob')
+        order = json.loads(body)
+        self.assertEqual(order['lines'], [{'product_id': self.pen.pk, 'product_name': 'Pen', 'quantity': 1,
+                                           'unit_price': '1.50'}])
+
+    async def test_asgi_export_streams_chunk_by_chunk(self):
+        read = []
+
+        def counted(*args, **kwargs):
+            for chunk in iter_row_chunks(*args, **kwargs):
+                read.append(len(chunk))
+                yield chunk
+
+        with mock.patch('crm.export.iter_row_chunks', side_effect=counted):
+            response = await self.async_client.get('/crm/customers/export/', {'chunk_size': 1})
+            self.assertTrue(response.is_async)
+            parts = aiter(response.streaming_content)
+            # Past the (empty) NDJSON header to the first row
+            while not (part := await anext(parts)):
+                pass
+            self.assertEqual((json.loads(part)['name'], read), ("Ada", [1]))
+            rest = [part async for part in parts]
+        self.assertEqual(([json.loads(part)['name'] for part in rest], read), (["Bob"], [1, 1]))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/crm/orders/export/', {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/crm/orders/export/', {'chunk_size': '0'}).status_code, 400)
+        response = self.client.get('/crm/customers/export/', {'created_at__gte': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('created_at__gte', response.json()['errors'])
+
+
+class ExportMemoryTests(TestCase):
+    # Set CRM_EXPORT_TEST_ORDERS lower for a quicker run
+    ORDERS = int(os.environ.get('CRM_EXPORT_TEST_ORDERS', 1_000_000))
+
+    def test_large_export_runs_in_constant_memory(self):
+        if current_rss_mb() is None:
+            self.skipTest("needs /proc/self/statm")
+        customers = Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"customer{i}@example.com") for i in range(1000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO crm_order (customer_id, order_date, total_amount) "
+                "WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < %s) "
+                "SELECT %s + n %% 1000, %s, 19.98 FROM seq",
+                [self.ORDERS - 1, customers[0].pk, timezone.now()],
+            )
+        response = self.client.get('/crm/orders/export/')
+        baseline = peak = current_rss_mb()
+        rows = size = 0
+        for i, chunk in enumerate(response.streaming_content):
+            rows += chunk.count(b'\n')
+            size += len(chunk)
+            if i % 20 == 0:
+                peak = max(peak, current_rss_mb())
+        self.assertEqual(rows, self.ORDERS)
+        # The body is ~140 bytes per order; holding it (or the rows) would blow the bound
+        self.assertLess(peak - baseline, 50)
+        if self.ORDERS >= 1_000_000:
+            self.assertGreater(size / 2**20, 100)
+
+
+JOB_CALLS = []
+
+
+@task('tests.record')
+def record_job(value):
+    JOB_CALLS.append(value)
+
+
+@task('tests.fail', max_attempts=3)
+def failing_job():
+    raise ValueError("boom")
+
+
+class JobQueueTests(TestCase):
+    def test_enqueue_is_part_of_the_transaction(self):
+        try:
+            with transaction.atomic():
+                enqueue('tests.record', value=1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(Job.objects.exists())
+        with self.assertRaises(LookupError):
+            enqueue('tests.missing')
+
+    @override_settings(CRM_JOB_RETRY_BACKOFF=10)
+    def test_failed_job_is_retried_with_backoff_then_fails(self):
+        job = enqueue('tests.fail')
+        now = timezone.now()
+        delays = []
+        for attempt in range(3):
+            self.assertEqual(claim('w1', 5, now=now), [job.pk])
+            self.assertEqual(claim('w2', 5, now=now), [])
+            outcome = run_job(job.pk, 'w1')
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt + 1)
+            if attempt < 2:
+                self.assertEqual((outcome, job.status), ('retried', Job.QUEUED))
+                delays.append(round((job.run_at - timezone.now()).total_seconds()))
+                # Not due again until the backoff has passed
+                self.assertEqual(claim('w1', 5, now=timezone.now()), [])
+                now = job.run_at
+        self.assertEqual(delays, [10, 20])
+        self.assertEqual((outcome, job.status), ('failed', Job.FAILED))
+        self.assertIn("ValueError: boom", job.last_error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_cron_task_runs_in_process(self):
+        product = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=3)
+        job = enqueue('crm.update_low_stock')
+        self.assertEqual(claim('w1', 1), [job.pk])
+        with mock.patch('crm.graphql_client.HTTPClient.execute') as http:
+            self.assertEqual(run_job(job.pk, 'w1'), 'succeeded')
+        http.assert_not_called()
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 13)
+
+    @override_settings(CRM_JOB_LEASE=60)
+    def test_lapsed_lease_is_taken_over(self):
+        job = enqueue('tests.record', value='late')
+        now = timezone.now()
+        self.assertEqual(claim('w1', 1, now=now), [job.pk])
+        self.assertEqual(claim('w2', 1, now=now + timedelta(seconds=30)), [])
+        self.assertEqual(claim('w2', 1, now=now + timedelta(seconds=61)), [job.pk])
+        # The first worker's late result doesn't count
+        run_job(job.pk, 'w1')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), (Job.RUNNING, 'w2', 2))
+        self.assertEqual(run_job(job.pk, 'w2'), 'succeeded')
+
+    def test_cron_expressions(self):
+        start = timezone.make_aware(timezone.datetime(2026, 10, 18, 10, 3, 30))  # a Sunday
+        next_after = lambda expression, moment=start: Cron(expression).next_after(moment)
+        self.assertEqual(next_after('*/5 * * * *'), start.replace(minute=5, second=0))
+        self.assertEqual(next_after('0 2 * * 0'), start.replace(day=25, hour=2, minute=0, second=0))
+        self.assertEqual(next_after('0 8 * * *'), start.replace(day=19, hour=8, minute=0, second=0))
+        # Day of month and weekday both set: either matches
+        self.assertEqual(next_after('0 0 1 * 1'), start.replace(day=19, hour=0, minute=0, second=0))
+        self.assertEqual(next_after('0 12 29 2 *').date(), timezone.datetime(2028, 2, 29).date())
+        for expression in ('* * *', '61 * * * *', '*/0 * * * *', 'x * * * *'):
+            with self.assertRaises(ValueError):
+                Cron(expression)
+
+    def test_each_scheduled_tick_is_enqueued_once(self):
+        schedule = [('*/5 * * * *', 'tests.record', {'value': 'tick'})]
+        now = timezone.now().replace(minute=2, second=0, microsecond=0)
+        self.assertEqual(enqueue_due(now, schedule), [])
+        tick = JobSchedule.objects.get().next_run_at
+        self.assertEqual(tick, now.replace(minute=5))
+        # Several workers polling after the tick (and a missed one) enqueue it once
+        later = now.replace(minute=12)
+        jobs = enqueue_due(later, schedule) + enqueue_due(later, schedule)
+        self.assertEqual([(job.run_at, job.kwargs) for job in jobs], [(tick, {'value': 'tick'})])
+        self.assertEqual(JobSchedule.objects.get().next_run_at, now.replace(minute=15))
+
+    def test_stats_report_depth_throughput_and_lag(self):
+        now = timezone.now()
+        enqueue('tests.record', value=1, run_at=now - timedelta(seconds=30))
+        enqueue('tests.record', value=2, run_at=now + timedelta(hours=1))
+        done = enqueue('tests.record', value=3, run_at=now - timedelta(seconds=10))
+        Job.objects.filter(pk=done.pk).update(
+            status=Job.SUCCEEDED, started_at=now - timedelta(seconds=6), finished_at=now - timedelta(seconds=5),
+        )
+        stats = job_stats(timedelta(minutes=1), now=now)
+        self.assertEqual((stats['queued'], stats['due'], stats['succeeded']), (2, 1, 1))
+        self.assertEqual(stats['succeeded_in_window'], 1)
+        self.assertEqual(stats['throughput_per_minute'], 1)
+        self.assertAlmostEqual(stats['oldest_due_seconds'], 30, places=3)
+        self.assertAlmostEqual(stats['avg_start_lag_seconds'], 4, places=3)
+
+
+class JobWorkerTests(TransactionTestCase):
+    def setUp(self):
+        JOB_CALLS.clear()
+
+    def test_thread_pool_runs_queued_jobs(self):
+        for i in range(10):
+            enqueue('tests.record', value=i)
+        enqueue('tests.record', value='later', run_at=timezone.now() + timedelta(hours=1))
+        outcomes = Worker(concurrency=4, poll_interval=0.05, schedule=()).run(burst=True)
+        self.assertEqual(outcomes, {'succeeded': 10})
+        self.assertEqual(sorted(JOB_CALLS), list(range(10)))
+        stats = job_stats()
+        self.assertEqual((stats['succeeded_in_window'], stats['queued'], stats['running']), (10, 1, 0))
+
+    def test_process_pool_and_command(self):
+        seed_orders(customers=3, orders_per_customer=2)
+        enqueue('crm.rebuild_aggregates')
+        with self.assertRaisesMessage(CommandError, "LocMemCache"):
+            call_command('run_crm_worker', '--burst', stdout=io.StringIO())
+        out = io.StringIO()
+        with override_settings(GRAPHQL_RESPONSE_CACHE=None):
+            call_command('run_crm_worker', '--burst', '--no-schedule', '--pool', 'process', '--concurrency', '2',
+                         stdout=out)
+        self.assertIn("1 succeeded", out.getvalue())
+        self.assertEqual(CustomerStats.objects.count(), 3)
+        out = io.StringIO()
+        call_command('crm_job_stats', '--json', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['succeeded'], 1)
+
+
+class StockReservationTests(TransactionTestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        self.pen = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=10)
+        self.pad = Product.objects.create(name="Pad", price=Decimal('4.00'), stock=5)
+        self.engine = StockEngine(shards=4)
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.stock
+
+    def test_reserves_in_memory_and_flushes_net_deltas(self):
+        first = place_order(self.customer, {self.pen.pk: 3, self.pad.pk: 1}, engine=self.engine)
+        place_order(self.customer, {self.pen.pk: 2}, engine=self.engine)
+        self.assertTrue(first.stock_pending)
+        self.assertEqual((self.stock(self.pen), self.stock(self.pad)), (10, 5))
+        self.assertEqual(self.engine.availability([self.pen.pk]), {self.pen.pk: (5, 0, 5)})
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.engine.flush(), 2)
+        product_updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "crm_product"')]
+        self.assertEqual(len(product_updates), 1)
+        self.assertEqual((self.stock(self.pen), self.stock(self.pad)), (5, 4))
+        self.assertFalse(Order.objects.filter(stock_pending=True).exists())
+        self.assertEqual(self.engine.availability([self.pen.pk]), {self.pen.pk: (5, 0, 0)})
+        # Orders still total like the database path's
+        self.assertEqual(first.total_amount, Decimal('8.50'))
+
+    def test_shortfall_and_failed_writes_give_the_stock_back(self):
+        with self.assertRaisesMessage(InsufficientStock, "Pad"):
+            place_order(self.customer, {self.pen.pk: 1, self.pad.pk: 6}, engine=self.engine)
+        with mock.patch('crm.orders.create_order', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                place_order(self.customer, {self.pen.pk: 4}, engine=self.engine)
+        self.assertEqual(self.engine.availability([self.pen.pk, self.pad.pk]),
+                         {self.pen.pk: (10, 0, 0), self.pad.pk: (5, 0, 0)})
+
+    def test_concurrent_orders_never_oversell(self):
+        outcomes = []
+
+        def buy():
+            for _ in range(10):
+                try:
+                    place_order(self.customer, {self.pen.pk: 1}, engine=self.engine)
+                    outcomes.append(True)
+                except InsufficientStock:
+                    outcomes.append(False)
+            connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(outcomes.count(True), 10)
+        self.engine.flush()
+        self.assertEqual(self.stock(self.pen), 0)
+
+    def test_flush_picks_up_restocks(self):
+        place_order(self.customer, {self.pen.pk: 4}, engine=self.engine)
+        Product.objects.filter(pk=self.pen.pk).update(stock=F('stock') + 10)
+        self.engine.flush()
+        self.assertEqual(self.engine.availability([self.pen.pk]), {self.pen.pk: (16, 0, 0)})
+
+    def test_orders_in_a_transaction_count_unflushed_reservations(self):
+        place_order(self.customer, {self.pen.pk: 8}, engine=self.engine)
+        # e.g. an atomic batch: the stock is taken off Product.stock directly
+        with self.assertRaisesMessage(InsufficientStock, "Pen"), transaction.atomic():
+            place_order(self.customer, {self.pen.pk: 5}, engine=self.engine)
+        with transaction.atomic():
+            place_order(self.customer, {self.pen.pk: 2}, engine=self.engine)
+        self.assertEqual(self.stock(self.pen), 8)
+        self.assertEqual(self.engine.availability([self.pen.pk]), {self.pen.pk: (0, 0, 8)})
+        with self.assertRaises(InsufficientStock):
+            place_order(self.customer, {self.pen.pk: 1}, engine=self.engine)
+        self.engine.flush()
+        self.assertEqual(self.stock(self.pen), 0)
+        self.assertEqual(self.engine.availability([self.pen.pk]), {self.pen.pk: (0, 0, 0)})
+
+    def test_flush_never_takes_stock_below_zero(self):
+        place_order(self.customer, {self.pen.pk: 8}, engine=self.engine)
+        # Written behind the engine's back
+        Product.objects.filter(pk=self.pen.pk).update(stock=5)
+        with self.assertLogs('crm.reservations', 'ERROR'):
+            self.engine.flush()
+        self.assertEqual(self.stock(self.pen), 0)
+
+    def test_reconcile_applies_unflushed_orders_once(self):
+        place_order(self.customer, {self.pen.pk: 3}, engine=self.engine)
+        place_order(self.customer, {self.pen.pk: 1, self.pad.pk: 2}, engine=self.engine)
+        # The process "crashed" before flushing; the next start reconciles
+        self.assertEqual(reconcile_stock(), {self.pen.pk: 4, self.pad.pk: 2})
+        self.assertEqual(reconcile_stock(), {})
+        # A late flush from the old engine doesn't apply them again
+        self.engine.flush()
+        self.assertEqual((self.stock(self.pen), self.stock(self.pad)), (6, 3))
+
+    def test_create_order_and_check_availability_mutations(self):
+        mutation = """
+            mutation($customer: ID!, $product: ID!) {
+                createOrder(input: {customerId: $customer, lines: [{productId: $product, quantity: 2}]}) {
+                    order { totalAmount }
+                }
+                checkStockAvailability(productIds: [$product]) { availability { productId available reserved pending } }
+            }
+        """
+        variables = {'customer': self.customer.pk, 'product': self.pen.pk}
+        with mock.patch('crm.schema.get_engine', return_value=self.engine):
+            result = schema.execute(mutation, variable_values=variables, context_value=RequestFactory().post('/'))
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['checkStockAvailability']['availability'], [
+            {'productId': str(self.pen.pk), 'available': 8, 'reserved': 0, 'pending': 2},
+        ])
+        self.assertEqual(self.stock(self.pen), 10)
+        # Without the engine, the stock field is the live number
+        result = schema.execute(mutation, variable_values=variables, context_value=RequestFactory().post('/'))
+        self.assertEqual(result.data['checkStockAvailability']['availability'][0]['available'], 8)
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.head = changes_since()[1]
+        self.ada = Customer.objects.create(name="Ada", email="ada@example.com")
+        self.pen = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=10)
+
+    def feed(self, cursor, first=100):
+        changes, cursor, has_more = changes_since(cursor, first)
+        return [(c.model, c.object_id, c.deleted) for c in changes], cursor, has_more
+
+    def test_writes_that_skip_save_bump_updated_at(self):
+        past = timezone.now() - timedelta(days=1)
+        Product.objects.filter(pk=self.pen.pk).update(updated_at=past)
+        Product.objects.filter(pk=self.pen.pk).update(stock=F('stock') + 1)
+        self.pen.refresh_from_db()
+        self.assertGreater(self.pen.updated_at, past)
+        # save() sets it itself
+        self.ada.name = "Ada L."
+        self.ada.save()
+        self.assertEqual(Customer.objects.get(pk=self.ada.pk).updated_at, self.ada.updated_at)
+
+    def test_feed_returns_each_changed_object_once_with_tombstones(self):
+        bob = Customer.objects.create(name="Bob", email="bob@example.com")
+        order = place_order(bob, {self.pen.pk: 2})
+        Product.objects.filter(pk=self.pen.pk).update(price=Decimal('2.00'))
+        # The stock flag is bookkeeping, not a change
+        Order.objects.filter(pk=order.pk).update(stock_pending=True)
+        bob_pk = bob.pk
+        bob.delete()
+        changes, cursor, has_more = changes_since(self.head)
+        self.assertFalse(has_more)
+        self.assertEqual([(c.model, c.object_id, c.deleted) for c in changes], [
+            ('customer', self.ada.pk, False),
+            ('product', self.pen.pk, False),
+            ('order', order.pk, True),
+            ('customer', bob_pk, True),
+        ])
+        self.assertEqual(changes[1].instance.price, Decimal('2.00'))
+        self.assertEqual(self.feed(cursor), ([], cursor, False))
+        # Paging
+        first, cursor, has_more = self.feed(self.head, first=2)
+        self.assertEqual((first, has_more), ([('customer', self.ada.pk, False), ('product', self.pen.pk, False)], True))
+        self.assertEqual(self.feed(cursor)[0][-1], ('customer', bob_pk, True))
+
+    def test_cleanup_cascade_is_logged(self):
+        order = place_order(self.ada, {self.pen.pk: 1})
+        Customer.objects.filter(pk=self.ada.pk).update(created_at=timezone.now() - timedelta(days=800))
+        Order.objects.filter(pk=order.pk).update(order_date=timezone.now() - timedelta(days=700))
+        cursor = changes_since()[1]
+        call_command('clean_inactive_customers', stdout=io.StringIO())
+        self.assertEqual(self.feed(cursor)[0], [('order', order.pk, True), ('customer', self.ada.pk, True)])
+
+    def test_pruned_cursor_is_refused(self):
+        Change.objects.update(changed_at=timezone.now() - timedelta(days=40))
+        Product.objects.create(name="Pad", price=Decimal('4.00'), stock=1)
+        self.assertEqual(prune_changes(30), 2)
+        with self.assertRaises(ExpiredCursor):
+            changes_since(self.head)
+
+    def test_graphql_changes_since_and_updated_since(self):
+        query = """
+            query($cursor: String) {
+                changesSince(cursor: $cursor, first: 10) {
+                    cursor hasMore changes { sequence model objectId deleted product { name stock } }
+                }
+            }
+        """
+        head = schema.execute(query, context_value=RequestFactory().post('/')).data['changesSince']
+        self.assertEqual(head['changes'], [])
+        Product.objects.filter(pk=self.pen.pk).update(stock=3)
+        result = schema.execute(query, variable_values={'cursor': head['cursor']}, context_value=RequestFactory().post('/'))
+        self.assertIsNone(result.errors)
+        changes = result.data['changesSince']['changes']
+        self.assertEqual([(c['model'], c['product']) for c in changes], [('product', {'name': 'Pen', 'stock': 3})])
+        since = (timezone.now() - timedelta(minutes=1)).isoformat()
+        result = schema.execute(
+            'query($since: DateTime) { allProducts(updatedSince: $since) { totalCount } }',
+            variable_values={'since': since}, context_value=RequestFactory().post('/'),
+        )
+        self.assertEqual(result.data['allProducts']['totalCount'], 1)
+
+
+ORDER_CREATED_SUBSCRIPTION = """
+    subscription { orderCreated { totalAmount customer { email orderCount } lines { quantity product { name } } } }
+"""
+LOW_STOCK_SUBSCRIPTION = "subscription($threshold: Int) { stockChanged(threshold: $threshold) { name stock } }"
+CREATE_ORDER = """
+    mutation($customer: ID!, $product: ID!, $quantity: Int!) {
+        createOrder(input: {customerId: $customer, lines: [{productId: $product, quantity: $quantity}]}) { order { id } }
+    }
+"""
+
+
+class InProcessWebSocket:
+    """A client for an ASGI websocket app in the same event loop, for these
+    tests and ``benchmarks.subscriptions``."""
+
+    def __init__(self, app, path='/graphql/', subprotocols=(PROTOCOL,)):
+        self.app = app
+        self.scope = {
+            'type': 'websocket', 'path': path, 'subprotocols': list(subprotocols),
+            'headers': [], 'query_string': b'',
+        }
+        self.to_app = asyncio.Queue()
+        self.from_app = asyncio.Queue()
+        self.task = None
+        self.close_code = None
+
+    async def connect(self):
+        """True if the app accepted the connection."""
+        self.task = asyncio.ensure_future(self.app(self.scope, self.to_app.get, self.from_app.put))
+        await self.to_app.put({'type': 'websocket.connect'})
+        message = await self.from_app.get()
+        if message['type'] == 'websocket.close':
+            self.close_code = message['code']
+            return False
+        return True
+
+    async def send_json(self, data):
+        await self.to_app.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self, timeout=5):
+        """The next message, or ``None`` once the app closed the connection."""
+        message = await asyncio.wait_for(self.from_app.get(), timeout)
+        if message['type'] == 'websocket.close':
+            self.close_code = message['code']
+            return None
+        return json.loads(message['text'])
+
+    async def disconnect(self):
+        if self.task is not None and not self.task.done():
+            await self.to_app.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self.task
+
+
+class SubscriptionTests(TransactionTestCase):
+    def setUp(self):
+        self.app = GraphQLWebSocketApp()
+        self.ada = Customer.objects.create(name="Ada", email="ada@example.com")
+        self.pen = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=10)
+
+    async def connect(self):
+        socket = InProcessWebSocket(self.app)
+        self.assertTrue(await socket.connect())
+        await socket.send_json({'type': 'connection_init'})
+        self.assertEqual(await socket.receive_json(), {'type': 'connection_ack'})
+        return socket
+
+    async def order(self, quantity):
+        result = await sync_to_async(execute)(
+            CREATE_ORDER, variable_values={'customer': self.ada.pk, 'product': self.pen.pk, 'quantity': quantity},
+        )
+        self.assertIsNone(result.errors)
+
+    async def test_subscribers_share_one_stream_per_query(self):
+        dashboards = [await self.connect() for _ in range(3)]
+        for socket in dashboards:
+            await socket.send_json({'id': 'orders', 'type': 'subscribe', 'payload': {'query': ORDER_CREATED_SUBSCRIPTION}})
+        await dashboards[0].send_json({'id': 'low', 'type': 'subscribe', 'payload': {
+            'query': LOW_STOCK_SUBSCRIPTION, 'variables': {'threshold': 5},
+        }})
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.app.groups), 2)
+        self.assertEqual(hub.subscriber_count(ORDER_CREATED), 1)
+
+        await self.order(6)
+        for socket in dashboards:
+            messages = [await socket.receive_json() for _ in range(2 if socket is dashboards[0] else 1)]
+            created = next(message for message in messages if message['id'] == 'orders')
+            self.assertEqual(created['payload']['data']['orderCreated'], {
+                'totalAmount': '9.00', 'customer': {'email': 'ada@example.com', 'orderCount': 1},
+                'lines': [{'quantity': 6, 'product': {'name': 'Pen'}}],
+            })
+        # Above the threshold after the restock: nothing until the next order
+        result = await sync_to_async(execute)("mutation { updateLowStockProducts(threshold: 5, increment: 10) { updatedCount } }")
+        self.assertEqual(result.data['updateLowStockProducts']['updatedCount'], 1)
+        await self.order(10)
+        low = [message for message in [await dashboards[0].receive_json() for _ in range(2)] if message['id'] == 'low']
+        self.assertEqual(low, [{'id': 'low', 'type': 'next', 'payload': {'data': {'stockChanged': {'name': 'Pen', 'stock': 4}}}}])
+
+        await dashboards[0].send_json({'id': 'low', 'type': 'complete'})
+        for socket in dashboards:
+            await socket.disconnect()
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.app.groups, {})
+        self.assertEqual((hub.subscriber_count(ORDER_CREATED), hub.subscriber_count(STOCK_CHANGED)), (0, 0))
+
+    async def test_protocol_errors(self):
+        refused = InProcessWebSocket(self.app, subprotocols=('graphql-ws',))
+        self.assertFalse(await refused.connect())
+
+        early = InProcessWebSocket(self.app)
+        await early.connect()
+        await early.send_json({'id': '1', 'type': 'subscribe', 'payload': {'query': ORDER_CREATED_SUBSCRIPTION}})
+        self.assertIsNone(await early.receive_json())
+        self.assertEqual(early.close_code, 4401)
+        await early.disconnect()
+
+        socket = await self.connect()
+        await socket.send_json({'type': 'ping'})
+        self.assertEqual(await socket.receive_json(), {'type': 'pong'})
+        await socket.send_json({'id': '1', 'type': 'subscribe', 'payload': {'query': '{ allProducts { totalCount } }'}})
+        error = await socket.receive_json()
+        self.assertEqual(error['type'], 'error')
+        self.assertIn("Only subscriptions", error['payload'][0]['message'])
+        await socket.send_json({'id': '2', 'type': 'subscribe', 'payload': {'query': 'subscription { nope }'}})
+        self.assertEqual((await socket.receive_json())['type'], 'error')
+        await socket.disconnect()
+
+    async def test_rolled_back_writes_publish_nothing(self):
+        async with subscribe('test') as messages:
+            def write(fail):
+                with transaction.atomic():
+                    publish('test', {'fail': fail})
+                    if fail:
+                        transaction.set_rollback(True)
+            await sync_to_async(write)(True)
+            await sync_to_async(write)(False)
+            self.assertEqual(await asyncio.wait_for(messages.get(), 1), {'fail': False})
+            self.assertEqual(len(messages.messages), 0)
+
+    async def test_slow_readers_are_cut_off(self):
+        async with subscribe('test', max_queue=2) as messages:
+            for i in range(3):
+                hub.deliver('test', i)
+            with self.assertRaises(SubscriptionOverflow):
+                await messages.get()
+        with override_settings(GRAPHQL_WS_OUTBOX=2):
+            socket = Socket(self.app, send=None)
+        for i in range(3):
+            socket.push(str(i))
+        self.assertEqual((socket.close_code, len(socket.outbox)), (1013, 0))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_REPLICA_CHECK_INTERVAL=0)
+class ReplicaRoutingTests(TransactionTestCase):
+    # Resolved in setUpClass, once the replica is registered
+    databases = '__all__'
+    NAMES = "query { allProducts { edges { node { name } } } }"
+    CREATE = 'mutation { createProduct(input: {name: "Ink", price: 2}) { product { name } } }'
+
+    @classmethod
+    def setUpClass(cls):
+        # A SQLite copy of the test database stands in for a replica
+        fd, cls.replica_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        connections.settings['replica'] = {**connections['default'].settings_dict, 'NAME': cls.replica_path}
+        cls.addClassCleanup(cls.remove_replica)
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        os.remove(cls.replica_path)
+
+    def setUp(self):
+        caches['graphql'].clear()
+        # A pool with no health checks cached
+        self.enterContext(mock.patch.dict('alx_backend_graphql.routing._pools', clear=True))
+        connections['replica'].close()
+        open(self.replica_path, 'wb').close()
+        Product.objects.create(name="Pen", price=Decimal('1.50'), stock=10)
+
+    def post(self, query, client=None):
+        response = (client or self.client).post('/graphql/', data={'query': query}, content_type='application/json')
+        body = response.json()
+        self.assertNotIn('errors', body)
+        return body, response
+
+    def names(self, client=None):
+        body, _ = self.post(self.NAMES, client)
+        return [edge['node']['name'] for edge in body['data']['allProducts']['edges']]
+
+    def test_queries_read_the_replica_until_the_client_writes(self):
+        sync_sqlite_replicas()
+        Product.objects.create(name="Eraser", price=Decimal('0.50'), stock=10)
+        self.assertEqual(self.names(), ["Pen"])
+
+        _, response = self.post(self.CREATE)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 5)
+        # Read-your-writes for the writer; the others may still lag
+        self.assertEqual(self.names(self.client_class()), ["Pen"])
+        self.assertEqual(self.names(), ["Pen", "Eraser", "Ink"])
+
+        sync_sqlite_replicas()
+        self.assertEqual(self.names(self.client_class()), ["Pen", "Eraser", "Ink"])
+
+    def test_operations_after_a_mutation_in_a_batch_read_the_primary(self):
+        sync_sqlite_replicas()
+        response = self.client.post('/graphql/', data=[
+            {'query': self.NAMES}, {'query': self.CREATE}, {'query': self.NAMES},
+        ], content_type='application/json')
+        before, _, after = response.json()
+        self.assertEqual(len(before['data']['allProducts']['edges']), 1)
+        self.assertEqual(len(after['data']['allProducts']['edges']), 2)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+    def test_unsynced_replica_is_skipped(self):
+        # An empty file, then a schema with no migrations recorded
+        self.assertEqual(self.names(), ["Pen"])
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('CREATE TABLE django_migrations (id integer)')
+        self.assertEqual(self.names(), ["Pen"])
+        with ReadRouting() as reads:
+            self.assertEqual(Product.objects.count(), 1)
+        self.assertIsNone(reads.alias)
+
+        sync_sqlite_replicas()
+        with self.assertLogs('alx_backend_graphql.routing', 'WARNING') as logs, ReadRouting() as reads:
+            self.assertEqual(Product.objects.count(), 1)
+        self.assertEqual(reads.alias, 'replica')
+        self.assertEqual(logs.output, ["WARNING:alx_backend_graphql.routing:Replica replica is back"])
+
+    def test_reads_in_transactions_and_writes_use_the_primary(self):
+        sync_sqlite_replicas()
+        with ReadRouting() as reads:
+            pen = Product.objects.get()
+            self.assertEqual(pen._state.db, 'replica')
+            pen.stock = 9
+            pen.save()
+            with transaction.atomic():
+                self.assertEqual(Product.objects.get().stock, 9)
+        self.assertEqual(Product.objects.using('replica').get().stock, 10)
+        with ReadRouting(replicas=False) as reads:
+            self.assertEqual(Product.objects.get()._state.db, 'default')
+        self.assertIsNone(reads.alias)
+
+    def test_responses_read_from_a_replica_after_an_invalidation_are_not_cached(self):
+        sync_sqlite_replicas()
+        body, _ = self.post(self.NAMES)
+        self.assertNotIn('cacheControl', body.get('extensions', {}))
+        with override_settings(DATABASE_REPLICA_MAX_LAG=0):
+            body, _ = self.post(self.NAMES)
+        self.assertEqual(body['extensions']['cacheControl']['hit'], False)
+        body, _ = self.post(self.NAMES)
+        self.assertEqual(body['extensions']['cacheControl']['hit'], True)
+
+    def test_pool_takes_healthy_replicas_in_turn(self):
+        pool = ReplicaPool(['a', 'b', 'c'], check_interval=60)
+        with mock.patch('alx_backend_graphql.routing.check_replica', side_effect=lambda alias: alias != 'b') as check:
+            self.assertEqual([pool.choose() for _ in range(4)], ['a', 'c', 'c', 'a'])
+        # Checked once each, then cached
+        self.assertEqual(check.call_count, 3)
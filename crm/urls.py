@@ -0,0 +1,9 @@
+from django.urls import path
+
+from crm import views
+
+urlpatterns = [
+    path('customers/import/', views.import_customers, name='import_customers'),
+    path('customers/export/', views.export_customers, name='export_customers'),
+    path('orders/export/', views.export_orders, name='export_orders'),
+]
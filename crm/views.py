@@ -1,3 +1,104 @@
-from django.shortcuts import render
+import json
 
-# Create your views here.
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from crm.bulk import BULK_CHUNK_SIZE, iter_bulk_create_customers
+from crm.export import (
+    CUSTOMER_COLUMNS, CUSTOMER_DEFAULTS, EXPORT_CHUNK_SIZE, FORMATS, LINE_COLUMNS, ORDER_COLUMNS, aiter_export,
+    iter_export,
+)
+from crm.filters import CustomerFilter, OrderFilter
+from crm.models import Customer, Order
+
+
+def iter_ndjson(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def get_chunk_size(request, default):
+    """``(chunk_size, error_response)`` from the ``chunk_size`` query parameter."""
+    try:
+        chunk_size = int(request.GET.get('chunk_size', default))
+    except ValueError:
+        return None, JsonResponse({'error': 'chunk_size must be an integer'}, status=400)
+    if chunk_size <= 0:
+        return None, JsonResponse({'error': 'chunk_size must be positive'}, status=400)
+    return chunk_size, None
+
+
+@csrf_exempt
+@require_POST
+def import_customers(request):
+    """Stream an NDJSON body of customers into the database chunk by chunk.
+
+    The body is read line by line, so batches far larger than a single
+    GraphQL payload can be imported in constant memory. Each chunk commits
+    on its own and its result is streamed back as one NDJSON line.
+    """
+    chunk_size, error = get_chunk_size(request, BULK_CHUNK_SIZE)
+    if error is not None:
+        return error
+
+    def results():
+        total_created = total_errors = 0
+        try:
+            for created, errors in iter_bulk_create_customers(iter_ndjson(request), chunk_size):
+                total_created += len(created)
+                total_errors += len(errors)
+                yield json.dumps({'created': len(created), 'errors': errors}) + '\n'
+        except ValueError as e:
+            yield json.dumps({'error': f"Invalid NDJSON: {e}"}) + '\n'
+        yield json.dumps({'done': True, 'created': total_created, 'errors': total_errors}) + '\n'
+
+    return StreamingHttpResponse(results(), content_type='application/x-ndjson')
+
+
+def export_response(request, filterset_class, queryset, columns, name, lines=False, defaults=None):
+    output_class = FORMATS.get(request.GET.get('format', 'ndjson'))
+    if output_class is None:
+        return JsonResponse({'error': f"format must be one of {', '.join(FORMATS)}"}, status=400)
+    chunk_size, error = get_chunk_size(request, EXPORT_CHUNK_SIZE)
+    if error is not None:
+        return error
+    filterset = filterset_class(request.GET, queryset=queryset)
+    if not filterset.is_valid():
+        return JsonResponse({'errors': filterset.errors}, status=400)
+    queryset = filterset.qs
+    if not queryset.query.order_by:
+        queryset = queryset.order_by('pk')
+
+    output = output_class(columns, LINE_COLUMNS if lines else None)
+    stream = aiter_export if isinstance(request, ASGIRequest) else iter_export
+    response = StreamingHttpResponse(
+        stream(queryset, columns, output, chunk_size, lines, defaults), content_type=output.content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{name}.{output.extension}"'
+    return response
+
+
+@require_GET
+def export_customers(request):
+    """Stream every customer matching the ``CustomerFilter`` parameters.
+
+    ``format`` is ``ndjson`` (default) or ``csv``; rows are read and encoded
+    ``chunk_size`` at a time, so the export runs in constant memory.
+    """
+    return export_response(
+        request, CustomerFilter, Customer.objects.all(), CUSTOMER_COLUMNS, 'customers', defaults=CUSTOMER_DEFAULTS,
+    )
+
+
+@require_GET
+def export_orders(request):
+    """Stream every order matching the ``OrderFilter`` parameters, with its
+    customer and, given ``lines=1``, its lines. Same formats as customers."""
+    return export_response(
+        request, OrderFilter, Order.objects.all(), ORDER_COLUMNS, 'orders',
+        lines=request.GET.get('lines') in ('1', 'true'),
+    )